@@ -0,0 +1,108 @@
+import os
+from collections import namedtuple
+
+import numpy as np
+import pygame
+
+from renderer import BudgetImage
+
+# Set this to 1 to store assets in as little memory as the surface backend can draw them from
+BUDGET_ENV_VAR = "WORKOUT_DISPLAY_MEMORY_BUDGET"
+
+# Crop an image to its visible pixels when they fit in a box under this fraction of its area
+CROP_BELOW = 0.75
+# RLE-accelerate images with at least this fraction of fully transparent pixels; the RLE data
+# lives next to the pixels, so it only pays for itself when it saves blit time on long runs
+RLE_TRANSPARENT = 0.3
+
+# What one asset costs: pixel bytes when converted whole and as stored, and how it is stored
+AssetReport = namedtuple("AssetReport", ["name", "size", "storage", "full_bytes", "stored_bytes"])
+
+# Reports of the assets loaded last, for the metrics endpoint
+reports = []
+
+
+def enabled():
+    return os.environ.get(BUDGET_ENV_VAR, "") not in ("", "0")
+
+
+def analyse(surface):
+    """Alpha statistics of an image: fractions of transparent, opaque and in-between pixels,
+    and the bounding box of its visible pixels."""
+    if not surface.get_flags() & pygame.SRCALPHA:
+        return {"transparent": 0.0, "opaque": 1.0, "partial": 0.0, "bounds": surface.get_rect()}
+    alpha = pygame.surfarray.array_alpha(surface)
+    pixels = alpha.size
+    transparent = np.count_nonzero(alpha == 0) / pixels
+    opaque = np.count_nonzero(alpha == 255) / pixels
+    return {"transparent": transparent, "opaque": opaque, "partial": 1.0 - transparent - opaque,
+            "bounds": surface.get_bounding_rect()}
+
+
+def _unused_color(surface):
+    """A color no pixel of the surface has, for its colorkey."""
+    rgb = pygame.surfarray.array3d(surface).reshape(-1, 3).astype(np.int32)
+    used = np.unique(rgb[:, 0] << 16 | rgb[:, 1] << 8 | rgb[:, 2])
+    for candidate in (0xFF00FF, 0x00FF00, 0x010203):
+        if not np.isin(candidate, used):
+            return (candidate >> 16, candidate >> 8 & 0xFF, candidate & 0xFF)
+    # Otherwise the lowest color not in use; an image this size cannot use all 16M
+    missing = int(np.setdiff1d(np.arange(len(used) + 1), used)[0])
+    return (missing >> 16, missing >> 8 & 0xFF, missing & 0xFF)
+
+
+def prepare(backend, name, surface):
+    """Load one decoded asset the cheapest way the surface backend can still draw it.
+
+    Images whose visible pixels fill only part of them are cropped to those, with their offset;
+    images with only fully transparent and opaque pixels lose their alpha channel for a colorkey;
+    mostly transparent images are RLE-accelerated. Returns the loaded image and its AssetReport.
+    """
+    stats = analyse(surface)
+    loaded = backend.load(surface)
+    full_bytes = loaded.get_pitch() * loaded.get_height()
+    width, height = surface.get_size()
+    bounds = stats["bounds"]
+    storage = []
+
+    offset = (0, 0)
+    cropped = bounds.width * bounds.height < CROP_BELOW * width * height
+    if cropped:
+        # A copy, not a subsurface, so the full pixels can be freed
+        loaded = loaded.subsurface(bounds).copy()
+        offset = bounds.topleft
+        storage.append(f"cropped to {bounds.width}x{bounds.height} at {offset}")
+
+    if stats["transparent"] and not stats["partial"]:
+        key = _unused_color(loaded)
+        keyed = pygame.Surface(loaded.get_size()).convert()
+        keyed.fill(key)
+        keyed.blit(loaded, (0, 0))
+        keyed.set_colorkey(key)
+        loaded = keyed
+        storage.append("colorkey")
+
+    rle = stats["transparent"] >= RLE_TRANSPARENT
+    if rle:
+        storage.append("RLE when not rotated")
+
+    stored_bytes = loaded.get_pitch() * loaded.get_height()
+    image = BudgetImage(loaded, offset, (width, height), rle) if cropped or rle else loaded
+    return image, AssetReport(name, (width, height), ", ".join(storage) or "full", full_bytes, stored_bytes)
+
+
+def load_budgeted(backend, surfaces):
+    """Load decoded assets by name with prepare() and print what each costs; returns the images."""
+    images = {}
+    del reports[:]
+    for name, surface in surfaces.items():
+        images[name], report = prepare(backend, name, surface)
+        reports.append(report)
+    print("Asset memory:")
+    for report in reports:
+        print(f"  {report.name:<18} {report.size[0]}x{report.size[1]:<5} {report.full_bytes / 1024:8.0f} KiB -> "
+              f"{report.stored_bytes / 1024:6.0f} KiB  {report.storage}")
+    full = sum(report.full_bytes for report in reports)
+    stored = sum(report.stored_bytes for report in reports)
+    print(f"  {'total':<24} {full / 1024:8.0f} KiB -> {stored / 1024:6.0f} KiB")
+    return images
@@ -0,0 +1,26 @@
+import os
+
+
+def source_key(path):
+    """The part of a cache file name that ties it to one version of its source file."""
+    # Source mtime is part of the key so an edited or re-exported source invalidates old copies
+    stat = os.stat(path)
+    return f"{int(stat.st_mtime)}-{stat.st_size}"
+
+
+def write_atomic(path, write, suffix=None):
+    """Call write(temp) to produce a file, then move it into place as `path`.
+
+    `suffix` ends the temp name (default `path`'s extension), for writers that pick the format
+    from it or append their own.
+    """
+    # Write to a per-process temp name first so a crash or a concurrent process never leaves
+    # a truncated file under the real name
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if suffix is None:
+        suffix = os.path.splitext(path)[1]
+    temp = f"{path}.{os.getpid()}.tmp{suffix}"
+    write(temp)
+    os.replace(temp, path)
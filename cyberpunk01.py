@@ -1,34 +1,73 @@
 import pygame
 import math
 import sys
-from collections import deque
-from threading import Thread, Event, Lock
-import queue  # For thread-safe communication
-from openant.easy.node import Node
-from openant.devices import ANTPLUS_NETWORK_KEY
-from openant.devices.heart_rate import HeartRate, HeartRateData
-from openant.devices.power_meter import PowerMeter, PowerData
-
-# Initialize Pygame
-pygame.init()
-screen = pygame.display.set_mode((1368, 768), pygame.FULLSCREEN)
-pygame.display.set_caption("Heart Rate and Power Display")
-clock = pygame.time.Clock()
-
-# Load overlay image
-overlay_image = pygame.image.load("cyberpunk768.png")
+from collections import deque, namedtuple
+import launcher
+import latency
+import metrics
+import ghost
+import sensors
+import wbal
+import workout
+from governor import FrameGovernor
+from stripchart import StripChart
+
+# Reference layout the overlay artwork and arc geometry were drawn for
+REFERENCE_SIZE = (1368, 768)
+CAPTION = "Heart Rate and Power Display"
+FULLSCREEN = True
+FPS = 30
+
+# The arcs are drawn with pygame.draw, so this display needs the surface backend
+BACKENDS = ("surface",)
+
+# Overlay image, loaded on the launcher's thread pool and pre-scaled to the screen size
+ASSETS = {"overlay": "cyberpunk768.png"}
 
 # Colors
 RED = (163, 0, 0)
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 CYAN = (10,196,169)
+YELLOW = (240, 200, 40)
+GHOST = (190, 110, 255)
+LOW_BALANCE_COLOR = (255, 90, 70)
+
+# W' balance text turns LOW_BALANCE_COLOR below this fraction of W'
+LOW_BALANCE = 0.25
 
 # Arc width modifier
 ARC_WIDTH = 400  # Change this value to adjust the thickness of the arcs
 
-# Text settings
-font = pygame.font.SysFont("Arial", 36)
+# Arc geometry, in reference pixels
+HEART_ARC_RECT = (227, -49, 900, 900)
+POWER_ARC_RECT = (456, 159, 455, 455)
+POWER_ARC_WIDTH = 220
+TARGET_BAND_WIDTH = 24  # workout target band, along the outer edge of the power arc
+# Ghost rider's power, a band this far in from the outer edge of the power arc, inside the
+# part of it the overlay leaves visible
+GHOST_ARC_INSET = 20
+GHOST_ARC_WIDTH = 10
+
+# Trend chart of the last few minutes, left of the dial, in reference pixels
+CHART_RECT = (40, 560, 320, 170)
+CHART_SECONDS = 180
+CHART_TRACES = {
+    "heart_rate": (RED, 60, 200),  # color, bottom and top of the scale
+    "power": (CYAN, 0, 600),
+}
+
+# Render quality tiers, best first; the frame governor steps down when frames run over budget.
+# arc_segments None draws the exact (and slow) pygame.draw.arc, a number draws a polygon band
+# with that many segments per full circle. skip_unchanged skips redrawing and re-blending the
+# overlay when the arcs moved less than a quarter degree and the text and chart are unchanged.
+QUALITY_TIERS = [
+    {"arc_segments": None, "text_every": 1, "skip_unchanged": False},
+    {"arc_segments": 120, "text_every": 1, "skip_unchanged": False},
+    {"arc_segments": 60, "text_every": 5, "skip_unchanged": True},
+    {"arc_segments": 24, "text_every": 15, "skip_unchanged": True},
+]
+UNCHANGED_ANGLE = math.radians(0.25)
 
 # Helper functions
 def smooth_value(queue, new_value, smoothing_time, fps):
@@ -45,120 +84,237 @@ def calculate_power_arc(value):
     result = math.pi * value / 300
     return min(result, 2 * math.pi)  # Limit to 2π
 
+def draw_arc_band(surface, color, rect, start_angle, stop_angle, width, segments):
+    """Filled polygon version of pygame.draw.arc, with `segments` steps per full circle."""
+    rect = pygame.Rect(rect)
+    cx, cy = rect.center
+    outer = rect.width / 2
+    inner = max(outer - width, 0)
+    steps = max(2, math.ceil(segments * (stop_angle - start_angle) / (2 * math.pi)))
+    angles = [start_angle + (stop_angle - start_angle) * i / steps for i in range(steps + 1)]
+    points = [(cx + outer * math.cos(a), cy - outer * math.sin(a)) for a in angles]
+    points += [(cx + inner * math.cos(a), cy - inner * math.sin(a)) for a in reversed(angles)]
+    pygame.draw.polygon(surface, color, points)
+
+def draw_arc(surface, color, rect, start_angle, stop_angle, width, segments):
+    if segments is None:
+        pygame.draw.arc(surface, color, rect, start_angle, stop_angle, width)
+    else:
+        draw_arc_band(surface, color, rect, start_angle, stop_angle, width, segments)
+
 # Data queues for smoothing
 heart_rate_queue = deque()
 power_queue = deque()
+POWER_SMOOTHING = 7  # seconds
+
+ghost_queue = deque()
+
+# What one frame shows: the smoothed values, 0 when there is nothing to show, the
+# ghost.GhostState with its power smoothed like the rider's and the W' balance fraction
+ArcState = namedtuple("ArcState", ["heart_rate", "power", "target", "ghost", "w_balance"])
+
+def _inset(rect, amount):
+    x, y, width, height = rect
+    return (x + amount, y + amount, width - 2 * amount, height - 2 * amount)
+
+def make_view(layout, images):
+    """Scale fonts and geometry once from the reference layout."""
+    return {
+        "overlay": images["overlay"],
+        "overlay_pos": layout.point(0, 0),
+        "heart_arc_rect": layout.rect(*HEART_ARC_RECT),
+        "heart_arc_width": layout.length(ARC_WIDTH),
+        "power_arc_rect": layout.rect(*POWER_ARC_RECT),
+        "power_arc_width": layout.length(POWER_ARC_WIDTH),
+        "target_band_width": layout.length(TARGET_BAND_WIDTH),
+        "ghost_arc_rect": layout.rect(*_inset(POWER_ARC_RECT, GHOST_ARC_INSET)),
+        "ghost_arc_width": layout.length(GHOST_ARC_WIDTH),
+        # Text anchors, centered horizontally on the dial
+        "heart_text_pos": layout.point(REFERENCE_SIZE[0] // 2, REFERENCE_SIZE[1] // 2 - 50),
+        "power_text_pos": layout.point(REFERENCE_SIZE[0] // 2, REFERENCE_SIZE[1] // 2 + 10),
+        "target_text_pos": layout.point(REFERENCE_SIZE[0] // 2, REFERENCE_SIZE[1] // 2 + 70),
+        "ghost_text_pos": layout.point(REFERENCE_SIZE[0] // 2, REFERENCE_SIZE[1] // 2 - 105),
+        "balance_text_pos": layout.point(REFERENCE_SIZE[0] // 2, REFERENCE_SIZE[1] // 2 + 108),
+        "font": pygame.font.SysFont("Arial", layout.length(36)),
+        # For the W' balance, which has to fit the narrowing bottom of the dial
+        "small_font": pygame.font.SysFont("Arial", layout.length(26)),
+        # Kept between frames for the lower quality tiers
+        "text": None,
+        "text_frames": 0,
+        "drawn": None,
+        # Trend chart, fed from the sensors by display_loop; None draws no chart
+        "chart": None,
+        "chart_pos": layout.point(*CHART_RECT[:2]),
+    }
+
+def make_chart(layout):
+    return StripChart(layout.image_size(CHART_RECT[2:]), CHART_TRACES, CHART_SECONDS)
+
+def frame_state(heart_rate, power, target=None, power_average=None, ghost_state=None, w_balance=None):
+    """Smooth one frame's values; None means the channel is stale. `target` is the workout.Target to show,
+    `ghost_state` the ghost.GhostState, `w_balance` the W' balance as a fraction of W'.
+
+    `power_average`, the exact POWER_SMOOTHING average from the power meter's counters, replaces
+    the per-frame mean of `power` while the channel is fresh.
+    """
+    # Stale channels feed zeros, so their arc drains and the "No ..." text comes back
+    smoothed_heart_rate = smooth_value(heart_rate_queue, heart_rate or 0, 4, FPS)
+    smoothed_power = smooth_value(power_queue, power or 0, POWER_SMOOTHING, FPS)
+    if power is not None and power_average is not None:
+        smoothed_power = power_average
+    if ghost_state is not None:
+        ghost_state = ghost_state._replace(power=smooth_value(ghost_queue, ghost_state.power or 0, POWER_SMOOTHING, FPS))
+    return ArcState(smoothed_heart_rate, smoothed_power, target, ghost_state, w_balance)
+
+def render_text(font, smoothed_heart_rate, smoothed_power, target=None, ghost_state=None, w_balance=None,
+                small_font=None):
+    if smoothed_heart_rate > 0:
+        heart_text = font.render(f"HR: {int(smoothed_heart_rate)}", True, WHITE)
+    else:
+        heart_text = font.render("No Heart Rate", True, WHITE)
 
-# Shared variables for ANT+ data
-heart_rate = 100
-power = 300
-
-# Lock for thread-safe variable access
-data_lock = Lock()
-
-# Placeholder for ANT+ device and node initialization
-node = Node()
-devices = [PowerMeter(node), HeartRate(node)]
-
-# Shared event to stop threads
-stop_event = Event()
-
-def ant_plus_data_logger():
-    """ANT+ data logging loop."""
-    global heart_rate, power  # Declare the global variables
-    try:
-        node.set_network_key(0x00, ANTPLUS_NETWORK_KEY)
-
-        # Define device callbacks
-        def on_found(device):
-            print(f"Device {device} found and receiving")
-
-        def on_device_data(page: int, page_name: str, data):
-            global heart_rate, power  # Access global variables
-            with data_lock:  # Ensure safe access to shared data
-                if isinstance(data, HeartRateData):
-                    heart_rate = data.heart_rate  # Update heart rate
-                elif isinstance(data, PowerData):
-                    power = data.instantaneous_power  # Update power
-
-        # Assign callbacks to devices
-        for d in devices:
-            d.on_found = lambda d=d: on_found(d)
-            d.on_device_data = on_device_data
-
-        print(f"Starting ANT+ node, press Ctrl-C to finish")
-        node.start()
-
-    except KeyboardInterrupt:
-        print("Closing ANT+ device...")
+    if smoothed_power > 0:
+        power_text = font.render(f"PWR: {int(smoothed_power)}", True, WHITE)
+    else:
+        power_text = font.render("No Power", True, WHITE)
 
-    finally:
-        # Ensure resources are closed
-        for d in devices:
-            d.close_channel()
-        node.stop()
-
-# Start the ANT+ logging thread
-ant_plus_thread = Thread(target=ant_plus_data_logger)
-ant_plus_thread.start()
-
-# Main loop variables
-running = True
-fps = 30
-
-while running:
-    # Handle events
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        if event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-            running = False
-
-    # Smooth data
-    smoothed_heart_rate = smooth_value(heart_rate_queue, heart_rate, 4, fps)
-    smoothed_power = smooth_value(power_queue, power, 7, fps)
+    target_text = None if target is None else font.render(f"TGT: {int(target.power)}", True, YELLOW)
+    ghost_text = None
+    if ghost_state is not None:
+        ghost_text = font.render(f"GHOST {int(ghost_state.power)} {ghost_state.delta:+.1f}kJ", True, GHOST)
+    balance_text = None
+    if w_balance is not None:
+        balance_text = (small_font or font).render(f"W' {w_balance:.0%}", True,
+                                                   LOW_BALANCE_COLOR if w_balance < LOW_BALANCE else WHITE)
+    return heart_text, power_text, target_text, ghost_text, balance_text
+
+def draw_frame(backend, view, state, quality=QUALITY_TIERS[0]):
+    """Draw one frame; returns False when it was skipped because nothing visible changed."""
+    screen = backend.screen
+    smoothed_heart_rate, smoothed_power, target, ghost_state, w_balance = state
+    segments = quality["arc_segments"]
 
     # Calculate arcs
     heart_arc_angle = calculate_heart_arc(smoothed_heart_rate)
     power_arc_angle = calculate_power_arc(smoothed_power)
+    ghost_arc_angle = None if ghost_state is None else calculate_power_arc(ghost_state.power)
+
+    # Lower tiers re-render the text only every few frames
+    refresh_text = view["text"] is None or view["text_frames"] >= quality["text_every"] - 1
+    if refresh_text:
+        text_values = (int(smoothed_heart_rate), int(smoothed_power), None if target is None else int(target.power),
+                       None if ghost_state is None else (int(ghost_state.power), round(ghost_state.delta, 1)),
+                       None if w_balance is None else round(w_balance, 2))
+    else:
+        text_values = view["drawn"][3:]
+
+    chart = view["chart"]
+    chart_changed = chart is not None and chart.tick()
+
+    drawn = view["drawn"]
+    if quality["skip_unchanged"] and not chart_changed and drawn is not None and drawn[3:] == text_values \
+            and abs(drawn[0] - heart_arc_angle) < UNCHANGED_ANGLE and abs(drawn[1] - power_arc_angle) < UNCHANGED_ANGLE \
+            and (drawn[2] == ghost_arc_angle or (drawn[2] is not None and ghost_arc_angle is not None
+                                                 and abs(drawn[2] - ghost_arc_angle) < UNCHANGED_ANGLE)):
+        return False
+    view["drawn"] = (heart_arc_angle, power_arc_angle, ghost_arc_angle) + text_values
+
+    if refresh_text:
+        view["text"] = render_text(view["font"], smoothed_heart_rate, smoothed_power, target, ghost_state, w_balance,
+                                   view["small_font"])
+        view["text_frames"] = 0
+    else:
+        view["text_frames"] += 1
+    heart_text, power_text, target_text, ghost_text, balance_text = view["text"]
 
     # Draw black background
     screen.fill(BLACK)
 
     # Draw heart rate arc
     if smoothed_heart_rate > 0:
-        pygame.draw.arc(screen, RED, (227, -49, 900, 900), math.pi / 2, math.pi / 2 + heart_arc_angle, 400)
+        draw_arc(screen, RED, view["heart_arc_rect"], math.pi / 2, math.pi / 2 + heart_arc_angle,
+                 view["heart_arc_width"], segments)
 
     # Draw power arc
     if smoothed_power > 0:
-        pygame.draw.arc(screen, CYAN, (456, 159, 455, 455), math.pi / 2, math.pi / 2 + power_arc_angle, 220)
+        draw_arc(screen, CYAN, view["power_arc_rect"], math.pi / 2, math.pi / 2 + power_arc_angle,
+                 view["power_arc_width"], segments)
 
-    # Draw text boxes
-    if smoothed_heart_rate > 0:
-        heart_text = font.render(f"HR: {int(smoothed_heart_rate)}", True, WHITE)
-    else:
-        heart_text = font.render("No Heart Rate", True, WHITE)
+    # Draw the workout's target band over the power arc
+    if target is not None:
+        draw_arc(screen, YELLOW, view["power_arc_rect"], math.pi / 2 + calculate_power_arc(target.low),
+                 math.pi / 2 + calculate_power_arc(target.high), view["target_band_width"], segments)
 
-    if smoothed_power > 0:
-        power_text = font.render(f"PWR: {int(smoothed_power)}", True, WHITE)
-    else:
-        power_text = font.render("No Power", True, WHITE)
-
-    screen.blit(heart_text, (screen.get_width() // 2 - heart_text.get_width() // 2, screen.get_height() // 2 - 50))
-    screen.blit(power_text, (screen.get_width() // 2 - power_text.get_width() // 2, screen.get_height() // 2 + 10))
+    # Draw the ghost rider's power as a thin band over the power arc
+    if ghost_arc_angle:
+        draw_arc(screen, GHOST, view["ghost_arc_rect"], math.pi / 2, math.pi / 2 + ghost_arc_angle,
+                 view["ghost_arc_width"], segments)
 
-    # Overlay image
-    screen.blit(overlay_image, (0, 0))
-
-    # Update display
-    pygame.display.flip()
+    # Draw text boxes
+    heart_text_pos, power_text_pos = view["heart_text_pos"], view["power_text_pos"]
+    screen.blit(heart_text, (heart_text_pos[0] - heart_text.get_width() // 2, heart_text_pos[1]))
+    screen.blit(power_text, (power_text_pos[0] - power_text.get_width() // 2, power_text_pos[1]))
+    if target_text is not None:
+        target_text_pos = view["target_text_pos"]
+        screen.blit(target_text, (target_text_pos[0] - target_text.get_width() // 2, target_text_pos[1]))
+    if ghost_text is not None:
+        ghost_text_pos = view["ghost_text_pos"]
+        screen.blit(ghost_text, (ghost_text_pos[0] - ghost_text.get_width() // 2, ghost_text_pos[1]))
+    if balance_text is not None:
+        balance_text_pos = view["balance_text_pos"]
+        screen.blit(balance_text, (balance_text_pos[0] - balance_text.get_width() // 2, balance_text_pos[1]))
+
+    # Overlay image, through the backend in case the memory budget mode stored it cropped
+    backend.blit(view["overlay"], view["overlay_pos"])
+
+    if chart is not None:
+        screen.blit(chart.surface, view["chart_pos"])
+    return True
+
+def display_loop(backend, layout, images):
+    clock = pygame.time.Clock()
+    view = make_view(layout, images)
+    governor = FrameGovernor(QUALITY_TIERS, FPS)
+    chart = view["chart"] = make_chart(layout)
+    sensors.subscribers.append(chart.add)
+    running = True
 
-    # Cap the frame rate
-    clock.tick(fps)
+    try:
+        while running:
+            # Handle events
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+                    running = False
+
+            governor.begin()
+
+            # Latest fresh samples, None for channels that have gone quiet
+            shown = sensors.snapshot()
+            hr_sample, power_sample = shown["heart_rate"], shown["power"]
+            target = workout.active.current() if workout.active else None
+            power_average = sensors.power_average(POWER_SMOOTHING) if sensors.power_mode == "accumulated" else None
+            ghost_state = ghost.active.current() if ghost.active else None
+            w_balance = wbal.active.fraction() if wbal.active else None
+            state = frame_state(hr_sample and hr_sample.value, power_sample and power_sample.value, target,
+                                power_average, ghost_state, w_balance)
+
+            # Update display, unless the governor let an unchanged frame be skipped
+            if draw_frame(backend, view, state, governor.quality):
+                backend.present()
+                latency.frames.record(shown)
+            metrics.frames.observe(governor.end())
+
+            # Cap the frame rate
+            clock.tick(FPS)
+    finally:
+        sensors.subscribers.remove(chart.add)
 
-# Stop the ANT+ thread gracefully
-stop_event.set()
-ant_plus_thread.join()
+def main():
+    # The launcher shows a first frame, then loads assets and starts ANT+ in the background
+    launcher.launch(sys.modules[__name__])
 
-pygame.quit()
-sys.exit()
+if __name__ == "__main__":
+    main()
+    sys.exit()
@@ -0,0 +1,292 @@
+import argparse
+import threading
+import time
+
+import pages
+import sensors
+from latency import LatencyHistogram
+from trainersim import BASIC_RESISTANCE_PAGE, COMMAND_STATUS_PAGE, TARGET_POWER_PAGE, TrainerSimulator
+
+
+class ErgController:
+    """Holds an FE-C trainer at a target power from a fixed-period loop on its own thread.
+
+    In "erg" mode the trainer's own ERG controller does the work: the loop sends the target
+    power at the first tick after it changes and repeats it every `resend` seconds. In
+    "resistance" mode the loop closes the loop itself, a PI controller on the trainer's
+    measured power setting the basic resistance, for trainers whose ERG mode is too sluggish.
+
+    Two latencies are measured per command: until the trainer confirms it on the command
+    status page (ack), and until its measured power is within `tolerance` of the target
+    (response). `trainer` is anything with openant FitnessEquipment's set_target_power and
+    set_basic_resistance; by default the trainer sensors.start_ant_node found.
+    """
+
+    def __init__(self, trainer=None, mode="erg", period=0.25, target=0.0, tolerance=0.05, min_tolerance=8.0,
+                 resend=5.0, kp=0.05, ki=0.15, target_source=None):
+        if mode not in ("erg", "resistance"):
+            raise ValueError(f"Unknown ERG control mode {mode!r}, expected 'erg' or 'resistance'")
+        self.trainer = trainer
+        self.mode = mode
+        self.period = period  # one FE-C page period, so the loop reacts within one sensor update
+        self.target = target
+        self.target_source = target_source  # optional callable(now) -> watts, read every tick
+        self.tolerance = tolerance  # fraction of the target counted as settled
+        self.min_tolerance = min_tolerance  # W, so low targets do not demand the impossible
+        self.resend = resend
+        # PI gains, tuned on the simulator (python erg.py --offline ... --mode resistance)
+        self.kp = kp  # % resistance per W of error
+        self.ki = ki  # % resistance per W of error and second
+
+        self.resistance = 0.0
+        self.commands = 0
+        self.failures = 0
+        self.overruns = 0
+        self.unsettled = 0  # targets replaced before the trainer got there
+        self.ack = LatencyHistogram(bucket_ms=10, max_ms=2000)
+        self.response = LatencyHistogram(bucket_ms=50, max_ms=10000)
+        self.jitter = LatencyHistogram(bucket_ms=1, max_ms=100)  # tick lateness
+
+        self._integral = 0.0
+        self._sent = None  # (page, value) last commanded
+        self._sent_at = None
+        self._ack_pending = None  # (sent at, page, raw value) waiting for the status page
+        self._response_pending = None  # (target changed at, target)
+        self._target_seen = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_target(self, watts):
+        self.target = float(watts)
+
+    def _band(self, target):
+        return max(target * self.tolerance, self.min_tolerance)
+
+    def _trainer(self):
+        if self.trainer is not None:
+            return self.trainer
+        return sensors.devices.get("FitnessEquipment")
+
+    def _send(self, trainer, page, value, now):
+        try:
+            if page == TARGET_POWER_PAGE:
+                trainer.set_target_power(int(round(value)))
+                raw = int(round(value)) * 4
+            else:
+                trainer.set_basic_resistance(value)
+                raw = int(value * 2)
+        except Exception as e:
+            self.failures += 1
+            print(f"Trainer command failed: {e}")
+            return
+        self.commands += 1
+        self._sent = (page, value)
+        self._sent_at = now
+        with self._lock:
+            self._ack_pending = (now, page, raw & 0xFFFF)
+
+    def tick(self, now):
+        """One control step at monotonic time now."""
+        if self.target_source is not None:
+            self.target = self.target_source(now)
+        target = self.target
+        # A step restarts the response timer; a ramp's small per-tick changes do not
+        if self._target_seen is None or abs(target - self._target_seen) > self._band(target):
+            with self._lock:
+                if self._response_pending is not None:
+                    self.unsettled += 1
+                self._response_pending = (now, target)
+            self._target_seen = target
+
+        trainer = self._trainer()
+        if trainer is None:
+            return
+        resend = self._sent_at is None or now - self._sent_at >= self.resend
+
+        if self.mode == "erg":
+            # Compare what the command carries: a ramp moves the target a little every tick,
+            # but the whole watts sent change far less often
+            watts = int(round(target))
+            if resend or self._sent != (TARGET_POWER_PAGE, watts):
+                self._send(trainer, TARGET_POWER_PAGE, watts, now)
+            return
+
+        # Resistance mode: PI on the trainer's last measured power, if it is recent
+        sample = sensors.samples["trainer_power"]
+        if sample.time is None or now - sample.time > 4 * self.period:
+            return
+        error = target - sample.value
+        proportional = self.kp * error
+        if 0.0 < proportional + self._integral < 100.0:
+            # Integrate only while unsaturated, so the integral cannot wind up
+            self._integral += self.ki * error * self.period
+        resistance = min(max(proportional + self._integral, 0.0), 100.0)
+        resistance = round(resistance * 2) / 2  # FE-C resolution is 0.5 %
+        self.resistance = resistance
+        if resend or self._sent != (BASIC_RESISTANCE_PAGE, resistance):
+            self._send(trainer, BASIC_RESISTANCE_PAGE, resistance, now)
+
+    def on_sample(self, channel, sample):
+        """sensors subscriber: time how long the trainer takes to reach the target."""
+        if channel != "trainer_power":
+            return
+        with self._lock:
+            pending = self._response_pending
+            if pending is None:
+                return
+            changed_at, target = pending
+            if abs(sample.value - target) <= self._band(target):
+                self.response.add(max(sample.time - changed_at, 0.0))
+                self._response_pending = None
+
+    def on_status(self, payload, received):
+        """Raw handler for the FE-C command status page: time the acknowledgement."""
+        with self._lock:
+            pending = self._ack_pending
+            if pending is None:
+                return
+            sent_at, page, raw = pending
+            # The page echoes the command's data: target power in bytes 6-7 (0.25 W), basic
+            # resistance in byte 7 alone (0.5 %) with byte 6 reserved
+            if page == TARGET_POWER_PAGE:
+                echoed = payload[6] | payload[7] << 8
+            else:
+                echoed = payload[7]
+            if payload[1] == page and payload[3] == 0 and echoed == raw:
+                self.ack.add(max(received - sent_at, 0.0))
+                self._ack_pending = None
+
+    def attach(self):
+        sensors.subscribers.append(self.on_sample)
+        sensors.dispatcher.register(pages.FITNESS_EQUIPMENT, COMMAND_STATUS_PAGE, self.on_status, raw=True)
+
+    def detach(self):
+        sensors.subscribers.remove(self.on_sample)
+        sensors.dispatcher.unregister(pages.FITNESS_EQUIPMENT, COMMAND_STATUS_PAGE, self.on_status, raw=True)
+
+    def start(self):
+        self.attach()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self.detach()
+
+    def _run(self):
+        # Ticks on a fixed grid of deadlines, so the period does not drift with the work done
+        deadline = time.monotonic()
+        while True:
+            delay = deadline - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                return
+            if self._stop.is_set():
+                return
+            now = time.monotonic()
+            self.jitter.add(now - deadline)
+            self.tick(now)
+            deadline += self.period
+            behind = time.monotonic() - deadline
+            if behind > 0:
+                # Skip the ticks that are already late instead of running them back to back
+                missed = int(behind // self.period) + 1
+                self.overruns += missed
+                deadline += missed * self.period
+
+    def report(self):
+        print(f"ERG control ({self.mode}): {self.commands} commands, {self.failures} failed, "
+              f"{self.overruns} ticks overrun, {self.unsettled} targets left before settling")
+        for name, histogram in (("command ack", self.ack), ("power response", self.response),
+                                ("tick lateness", self.jitter)):
+            if histogram.count:
+                print(f"{name}: {histogram.format()}")
+
+
+def simulate(controller, simulator, schedule, step=0.01):
+    """Run controller and simulator in simulated time, as fast as possible, for tuning.
+
+    `schedule` is a list of (seconds, target watts). Returns (time, target, measured power) per page.
+    """
+    controller.attach()
+    trace = []
+    now = 0.0
+    next_tick = 0.0
+    try:
+        for duration, target in schedule:
+            controller.set_target(target)
+            end = now + duration
+            while now < end:
+                if now >= next_tick:
+                    controller.tick(now)
+                    next_tick += controller.period
+                now += step
+                out = simulator.step(step)
+                simulator.publish(out, now)
+                if any(page == 0x19 for page, _ in out):
+                    trace.append((now, target, simulator.measured_power))
+    finally:
+        controller.detach()
+    return trace
+
+
+def parse_schedule(text):
+    """"30:150,60:250" -> [(30.0, 150.0), (60.0, 250.0)]: seconds at each target power."""
+    schedule = []
+    for part in text.split(","):
+        seconds, watts = part.split(":")
+        schedule.append((float(seconds), float(watts)))
+    return schedule
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive an FE-C trainer in ERG mode, or tune the loop on the simulator")
+    parser.add_argument("schedule", type=parse_schedule, help="SECONDS:WATTS steps, e.g. 30:150,60:250")
+    parser.add_argument("--mode", choices=("erg", "resistance"), default="erg")
+    parser.add_argument("--period", type=float, default=0.25, help="control period in seconds")
+    parser.add_argument("--kp", type=float, default=0.05)
+    parser.add_argument("--ki", type=float, default=0.15)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--simulate", action="store_true", help="real-time simulated trainer instead of ANT+")
+    target.add_argument("--offline", action="store_true", help="simulated trainer in simulated time, no waiting")
+    args = parser.parse_args()
+
+    simulator = TrainerSimulator() if args.simulate or args.offline else None
+    controller = ErgController(simulator, args.mode, args.period, target=args.schedule[0][1], kp=args.kp, ki=args.ki)
+
+    if args.offline:
+        trace = simulate(controller, simulator, args.schedule)
+        for t, target, power in trace[::4]:
+            print(f"{t:7.1f} s  target {target:5.0f} W  trainer {power:5d} W")
+        controller.report()
+        return
+
+    if simulator:
+        simulator.start()
+    else:
+        sensors.start_ant_node()
+    controller.start()
+    try:
+        for duration, watts in args.schedule:
+            controller.set_target(watts)
+            end = time.monotonic() + duration
+            while time.monotonic() < end:
+                time.sleep(1.0)
+                sample = sensors.samples["trainer_power"]
+                print(f"target {watts:5.0f} W  trainer {sample.value:5.0f} W")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        controller.stop()
+        if simulator:
+            simulator.stop()
+        sensors.stop_ant_node()
+        controller.report()
+
+
+if __name__ == "__main__":
+    main()
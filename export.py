@@ -0,0 +1,162 @@
+import argparse
+import importlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import sensors
+from filters import make_filters
+from layout import Layout, load_scaled, parse_size
+from resample import hold
+from sessions import load_session
+
+# Displays that can be exported, by module name
+DISPLAYS = ("steamdisplay8", "cyberpunk01")
+
+# Per-process render state, set up once by _init_worker
+_worker = {}
+
+
+def frame_values(session, fps, channels=("heart_rate", "power")):
+    """Value shown at every frame time: the latest filtered sample, NaN once it has gone stale.
+
+    Runs the same outlier filters and stale timeout as the live path, so an export looks
+    like the display would have looked during the ride.
+    """
+    filters = make_filters()
+    frame_times = np.arange(int(session.duration * fps) + 1) / fps
+    values = {}
+    for channel in channels:
+        shown = np.full(len(frame_times), np.nan)
+        raw = session.channels.get(channel)
+        if raw is not None and len(raw):
+            valid = ~np.isnan(raw)
+            times = session.times[valid]
+            filtered = raw[valid]
+            channel_filter = filters.get(channel)
+            if channel_filter is not None:
+                filtered = np.array([np.nan if value is None else value for value in
+                                     (channel_filter.update(v, t) for v, t in zip(filtered.tolist(), times.tolist()))])
+            # A sample the filter rejected is skipped, as the live path never publishes it
+            timeout = sensors.freshness.timeouts.get(channel, sensors.freshness.timeout)
+            shown = hold(times, filtered, frame_times, timeout)
+        values[channel] = shown
+    return frame_times, values
+
+
+def simulate(display, values):
+    """Run the display's per-frame state update over every frame, in order.
+
+    Needle physics and smoothing depend on the previous frame, so this part is sequential;
+    it is cheap next to drawing, which is what gets spread over the process pool.
+    """
+    states = []
+    for heart_rate, power in zip(values["heart_rate"].tolist(), values["power"].tolist()):
+        states.append(display.frame_state(None if heart_rate != heart_rate else heart_rate,
+                                          None if power != power else power))
+    return states
+
+
+def _init_worker(display_name, size):
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    import pygame
+    from renderer import SurfaceBackend
+
+    pygame.init()
+    display = importlib.import_module(display_name)
+    backend = SurfaceBackend(size, display.CAPTION)
+    layout = Layout(display.REFERENCE_SIZE, backend.size)
+    images = {name: backend.load(load_scaled(path, layout)) for name, path in display.ASSETS.items()}
+    _worker.update(pygame=pygame, display=display, backend=backend, view=display.make_view(layout, images))
+
+
+def _render_chunk(start, states, pattern):
+    """Draw a run of frames; save them as numbered images, or return them as raw RGB bytes."""
+    pygame, display, backend = _worker["pygame"], _worker["display"], _worker["backend"]
+    frames = []
+    for i, state in enumerate(states):
+        display.draw_frame(backend, _worker["view"], state)
+        if pattern:
+            pygame.image.save(backend.screen, pattern % (start + i))
+        else:
+            frames.append(pygame.image.tobytes(backend.screen, "RGB"))
+    return b"".join(frames)
+
+
+def export(display_name, session, size=None, fps=30, pattern=None, raw=None, workers=None, chunk_frames=None):
+    """Render a session headlessly, either to numbered images (`pattern`) or raw RGB24 frames written to `raw`."""
+    display = importlib.import_module(display_name)
+    size = tuple(size or display.REFERENCE_SIZE)
+    workers = workers or os.cpu_count()
+    # Raw frames travel back through the pool, so keep their chunks small
+    chunk_frames = chunk_frames or (120 if pattern else 8)
+
+    started = time.perf_counter()
+    _, values = frame_values(session, fps)
+    states = simulate(display, values)
+    simulated = time.perf_counter()
+
+    # Scale the assets once here, so the workers all find them in the disk cache
+    layout = Layout(display.REFERENCE_SIZE, size)
+    for path in display.ASSETS.values():
+        load_scaled(path, layout)
+
+    chunks = [(start, states[start:start + chunk_frames]) for start in range(0, len(states), chunk_frames)]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(display_name, size)) as pool:
+        if pattern:
+            for future in [pool.submit(_render_chunk, start, chunk, pattern) for start, chunk in chunks]:
+                future.result()
+        else:
+            # Bounded window of chunks in flight, written out strictly in frame order
+            in_flight = []
+            for start, chunk in chunks:
+                in_flight.append(pool.submit(_render_chunk, start, chunk, None))
+                if len(in_flight) >= 2 * workers:
+                    raw.write(in_flight.pop(0).result())
+            for future in in_flight:
+                raw.write(future.result())
+
+    elapsed = time.perf_counter() - started
+    print(f"Exported {len(states)} frames ({len(states) / fps:.0f} s of video) in {elapsed:.1f} s "
+          f"on {workers} processes, {simulated - started:.2f} s of it simulating", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a recorded session to video frames, without a window")
+    parser.add_argument("display", choices=DISPLAYS)
+    parser.add_argument("session", help="FIT or CSV session file")
+    parser.add_argument("--size", help="frame size as WIDTHxHEIGHT, default the display's reference size")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--workers", type=int, help="render processes, default one per core")
+    parser.add_argument("--chunk", type=int, help="frames per work item")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--images", metavar="PATTERN", help="numbered image files, e.g. frames/%%06d.png")
+    output.add_argument("--raw", metavar="FILE", help="raw RGB24 frames to FILE, or - for stdout")
+    args = parser.parse_args()
+
+    size = parse_size(args.size) if args.size else importlib.import_module(args.display).REFERENCE_SIZE
+    session = load_session(args.session)
+
+    if args.images:
+        directory = os.path.dirname(args.images)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        export(args.display, session, size, args.fps, pattern=args.images, workers=args.workers,
+               chunk_frames=args.chunk)
+        return
+
+    print(f"Encode with e.g.: ffmpeg -f rawvideo -pix_fmt rgb24 -s {size[0]}x{size[1]} -r {args.fps} "
+          f"-i - out.mp4", file=sys.stderr)
+    if args.raw == "-":
+        export(args.display, session, size, args.fps, raw=sys.stdout.buffer, workers=args.workers,
+               chunk_frames=args.chunk)
+    else:
+        with open(args.raw, "wb") as raw:
+            export(args.display, session, size, args.fps, raw=raw, workers=args.workers, chunk_frames=args.chunk)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import heapq
+import time
+from collections import deque, defaultdict
+
+
+class RollingMedian:
+    """Median over a sliding window of the last `window` values, O(log n) per update.
+
+    Two heaps hold the lower and upper half of the window. Values that fall out of the
+    window are only marked as deleted and dropped once they reach the top of a heap.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.values = deque()
+        self._low = []  # max-heap of the lower half, stored negated
+        self._high = []  # min-heap of the upper half
+        self._low_size = 0
+        self._high_size = 0
+        self._deleted = defaultdict(int)
+
+    def __len__(self):
+        return len(self.values)
+
+    def _prune(self, heap, sign):
+        while heap and self._deleted.get(sign * heap[0]):
+            value = sign * heapq.heappop(heap)
+            self._deleted[value] -= 1
+            if not self._deleted[value]:
+                del self._deleted[value]
+
+    def _rebalance(self):
+        # Keep the lower half equal to or one larger than the upper half
+        if self._low_size > self._high_size + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, -1)
+        elif self._low_size < self._high_size:
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._low_size += 1
+            self._high_size -= 1
+            self._prune(self._high, 1)
+
+    def _remove(self, value):
+        self._deleted[value] += 1
+        if value <= -self._low[0]:
+            self._low_size -= 1
+            if value == -self._low[0]:
+                self._prune(self._low, -1)
+        else:
+            self._high_size -= 1
+            if value == self._high[0]:
+                self._prune(self._high, 1)
+        self._rebalance()
+
+    def push(self, value):
+        """Add a value, dropping the oldest one once the window is full, and return the median."""
+        if not self._low or value <= -self._low[0]:
+            heapq.heappush(self._low, -value)
+            self._low_size += 1
+        else:
+            heapq.heappush(self._high, value)
+            self._high_size += 1
+        self._rebalance()
+
+        self.values.append(value)
+        if len(self.values) > self.window:
+            self._remove(self.values.popleft())
+        return self.median()
+
+    def median(self):
+        if not self.values:
+            return None
+        if self._low_size > self._high_size:
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) / 2
+
+
+class OutlierFilter:
+    """Streaming spike rejection for one sensor channel.
+
+    A sample outside [min_value, max_value] is dropped: update returns None and nothing is
+    published, so a sensor stuck on an impossible value goes stale. A sample further than
+    max_deviation from the rolling median is replaced by the median. The output is then
+    limited to change by at most max_rate units per second.
+    """
+
+    def __init__(self, window=7, max_deviation=None, max_rate=None, min_value=None, max_value=None):
+        self.median = RollingMedian(window)
+        self.max_deviation = max_deviation
+        self.max_rate = max_rate
+        self.min_value = min_value
+        self.max_value = max_value
+        self.value = None
+        self.rejected = 0
+        self._last_time = None
+
+    def update(self, value, t=None):
+        """Feed one raw sample, taken at monotonic time t, and return the filtered value, None when dropped."""
+        if t is None:
+            t = time.monotonic()
+
+        # Values the sensor cannot physically report never enter the window
+        if (self.min_value is not None and value < self.min_value) or \
+                (self.max_value is not None and value > self.max_value):
+            self.rejected += 1
+            return None
+
+        median = self.median.push(value)
+        if self.max_deviation is not None and abs(value - median) > self.max_deviation:
+            self.rejected += 1
+            value = median
+
+        if self.max_rate is not None and self.value is not None:
+            max_step = self.max_rate * (t - self._last_time)
+            value = min(max(value, self.value - max_step), self.value + max_step)
+
+        self.value = value
+        self._last_time = t
+        return value
+
+
+# Default filter settings per channel, tuned for ~4 Hz ANT+ pages
+CHANNEL_FILTERS = {
+    # Chest straps glitch to 200+ bpm for a page or two; real HR moves a few bpm per second
+    "heart_rate": dict(window=5, max_deviation=20, max_rate=8, min_value=30, max_value=210),
+    # Power meters spike to 2000 W; a real sprint holds for longer than half the window
+    "power": dict(window=7, max_deviation=400, max_rate=2000, min_value=0, max_value=2500),
+}
+
+
+def make_filters(config=CHANNEL_FILTERS):
+    """Build one OutlierFilter per channel from a {channel: settings} mapping."""
+    return {channel: OutlierFilter(**settings) for channel, settings in config.items()}
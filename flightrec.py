@@ -0,0 +1,284 @@
+import argparse
+import datetime as dt
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+import pages
+import sensors
+
+# Set this to a file path to record every ANT+ page of displays started by the launcher
+RECORDER_ENV_VAR = "WORKOUT_DISPLAY_FLIGHT_RECORDER"
+
+MAGIC = b"WDFR"
+VERSION = 1
+# Magic, version, record size, capacity in records, next sequence number, file creation time
+HEADER = struct.Struct("<4sHHQQd")
+HEADER_SIZE = 64
+# Sequence number (from 1; 0 is an empty slot), wall clock time, monotonic received time,
+# ANT+ device type and the 8 page bytes
+RECORD = struct.Struct("<QddB8s7x")
+RECORD_DTYPE = np.dtype([("sequence", "<u8"), ("wall", "<f8"), ("received", "<f8"), ("device_type", "u1"),
+                         ("payload", "u1", 8), ("pad", "V7")])
+
+# About 4.5 hours of four sensors at 4 pages a second, in 10 MB
+DEFAULT_CAPACITY = 1 << 18
+
+# The monotonic received times restart at every boot of the kiosk, and a ring file outlives
+# reboots. Consecutive records whose monotonic and wall clock steps disagree by more than
+# BOOT_TOLERANCE seconds lie on either side of a reboot or suspend; replay puts at most
+# BOOT_GAP seconds between them, long enough for the displays to show the sensors stale.
+BOOT_TOLERANCE = 1.0
+BOOT_GAP = 10.0
+
+DEVICE_NAMES = {pages.POWER_METER: "power meter", pages.FITNESS_EQUIPMENT: "trainer", pages.HEART_RATE: "heart rate",
+                pages.BIKE_SPEED_CADENCE: "speed/cadence", pages.BIKE_CADENCE: "cadence", pages.BIKE_SPEED: "speed"}
+
+
+class FlightRecorder:
+    """Appends raw ANT+ pages to a fixed-size ring file through a memory map.
+
+    A page costs one struct.pack_into into the mapped file and one for the header, so it is
+    cheap enough to leave on. The kernel owns the mapped pages, so everything recorded up to a
+    crash of the process is in the file; only a power cut can lose what was not written back yet.
+    Each record carries its sequence number, so a reader can order them without trusting the
+    header, which a crash may leave one record behind.
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        size = HEADER_SIZE + capacity * RECORD.size
+        with open(path, "a+b") as f:
+            f.seek(0)
+            header = f.read(HEADER.size)
+            reuse = False
+            if len(header) == HEADER.size:
+                magic, version, record_size, old_capacity, sequence, created = HEADER.unpack(header)
+                reuse = (magic, version, record_size, old_capacity) == (MAGIC, VERSION, RECORD.size, capacity)
+            if not reuse:
+                # A new file, or one in another format: start over
+                f.truncate(0)
+                f.truncate(size)
+                sequence, created = 1, time.time()
+            self.map = mmap.mmap(f.fileno(), size)
+        self.capacity = capacity
+        self.sequence = sequence
+        self.created = created
+        self._lock = threading.Lock()
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, RECORD.size, capacity, sequence, created)
+
+    def record(self, device_type, payload, received=None):
+        """Append one page; `payload` is its data, of which the first 8 bytes are kept."""
+        if received is None:
+            received = time.monotonic()
+        data = bytes(payload[:8])
+        with self._lock:
+            sequence = self.sequence
+            RECORD.pack_into(self.map, HEADER_SIZE + (sequence % self.capacity) * RECORD.size,
+                             sequence, time.time(), received, device_type, data)
+            # Header last, so it never points past a record that was not written
+            self.sequence = sequence + 1
+            struct.pack_into("<Q", self.map, 16, self.sequence)
+
+    def tap(self, device):
+        """Record an openant device's pages as the channel delivers them, before openant decodes them.
+
+        A page that breaks the decoder is then on file too.
+        """
+        decode = device._on_data
+
+        def on_data(data):
+            self.record(device.device_type, data, time.monotonic())
+            decode(data)
+
+        device.channel.on_broadcast_data = on_data
+        device.channel.on_burst_data = on_data
+        device.channel.on_acknowledge = on_data
+
+    def close(self):
+        self.map.flush()
+        self.map.close()
+
+
+def read_records(path):
+    """All records of a ring file in the order they were written, as a NumPy structured array."""
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"{path} is not a flight recorder file")
+        magic, version, record_size, capacity, _, _ = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a version {VERSION} flight recorder file")
+        f.seek(HEADER_SIZE)
+        records = np.frombuffer(f.read(capacity * RECORD.size), RECORD_DTYPE)
+    records = records[records["sequence"] != 0]
+    return records[np.argsort(records["sequence"], kind="stable")]
+
+
+def last_minutes(records, minutes):
+    """The records of the last `minutes` before the newest one."""
+    if minutes is None or not len(records):
+        return records
+    return records[records["wall"] >= records["wall"][-1] - minutes * 60]
+
+
+def replay_times(records):
+    """Seconds from the first record at which each record is replayed.
+
+    Within one boot the monotonic received times give the spacing, unaffected by the wall
+    clock being set; across a reboot or suspend the wall clock gap, clamped to [0, BOOT_GAP].
+    """
+    if not len(records):
+        return np.empty(0)
+    received_steps = np.diff(records["received"])
+    wall_steps = np.diff(records["wall"])
+    same_boot = (received_steps >= 0) & (np.abs(received_steps - wall_steps) <= BOOT_TOLERANCE)
+    steps = np.where(same_boot, received_steps, np.clip(wall_steps, 0.0, BOOT_GAP))
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def page_number(device_type, payload):
+    if device_type in pages.PAGELESS:
+        return None
+    return payload[0] & pages.PAGE_MASKS.get(device_type, 0xFF)
+
+
+class _ReplayChannel:
+    """Stands in for an openant Channel: keeps the callbacks assigned to it, ignores commands."""
+
+    id = 0
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class ReplayNode:
+    """Stands in for the openant Node, so devices can be created without a USB stick."""
+
+    def new_channel(self, *args, **kwargs):
+        return _ReplayChannel()
+
+    def remove_channel(self, channel):
+        pass
+
+
+def replay_devices(clock):
+    """openant devices of every sensors.DEVICES class, by device type, wired to sensors.dispatcher like the live ones."""
+    from openant.devices.bike_speed_cadence import BikeSpeedCadence
+    from openant.devices.fitness_equipment import FitnessEquipment
+    from openant.devices.heart_rate import HeartRate
+    from openant.devices.power_meter import PowerMeter
+    classes = {cls.__name__: cls for cls in (PowerMeter, HeartRate, BikeSpeedCadence, FitnessEquipment)}
+    node = ReplayNode()
+    devices = {}
+    for name, kwargs in sensors.DEVICES.items():
+        device = classes[name](node, **kwargs)
+        device.on_device_data, device.on_update = sensors.dispatcher.device_callbacks(device.device_type, clock)
+        devices[device.device_type] = device
+    return devices
+
+
+def replay(records, speed=None, stop=None):
+    """Feed recorded pages through openant's decoding and the dispatcher into the sensors.
+
+    With `speed` None it runs as fast as it can, each page received at its replay_times
+    offset, so the same records always publish the same samples. With a speed it runs in real
+    time (times that speed) on the monotonic clock, for the displays.
+    """
+    now = [0.0]
+    devices = replay_devices(lambda: now[0])
+    if not len(records):
+        return
+    started = time.monotonic()
+    for offset, device_type, payload in zip(replay_times(records).tolist(), records["device_type"].tolist(),
+                                            records["payload"].tolist()):
+        if speed is None:
+            now[0] = offset
+        else:
+            delay = started + offset / speed - time.monotonic()
+            if delay > 0:
+                if stop is None:
+                    time.sleep(delay)
+                elif stop.wait(delay):
+                    return
+            now[0] = time.monotonic()
+        if stop is not None and stop.is_set():
+            return
+        device = devices.get(device_type)
+        if device is not None:
+            device._on_data(payload)
+
+
+class ReplaySource:
+    """Plays a flight recorder file into the sensors in real time, like sessions.ReplaySource."""
+
+    def __init__(self, records, speed=1.0):
+        self.records = records
+        self.speed = speed
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=replay, args=(self.records, self.speed, self._stop), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+
+def extract(records, path):
+    """Write records to a new ring file just big enough for them, to attach to a bug report."""
+    if os.path.exists(path):
+        os.remove(path)
+    recorder = FlightRecorder(path, max(len(records), 1))
+    for record in records:
+        sequence = recorder.sequence
+        RECORD.pack_into(recorder.map, HEADER_SIZE + (sequence % recorder.capacity) * RECORD.size, sequence,
+                         float(record["wall"]), float(record["received"]), int(record["device_type"]),
+                         record["payload"].tobytes())
+        recorder.sequence = sequence + 1
+    struct.pack_into("<Q", recorder.map, 16, recorder.sequence)
+    recorder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay an ANT+ flight recorder file")
+    parser.add_argument("command", choices=("dump", "replay", "extract"))
+    parser.add_argument("file")
+    parser.add_argument("out", nargs="?", help="file to write, for extract")
+    parser.add_argument("--minutes", type=float, help="only the last MINUTES of the recording")
+    args = parser.parse_args()
+
+    records = last_minutes(read_records(args.file), args.minutes)
+    if not len(records):
+        print(f"{args.file} holds no records")
+        return
+
+    if args.command == "dump":
+        for record, offset in zip(records, replay_times(records).tolist()):
+            device_type = int(record["device_type"])
+            payload = record["payload"].tolist()
+            page = page_number(device_type, payload)
+            when = dt.datetime.fromtimestamp(float(record["wall"])).isoformat(timespec="milliseconds")
+            print(f"{when} {offset:10.3f} s  "
+                  f"{DEVICE_NAMES.get(device_type, device_type):<13} page {'--' if page is None else f'{page:02X}'}  "
+                  f"{bytes(payload).hex(' ')}")
+    elif args.command == "extract":
+        if not args.out:
+            parser.error("extract needs an output file")
+        extract(records, args.out)
+        print(f"Wrote {len(records)} records to {args.out}")
+    else:
+        # Every published sample, in order: the same file always prints the same lines
+        sensors.subscribers.append(lambda channel, sample: print(f"{sample.time:10.3f} s  {channel:<13} {sample.value:g}"))
+        replay(records)
+        sensors.dispatcher.report()
+
+
+if __name__ == "__main__":
+    main()
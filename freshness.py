@@ -0,0 +1,104 @@
+import threading
+import time
+
+
+class TimerWheel:
+    """Hashed timer wheel: O(1) to (re)schedule a key, advancing costs one step per elapsed tick.
+
+    Each key sits in at most one slot. Rescheduling to a later deadline only updates the
+    deadline; the key is moved to its new slot when its old slot comes round.
+    """
+
+    def __init__(self, resolution=0.1, slots=64, now=0.0):
+        self.resolution = resolution
+        self.slots = slots
+        self._wheel = [set() for _ in range(slots)]
+        self._deadlines = {}
+        self._tick = int(now // resolution)
+
+    def _insert(self, key, deadline):
+        tick = max(int(deadline // self.resolution), self._tick + 1)
+        self._wheel[tick % self.slots].add(key)
+
+    def schedule(self, key, deadline):
+        if key not in self._deadlines:
+            self._insert(key, deadline)
+        elif deadline < self._deadlines[key]:
+            # Moving a deadline earlier needs the key in an earlier slot too
+            self._insert(key, deadline)
+        self._deadlines[key] = deadline
+
+    def cancel(self, key):
+        self._deadlines.pop(key, None)
+
+    def advance(self, now):
+        """Move the wheel to `now` and return the keys whose deadline has passed."""
+        target = int(now // self.resolution)
+        expired = []
+        # After a long pause one revolution visits every slot, so never walk more than that
+        for tick in range(max(self._tick + 1, target - self.slots + 1), target + 1):
+            self._tick = tick
+            index = tick % self.slots
+            keys, self._wheel[index] = self._wheel[index], set()
+            for key in keys:
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    continue
+                if deadline <= now:
+                    del self._deadlines[key]
+                    expired.append(key)
+                else:
+                    self._insert(key, deadline)
+        self._tick = max(self._tick, target)
+        return expired
+
+
+class FreshnessTracker:
+    """Marks channels stale when no sample arrived within their timeout, and bridges short gaps.
+
+    Keys are arbitrary, e.g. "power" or ("rider 3", "power"), so one tracker and one
+    timer wheel serve every channel of every rider.
+    """
+
+    def __init__(self, timeout=3.0, max_gap=1.5, period=0.25, timeouts=None, resolution=0.1):
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.max_gap = max_gap
+        self.period = period
+        self._wheel = TimerWheel(resolution, slots=max(8, int(2 * timeout / resolution)), now=time.monotonic())
+        self._last = {}
+        self._fresh = set()
+        self._lock = threading.Lock()
+
+    def seen(self, key, sample):
+        """Record a sample and return interpolated samples filling a short gap before it."""
+        with self._lock:
+            previous = self._last.get(key)
+            self._last[key] = sample
+            self._fresh.add(key)
+            self._wheel.schedule(key, sample.time + self.timeouts.get(key, self.timeout))
+
+        if previous is None:
+            return []
+        gap = sample.time - previous.time
+        if gap <= 1.5 * self.period or gap > self.max_gap:
+            return []
+        steps = round(gap / self.period)
+        step_value = (sample.value - previous.value) / steps
+        return [type(sample)(previous.value + step_value * i, previous.time + gap * i / steps)
+                for i in range(1, steps)]
+
+    def advance(self, now=None):
+        """Expire timed-out channels; call once per frame. Returns the keys that just went stale."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            expired = self._wheel.advance(now)
+            self._fresh.difference_update(expired)
+        return expired
+
+    def is_stale(self, key):
+        return key not in self._fresh
+
+    def last(self, key):
+        return self._last.get(key)
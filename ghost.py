@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import cachefile
+import resample
+
+# Indexed copies of ghost sessions are cached here, one file per session and step
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".ghost_cache")
+
+# Seconds between the rows of the index
+STEP = 1.0
+# A recorded value is held this many seconds at most; longer gaps in the ride read as missing
+MAX_GAP = 5.0
+
+# Columns of the index: held power, held heart rate, work done since the start in joules
+POWER, HEART_RATE, WORK = range(3)
+
+# Where the ghost is at one moment: its power and heart rate (None in a gap of the recording)
+# and how far ahead of it the rider is, in kilojoules of work
+GhostState = namedtuple("GhostState", ["power", "heart_rate", "delta"])
+
+# The ghost race the displays show, set by the launcher
+active = None
+
+
+def build_index(session, step=STEP):
+    """Resample a sessions.Session onto rows every `step` seconds: held power, heart rate and work so far."""
+    rows = int(np.ceil(session.duration / step)) + 1 if len(session) else 0
+    grid = np.arange(rows) * step
+    table = np.empty((rows, 3))
+    for column, channel in ((POWER, "power"), (HEART_RATE, "heart_rate")):
+        if channel in session.channels:
+            table[:, column] = resample.hold(session.times, session.channels[channel], grid, MAX_GAP)
+        else:
+            table[:, column] = np.nan
+    # Work at the start of each row, each row's power held over its step
+    table[0:1, WORK] = 0.0
+    np.cumsum(np.nan_to_num(table[:-1, POWER]) * step, out=table[1:, WORK])
+    return table
+
+
+def cache_path(path, step=STEP, cache_dir=CACHE_DIR):
+    name = os.path.basename(path).replace(".", "-")
+    return os.path.join(cache_dir, f"{name}-{step:g}s-{cachefile.source_key(path)}.npy")
+
+
+class Ghost:
+    """A recorded ride indexed by elapsed time: looking up any moment is one row of a memory-mapped array.
+
+    Only the rows the ride has reached are ever read from disk, so a ride of hours costs no
+    startup time and next to no resident memory.
+    """
+
+    def __init__(self, table, step=STEP, name=""):
+        # A plain array over the same mapping: indexing a numpy.memmap costs several times more
+        self.table = np.asarray(table)
+        self.step = step
+        self.name = name
+        self.duration = (len(table) - 1) * step if len(table) else 0.0
+
+    def at(self, elapsed):
+        """(power, heart rate, work) at elapsed seconds, values None in gaps; None outside the ride."""
+        row = int(elapsed / self.step)
+        if elapsed < 0 or row >= len(self.table):
+            return None
+        power, heart_rate, work = self.table[row].tolist()
+        if power == power:  # not NaN
+            work += power * (elapsed - row * self.step)
+        else:
+            power = None
+        return power, None if heart_rate != heart_rate else heart_rate, work
+
+
+def load_ghost(path, step=STEP, cache_dir=CACHE_DIR):
+    """Load a FIT or CSV session as a Ghost, indexing it and caching the index on disk on first use."""
+    cached = cache_path(path, step, cache_dir)
+    if not os.path.exists(cached):
+        import sessions
+        start = time.perf_counter()
+        table = build_index(sessions.load_session(path), step)
+        cachefile.write_atomic(cached, lambda temp: np.save(temp, table))
+        print(f"Indexed ghost session {os.path.basename(path)}: {len(table)} rows in "
+              f"{(time.perf_counter() - start) * 1000:.0f} ms")
+    return Ghost(np.load(cached, mmap_mode="r"), step, os.path.basename(path))
+
+
+class GhostRace:
+    """The rider against a Ghost ridden from the same start, on the time.monotonic() clock.
+
+    Register `add` with sensors.subscribers: it adds up the rider's work from the power samples,
+    each held until the next one and for at most `max_gap` seconds. It may be called from the
+    sensor thread while `current` runs on the display thread.
+    """
+
+    def __init__(self, ghost, max_gap=MAX_GAP):
+        self.ghost = ghost
+        self.max_gap = max_gap
+        self.start_time = None
+        # Work before the last power sample and that sample, replaced whole
+        self._work = (0.0, None)
+        self._lock = threading.Lock()
+
+    def start(self, now=None):
+        self.start_time = time.monotonic() if now is None else now
+
+    def add(self, channel, sample):
+        if channel != "power" or self.start_time is None or sample.time < self.start_time:
+            return
+        with self._lock:
+            work, last = self._work
+            if last is not None:
+                work += last.value * min(sample.time - last.time, self.max_gap)
+            self._work = (work, sample)
+
+    def rider_work(self, now):
+        work, last = self._work
+        if last is not None:
+            work += last.value * min(max(now - last.time, 0.0), self.max_gap)
+        return work
+
+    def current(self, now=None):
+        """The GhostState now, None before the start and after the end of the ghost's ride."""
+        if self.start_time is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        at = self.ghost.at(now - self.start_time)
+        if at is None:
+            return None
+        power, heart_rate, work = at
+        return GhostState(power, heart_rate, (self.rider_work(now) - work) / 1000)
@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import sys
+import time
+import zlib
+
+# Rendered off screen, so this runs on a kiosk over ssh or on a build machine
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+import workout
+from layout import Layout, load_scaled
+
+# Displays with the frame_state/draw_frame protocol, rendered through a backend
+DISPLAYS = ("steamdisplay8", "cyberpunk01")
+# The original variants, which run their own loop on module globals
+LEGACY_DISPLAYS = tuple(f"steamdisplay{n}" for n in range(1, 8))
+
+# Golden frames depend on the machine's pygame, SDL and fonts, so they are not committed:
+# run "python golden.py record" once on the machine that will check (the kiosk, or a build
+# machine with the same packages) before changing a display, then "check" after the change
+GOLDEN_DIR = "golden"
+FPS = 30
+
+# The difference hash compares neighbouring cells of a HASH_SIZE x HASH_SIZE grayscale thumbnail
+HASH_SIZE = 32
+# Hash bits a changed frame may differ by when there is no stored image to compare pixels
+# with. Needles a few pixels off often leave the hash alone, so keep this low on one machine;
+# raise it to compare against frames recorded with another pygame or SDL build.
+HASH_TOLERANCE = 0
+# Every KEYFRAME_EVERY-th frame (and the last) is stored as an image for the pixel diff
+KEYFRAME_EVERY = 100
+# Pixel diff: a channel differing by more than PIXEL_TOLERANCE counts the pixel as changed,
+# and a frame fails when more than MAX_CHANGED of its pixels changed
+PIXEL_TOLERANCE = 24
+MAX_CHANGED = 0.0005
+# Failing frames check writes out per display; a broken needle fails nearly every frame
+MAX_SAVED = 20
+
+# Targets for the scripted inputs: steady, ramp, a block near the top of the dial, free riding
+SCRIPT_WORKOUT = {"intervals": [
+    {"duration": 3, "power": 0.6, "label": "Steady"},
+    {"duration": 3, "power": [0.6, 1.2], "label": "Ramp"},
+    {"duration": 2, "power": 1.5, "label": "Hard"},
+    {"duration": 100, "power": None},
+]}
+SCRIPT_FTP = 250
+
+
+def script(frames):
+    """Scripted (heart rate, power, target) for every frame; None values are stale channels.
+
+    Covers rising and falling values, steps the needle physics has to chase, the top of each
+    dial, a sensor dropout and a workout with ramps, so a regression in any of them shows.
+    """
+    timeline = workout.compile_workout(SCRIPT_WORKOUT)
+    inputs = []
+    for i in range(frames):
+        phase = i / frames
+        heart_rate = 100 + 85 * min(phase / 0.4, 1.0)
+        if phase > 0.6:
+            heart_rate = 185 - 60 * (phase - 0.6) / 0.4
+        power = (0, 150, 300, 600, 950, 250, 420, 80)[int(phase * 8)]
+        if 0.7 <= phase < 0.78:
+            heart_rate = power = None
+        inputs.append((heart_rate, power, timeline.at(i / FPS, SCRIPT_FTP)))
+    return inputs
+
+
+def frame_hash(surface):
+    """Difference hash of a frame, as a Python int of HASH_SIZE * HASH_SIZE bits.
+
+    One smoothscale down to a thumbnail does nearly all the work, in C; comparing two hashes
+    is then one XOR and a bit count.
+    """
+    thumbnail = pygame.transform.smoothscale(surface, (HASH_SIZE + 1, HASH_SIZE))
+    rgb = pygame.surfarray.array3d(thumbnail).astype(np.int16)
+    gray = rgb[..., 0] * 3 + rgb[..., 1] * 6 + rgb[..., 2]  # x, y order from surfarray
+    bits = (gray[1:, :] > gray[:-1, :]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def frame_digest(surface):
+    """Checksum of a frame's pixels straight from its buffer: equal checksums are equal frames, the usual case."""
+    return zlib.crc32(surface.get_view("1"))
+
+
+def hash_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def pixel_diff(surface, golden):
+    """Fraction of pixels changed beyond PIXEL_TOLERANCE, and a mask image of them."""
+    if surface.get_size() != golden.get_size():
+        return 1.0, None
+    a = pygame.surfarray.array3d(surface).astype(np.int16)
+    b = pygame.surfarray.array3d(golden).astype(np.int16)
+    changed = (np.abs(a - b) > PIXEL_TOLERANCE).any(axis=2)
+    mask = np.zeros(a.shape, dtype=np.uint8)
+    mask[changed] = (255, 0, 255)
+    return changed.mean(), pygame.surfarray.make_surface(mask)
+
+
+def render_frames(display_name, inputs, visit):
+    """Render the scripted inputs on a display at its reference size, calling visit(index, surface) per frame.
+
+    The surface is only valid during the call, so whatever is kept of a frame is computed
+    there and no more than one frame is held at a time, even on a small kiosk board.
+    """
+    if display_name in LEGACY_DISPLAYS:
+        _render_legacy(display_name, inputs, visit)
+        return
+    # A fresh module each run: needle physics and smoothing keep their state in module globals
+    display = importlib.reload(importlib.import_module(display_name))
+    from renderer import SurfaceBackend
+    backend = SurfaceBackend(display.REFERENCE_SIZE, display.CAPTION)
+    layout = Layout(display.REFERENCE_SIZE, backend.size)
+    images = {name: backend.load(load_scaled(path, layout)) for name, path in display.ASSETS.items()}
+    # No strip chart: it scrolls with the wall clock, so it would never match
+    view = display.make_view(layout, images)
+    for i, (heart_rate, power, target) in enumerate(inputs):
+        state = display.frame_state(heart_rate, power, target)
+        display.draw_frame(backend, view, state, display.QUALITY_TIERS[0])
+        visit(i, backend.screen)
+
+
+class _FastClock:
+    def tick(self, framerate=0):
+        return 0
+
+
+def _render_legacy(display_name, inputs, visit):
+    """Run an original variant's own display_loop, feeding its globals and catching each flip.
+
+    The loop is driven from inside pygame.display.flip, so this renders exactly what the variant
+    draws; each frame is handed to `visit` right there, since the loop cannot be suspended.
+    """
+    rendered = 0
+
+    def flip():
+        nonlocal rendered
+        if rendered == len(inputs):
+            return  # the loop's last pass, after it saw the QUIT
+        visit(rendered, pygame.display.get_surface())
+        rendered += 1
+        if rendered < len(inputs):
+            heart_rate, power, _ = inputs[rendered]
+            # The original variants have no notion of a stale channel; a dropout reads as zero
+            display.heart_rate, display.power = heart_rate or 0, power or 0
+        else:
+            pygame.event.post(pygame.event.Event(pygame.QUIT))
+
+    patches = {(pygame.display, "flip"): flip, (pygame.time, "Clock"): _FastClock,
+               (pygame, "quit"): lambda: None}
+    saved = {key: getattr(*key) for key in patches}
+    try:
+        for (module, name), replacement in patches.items():
+            setattr(module, name, replacement)
+        # steamdisplay7 prints every needle update
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            display = importlib.reload(importlib.import_module(display_name))
+            heart_rate, power, _ = inputs[0]
+            display.heart_rate, display.power = heart_rate or 0, power or 0
+            pygame.event.clear()
+            display.display_loop()
+    finally:
+        for (module, name), original in saved.items():
+            setattr(module, name, original)
+
+
+def _paths(directory, display_name):
+    return os.path.join(directory, f"{display_name}.json"), os.path.join(directory, display_name)
+
+
+def record(display_name, frames, directory=GOLDEN_DIR, keyframe_every=KEYFRAME_EVERY):
+    """Render the script and store every frame's hash and every keyframe's image as the golden frames."""
+    index_path, image_dir = _paths(directory, display_name)
+    os.makedirs(image_dir, exist_ok=True)
+    digests = []
+    hashes = []
+    keyframes = []
+
+    def visit(i, surface):
+        digests.append(frame_digest(surface))
+        hashes.append(format(frame_hash(surface), "x"))
+        if i % keyframe_every == 0 or i == frames - 1:
+            pygame.image.save(surface, os.path.join(image_dir, f"{i:05d}.png"))
+            keyframes.append(i)
+
+    render_frames(display_name, script(frames), visit)
+    with open(index_path, "w") as f:
+        json.dump({"frames": frames, "hash_size": HASH_SIZE, "keyframes": keyframes, "digests": digests,
+                   "hashes": hashes}, f, indent=0)
+    return len(hashes)
+
+
+def check(display_name, directory=GOLDEN_DIR, out_dir=None, hash_tolerance=HASH_TOLERANCE):
+    """Render the script again and compare it with the golden frames.
+
+    A frame with the golden digest passes straight away. Otherwise a keyframe gets the pixel
+    diff, which tells a few antialiasing pixels apart from a moved needle, and any other frame
+    passes only within `hash_tolerance` bits of the golden perceptual hash. Failing frames, and
+    the diff masks of failing keyframes, are written to `out_dir`.
+
+    Returns the failures as (frame, reason) and the number of frames that changed but passed.
+    """
+    index_path, image_dir = _paths(directory, display_name)
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"no golden frames in {index_path}, record them on this machine first: "
+                                f"python golden.py record {display_name}")
+    with open(index_path) as f:
+        golden = json.load(f)
+    if golden["hash_size"] != HASH_SIZE:
+        raise ValueError(f"{index_path} was recorded with {golden['hash_size']}-cell hashes, re-record it")
+    keyframes = set(golden["keyframes"])
+    failures = []
+    near = 0
+
+    def visit(i, surface):
+        nonlocal near
+        if frame_digest(surface) == golden["digests"][i]:
+            return
+        mask = None
+        if i in keyframes:
+            changed, mask = pixel_diff(surface, pygame.image.load(os.path.join(image_dir, f"{i:05d}.png")))
+            passed = changed <= MAX_CHANGED
+            reason = f"{changed:.2%} of pixels changed"
+        else:
+            distance = hash_distance(frame_hash(surface), int(golden["hashes"][i], 16))
+            passed = distance <= hash_tolerance
+            reason = f"perceptual hash differs by {distance} bits"
+        if passed:
+            near += 1
+            return
+        failures.append((i, reason))
+        if out_dir and len(failures) <= MAX_SAVED:
+            os.makedirs(out_dir, exist_ok=True)
+            pygame.image.save(surface, os.path.join(out_dir, f"{display_name}-{i:05d}.png"))
+            if mask is not None:
+                pygame.image.save(mask, os.path.join(out_dir, f"{display_name}-{i:05d}-diff.png"))
+
+    render_frames(display_name, script(golden["frames"]), visit)
+    return failures, near
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render scripted frames of the displays and compare them "
+                                                 "with stored golden frames")
+    parser.add_argument("command", choices=("record", "check"))
+    parser.add_argument("displays", nargs="*", help="default all of them")
+    parser.add_argument("--frames", type=int, default=300, help="frames to record")
+    parser.add_argument("--dir", default=GOLDEN_DIR, help="golden frame directory")
+    parser.add_argument("--out", default="golden-failures", help="where check writes failing frames")
+    parser.add_argument("--hash-tolerance", type=int, default=HASH_TOLERANCE)
+    args = parser.parse_args()
+
+    # The original variants load their images relative to the working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    pygame.init()
+    failed = False
+    for name in args.displays or LEGACY_DISPLAYS + DISPLAYS:
+        start = time.perf_counter()
+        try:
+            if args.command == "record":
+                count = record(name, args.frames, args.dir)
+                print(f"{name}: recorded {count} frames in {time.perf_counter() - start:.1f} s")
+                continue
+            failures, near = check(name, args.dir, args.out, args.hash_tolerance)
+        except Exception as e:
+            # steamdisplay1's offset indexing, for one, cannot draw a frame; report it and go on
+            print(f"{name}: could not render: {e!r}")
+            failed = True
+            continue
+        print(f"{name}: {len(failures)} frames differ, {near} more changed within tolerance "
+              f"({time.perf_counter() - start:.1f} s)")
+        for i, reason in failures[:10]:
+            print(f"  frame {i}: {reason}")
+        failed = failed or bool(failures)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
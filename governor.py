@@ -0,0 +1,61 @@
+import time
+from collections import deque
+
+
+class FrameGovernor:
+    """Keeps frame cost under budget by stepping through render quality tiers.
+
+    Tier 0 is the best quality, higher tiers are cheaper. Every `window` frames the
+    governor looks at the 90th percentile of the measured frame cost: above `high` of the
+    budget it steps one tier down in quality, below `low` (and at least `hold` seconds after
+    the last change) it steps one tier back up.
+    """
+
+    def __init__(self, tiers, fps=30, window=30, high=0.85, low=0.5, hold=3.0):
+        self.tiers = tiers
+        self.budget = 1.0 / fps
+        self.window = window
+        self.high = high
+        self.low = low
+        self.hold = hold
+        self.tier = 0
+        self.costs = deque(maxlen=window)
+        self.changes = 0
+        self._frames = 0
+        self._start = None
+        self._last_change = time.monotonic()
+
+    @property
+    def quality(self):
+        """Settings of the current tier."""
+        return self.tiers[self.tier]
+
+    def begin(self):
+        """Call at the start of a frame's work, after waiting for the clock."""
+        self._start = time.perf_counter()
+
+    def end(self):
+        """Call when the frame has been presented; returns its cost in seconds."""
+        cost = time.perf_counter() - self._start
+        self.costs.append(cost)
+        self._frames += 1
+        if self._frames >= self.window:
+            self._frames = 0
+            self._adjust()
+        return cost
+
+    def _adjust(self):
+        costs = sorted(self.costs)
+        p90 = costs[int(len(costs) * 0.9) - 1]
+        now = time.monotonic()
+        if p90 > self.high * self.budget and self.tier < len(self.tiers) - 1:
+            self.tier += 1
+        elif p90 < self.low * self.budget and self.tier > 0 and now - self._last_change > self.hold:
+            self.tier -= 1
+        else:
+            return
+        self.changes += 1
+        self._last_change = now
+        print(f"Frame governor: quality tier {self.tier} (p90 frame cost {p90 * 1000:.1f} ms, "
+              f"budget {self.budget * 1000:.1f} ms)")
+        self.costs.clear()
@@ -0,0 +1,252 @@
+import math
+from collections import deque
+
+# Beat event times count 1/1024 s and roll over every 64 s, beat counts every 256 beats.
+# After this many seconds without a page either may have rolled over unseen, so start over.
+MAX_GAP = 30.0
+
+# R-R intervals outside this range, in seconds (240 and 30 bpm), are artifacts
+RR_MIN = 0.25
+RR_MAX = 2.0
+# An interval differing from the last accepted one by more than this fraction is an artifact,
+# unless MAX_REJECTS in a row were: then the rhythm itself changed
+MAX_CHANGE = 0.3
+MAX_REJECTS = 3
+
+# Seconds of beats the statistics cover, and beats needed before they are reported
+WINDOW = 120.0
+MIN_BEATS = 30
+# Box sizes in beats for DFA alpha1, the short-term scaling exponent
+DFA_SCALES = tuple(range(4, 17))
+
+
+class BeatIntervals:
+    """R-R intervals from the beat count and beat event time of ANT+ heart rate pages.
+
+    Every heart rate data page carries the time of the latest beat and a running beat count.
+    Consecutive beats give one interval each. When pages were missed and the count jumped,
+    page 4's previous beat time still gives the interval before the latest beat; the ones
+    before that are lost.
+    """
+
+    def __init__(self, max_gap=MAX_GAP):
+        self.max_gap = max_gap
+        self.missed = 0  # beats whose interval could not be recovered
+        self.restarts = 0
+        self._last = None  # (beat count, beat time in 1/1024 s, time received)
+
+    def update(self, beat_count, beat_time, received, previous_beat_time=None):
+        """Take one page's fields, times in 1/1024 s; returns the new intervals as (seconds, follows).
+
+        `follows` is False for an interval whose preceding interval was lost. Repeats of the
+        last beat return nothing.
+        """
+        last = self._last
+        self._last = (beat_count, beat_time, received)
+        if last is None or received - last[2] > self.max_gap:
+            if last is not None:
+                self.restarts += 1
+            return []
+        beats = (beat_count - last[0]) & 0xFF
+        if beats == 0:
+            return []
+        if beats == 1:
+            return [(((beat_time - last[1]) & 0xFFFF) / 1024, True)]
+        if previous_beat_time is None:
+            self.missed += beats
+            return []
+        latest = (((beat_time - previous_beat_time) & 0xFFFF) / 1024, beats == 2)
+        if beats == 2:
+            # Only the beat in between was missed, and page 4 says when it was
+            return [(((previous_beat_time - last[1]) & 0xFFFF) / 1024, True), latest]
+        self.missed += beats - 1
+        return [latest]
+
+
+class _DfaScale:
+    """Detrended fluctuation of one box size, one box at a time.
+
+    Boxes are aligned to the beat number, so a box is fitted once, when its last beat arrives,
+    from running sums: no profile is kept and nothing is refitted when the window slides.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        n = size
+        self._sk = n * (n - 1) / 2
+        self._skk = (n - 1) * n * (2 * n - 1) / 6
+        self._det = n * self._skk - self._sk * self._sk
+        self.boxes = deque()  # (time of the first beat, residual sum of squares)
+        self.total = 0.0  # residual sum of squares of the boxes in the window
+        self._reset_box()
+
+    def _reset_box(self):
+        self._k = 0
+        self._y0 = 0.0
+        self._start = None
+        self._sy = self._sky = self._syy = 0.0
+
+    def add(self, y, t):
+        if self._k == 0:
+            self._y0, self._start = y, t
+        # Relative to the box's first value: the detrending removes any offset anyway
+        v = y - self._y0
+        self._sy += v
+        self._sky += self._k * v
+        self._syy += v * v
+        self._k += 1
+        if self._k == self.size:
+            n = self.size
+            slope = (n * self._sky - self._sk * self._sy) / self._det
+            intercept = (self._sy - slope * self._sk) / n
+            residual = max(self._syy - intercept * self._sy - slope * self._sky, 0.0)
+            self.boxes.append((self._start, residual))
+            self.total += residual
+            self._reset_box()
+
+    def expire(self, start):
+        boxes = self.boxes
+        while boxes and boxes[0][0] < start:
+            self.total -= boxes.popleft()[1]
+        if not boxes:
+            self.total = 0.0
+
+    def fluctuation(self):
+        if len(self.boxes) < 2:
+            return None
+        return math.sqrt(max(self.total, 0.0) / (len(self.boxes) * self.size))
+
+
+class HeartRateVariability:
+    """RMSSD, SDNN and DFA alpha1 over the R-R intervals of the last `window` seconds.
+
+    Each interval updates running sums in O(1), plus one step per DFA box size; reading the
+    statistics costs a few square roots and a 13-point line fit. Artifacts are dropped and,
+    like lost intervals, never paired with their neighbours for RMSSD.
+    """
+
+    def __init__(self, window=WINDOW, scales=DFA_SCALES, min_beats=MIN_BEATS):
+        self.window = window
+        self.min_beats = min_beats
+        self.intervals = BeatIntervals()
+        self.artifacts = 0
+        self._beats = deque()  # (time, interval, squared difference from the previous one or None)
+        self._sum = self._sum_squares = 0.0
+        self._diff_sum = 0.0
+        self._diffs = 0
+        self._previous = None  # last accepted interval, None after a lost or rejected one
+        self._reference = None  # last accepted interval, for the artifact check
+        self._rejects = 0
+        self._profile = 0.0
+        self._profile_reference = None
+        self._updates = 0
+        self._scales = [_DfaScale(size) for size in scales]
+        logs = [math.log(size) for size in scales]
+        mean = sum(logs) / len(logs)
+        self._log_scales = [x - mean for x in logs]
+        self._log_spread = sum(x * x for x in self._log_scales)
+
+    def update(self, beat_count, beat_time, received, previous_beat_time=None):
+        """Take one heart rate page's beat fields (see BeatIntervals.update); returns the intervals accepted."""
+        restarts = self.intervals.restarts
+        intervals = self.intervals.update(beat_count, beat_time, received, previous_beat_time)
+        if self.intervals.restarts != restarts:
+            self.reset()
+        accepted = []
+        for interval, follows in intervals:
+            if self.add(interval, received, follows):
+                accepted.append(interval)
+        return accepted
+
+    def reset(self):
+        self._beats.clear()
+        self._sum = self._sum_squares = self._diff_sum = 0.0
+        self._diffs = 0
+        self._previous = self._reference = None
+        self._rejects = 0
+        self._profile = 0.0
+        self._profile_reference = None
+        self._scales = [_DfaScale(scale.size) for scale in self._scales]
+
+    def add(self, interval, t, follows=True):
+        """Add one R-R interval in seconds ending at time t; returns False when it was rejected as an artifact."""
+        reference = self._reference
+        if not RR_MIN <= interval <= RR_MAX or (
+                reference is not None and abs(interval - reference) > MAX_CHANGE * reference
+                and self._rejects < MAX_REJECTS):
+            self.artifacts += 1
+            self._rejects += 1
+            self._previous = None
+            return False
+        self._rejects = 0
+        self._reference = interval
+
+        square = None
+        if follows and self._previous is not None:
+            square = (interval - self._previous) ** 2
+            self._diff_sum += square
+            self._diffs += 1
+        self._previous = interval
+        self._beats.append((t, interval, square))
+        self._sum += interval
+        self._sum_squares += interval * interval
+
+        # Integrated profile of the intervals. Any constant reference in place of the mean only
+        # adds a linear trend, which each box's fit removes.
+        if self._profile_reference is None:
+            self._profile_reference = interval
+        self._profile += interval - self._profile_reference
+        start = t - self.window
+        for scale in self._scales:
+            scale.add(self._profile, t)
+            scale.expire(start)
+
+        beats = self._beats
+        while beats[0][0] < start:
+            _, old, old_square = beats.popleft()
+            self._sum -= old
+            self._sum_squares -= old * old
+            if old_square is not None:
+                self._diff_sum -= old_square
+                self._diffs -= 1
+            # The new first beat's difference was from the beat that just left
+            if beats and beats[0][2] is not None:
+                self._diff_sum -= beats[0][2]
+                self._diffs -= 1
+                beats[0] = beats[0][:2] + (None,)
+        # Running sums drift with every subtraction; start them over from the window now and then
+        self._updates += 1
+        if self._updates % 1000 == 0:
+            self._sum = math.fsum(b[1] for b in beats)
+            self._sum_squares = math.fsum(b[1] * b[1] for b in beats)
+            self._diff_sum = math.fsum(b[2] for b in beats if b[2] is not None)
+        return True
+
+    def __len__(self):
+        return len(self._beats)
+
+    def rmssd(self):
+        """Root mean square of successive differences, in ms; None until the window holds enough beats."""
+        if len(self._beats) < self.min_beats or not self._diffs:
+            return None
+        return 1000 * math.sqrt(max(self._diff_sum, 0.0) / self._diffs)
+
+    def sdnn(self):
+        """Standard deviation of the intervals, in ms."""
+        n = len(self._beats)
+        if n < self.min_beats:
+            return None
+        variance = (self._sum_squares - self._sum * self._sum / n) / (n - 1)
+        return 1000 * math.sqrt(max(variance, 0.0))
+
+    def dfa_alpha1(self):
+        """Slope of log fluctuation over log box size, for boxes of 4 to 16 beats; about 0.75 marks the aerobic threshold."""
+        if len(self._beats) < self.min_beats:
+            return None
+        slope = 0.0
+        for x, scale in zip(self._log_scales, self._scales):
+            fluctuation = scale.fluctuation()
+            if not fluctuation:
+                return None
+            slope += x * math.log(fluctuation)
+        return slope / self._log_spread
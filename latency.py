@@ -0,0 +1,80 @@
+import time
+
+
+class LatencyHistogram:
+    """Fixed-width histogram of sample ages, cheap enough to update every frame."""
+
+    def __init__(self, bucket_ms=10, max_ms=2000):
+        self.bucket_ms = bucket_ms
+        # The last bucket collects everything at or above max_ms
+        self.counts = [0] * (max_ms // bucket_ms + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, age):
+        """Record one age, in seconds."""
+        ms = age * 1000
+        index = min(int(ms // self.bucket_ms), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        """Upper edge, in ms, of the bucket holding the p-th percentile."""
+        if not self.count:
+            return None
+        target = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return (index + 1) * self.bucket_ms
+        return len(self.counts) * self.bucket_ms
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def format(self, width=40):
+        lines = [f"n={self.count} mean={self.mean():.1f} ms p50={self.percentile(50)} ms "
+                 f"p90={self.percentile(90)} ms p99={self.percentile(99)} ms max={self.max:.1f} ms"]
+        peak = max(self.counts)
+        for index, count in enumerate(self.counts):
+            if count:
+                bar = "#" * max(1, round(count / peak * width))
+                lines.append(f"  {index * self.bucket_ms:5d}-{(index + 1) * self.bucket_ms:<5d} ms {count:7d} {bar}")
+        return "\n".join(lines)
+
+
+class FrameLatency:
+    """Per-channel sensor-to-photon latency: the age of each shown value when the frame is flipped."""
+
+    def __init__(self, bucket_ms=10, max_ms=2000):
+        self.bucket_ms = bucket_ms
+        self.max_ms = max_ms
+        self.histograms = {}
+
+    def record(self, samples, now=None):
+        """Call right after the flip with the {channel: Sample} values the frame showed, None if not shown."""
+        if now is None:
+            now = time.monotonic()
+        for channel, sample in samples.items():
+            if sample is None or sample.time is None:
+                continue
+            histogram = self.histograms.get(channel)
+            if histogram is None:
+                histogram = self.histograms[channel] = LatencyHistogram(self.bucket_ms, self.max_ms)
+            histogram.add(now - sample.time)
+
+    def report(self):
+        if not self.histograms:
+            return
+        print("Sensor-to-photon latency:")
+        for channel, histogram in self.histograms.items():
+            print(f"{channel}: {histogram.format()}")
+
+
+# Shared recorder the display loops write to and the launcher reports at exit
+frames = FrameLatency()
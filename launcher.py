@@ -0,0 +1,270 @@
+import argparse
+import importlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import pygame
+
+import assetbudget
+import flightrec
+import latency
+import metrics
+import samplebus
+import sensors
+from layout import Layout, SIZE_ENV_VAR, load_scaled, screen_size
+from renderer import BACKEND_ENV_VAR, BACKENDS, create_backend
+
+# Displays the launcher knows how to start, by module name
+DISPLAYS = ("steamdisplay8", "cyberpunk01")
+
+
+class StartupTimer:
+    """Collects named startup phase durations, from any thread."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases.append((name, seconds))
+
+    def mark(self, name, since):
+        """Record the time spent since `since` and return now, for chaining phases."""
+        now = time.perf_counter()
+        self.record(name, now - since)
+        return now
+
+    def report(self):
+        with self._lock:
+            phases = list(self.phases)
+        print("Startup timing:")
+        for name, seconds in phases:
+            print(f"  {name:<24} {seconds * 1000:8.1f} ms")
+        print(f"  {'total':<24} {(time.perf_counter() - self.start) * 1000:8.1f} ms")
+
+
+def show_splash(backend, layout, text="Loading..."):
+    """Put something on screen before any asset has been loaded."""
+    font = pygame.font.Font(None, layout.length(36))
+    label = font.render(text, True, (255, 255, 255))
+    center = layout.rel(0.5, 0.5)
+    backend.clear((0, 0, 0))
+    backend.blit_surface(label, (center[0] - label.get_width() // 2, center[1] - label.get_height() // 2))
+    backend.present()
+
+
+def load_assets(backend, layout, files, timer=None, max_workers=4):
+    """Decode and pre-scale the asset files on a thread pool, keeping the window responsive meanwhile."""
+    start = time.perf_counter()
+
+    def load(path):
+        t = time.perf_counter()
+        surface = load_scaled(path, layout)
+        if timer:
+            timer.record(f"  load {os.path.basename(path)}", time.perf_counter() - t)
+        return surface
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(load, path): name for name, path in files.items()}
+        surfaces = {}
+        while pending:
+            done, _ = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+            for future in done:
+                surfaces[pending.pop(future)] = future.result()
+            pygame.event.pump()
+
+    # Display conversion and texture upload have to happen on the main thread
+    if assetbudget.enabled() and backend.name == "surface":
+        images = assetbudget.load_budgeted(backend, surfaces)
+    else:
+        images = {name: backend.load(surface) for name, surface in surfaces.items()}
+    if timer:
+        timer.record("assets", time.perf_counter() - start)
+    return images
+
+
+def launch(display, start_sensors=True, replay=None, speed=1.0, erg=None, erg_mode="erg", simulate_trainer=False,
+           workout_file=None, ftp=250, workout_erg=False, power_mode="instantaneous", ghost_file=None,
+           cp=None, w_prime=20000.0):
+    """Start a display module: first frame, then assets and ANT+ in parallel, then its display loop.
+
+    With `replay` set to a FIT or CSV file the recorded session is played instead of starting ANT+,
+    with WORKOUT_DISPLAY_SAMPLE_BUS set the samples come from samplebus.py in another process,
+    with `simulate_trainer` a simulated trainer and rider. `erg` holds the trainer at that many watts.
+    `workout_file` shows a workout's targets scaled to `ftp`; with `workout_erg` it also drives the trainer.
+    `power_mode` is sensors.power_mode, "accumulated" for exact averages from the power counters.
+    `ghost_file` is a FIT or CSV session to race against, from when the display loop starts.
+    With `cp` set the displays show the rider's W' balance for that critical power and `w_prime`.
+    """
+    bus = os.environ.get(samplebus.BUS_ENV_VAR)
+    if bus and (erg is not None or workout_erg):
+        raise ValueError("The trainer belongs to the acquisition process of the sample bus, give it --erg there")
+    if power_mode not in ("instantaneous", "accumulated"):
+        raise ValueError(f"Unknown power mode {power_mode!r}, expected 'instantaneous' or 'accumulated'")
+    sensors.power_mode = power_mode
+    timer = StartupTimer()
+    since = timer.start
+
+    # Displays that draw with pygame.draw list the backends they support
+    supported = getattr(display, "BACKENDS", tuple(BACKENDS))
+    backend_name = os.environ.get(BACKEND_ENV_VAR, supported[0])
+    if backend_name not in supported:
+        raise ValueError(f"{display.__name__} does not support the {backend_name!r} backend")
+
+    pygame.init()
+    fullscreen = getattr(display, "FULLSCREEN", False)
+    size = screen_size(display.REFERENCE_SIZE, fullscreen=fullscreen)
+    backend = create_backend(size, display.CAPTION, pygame.FULLSCREEN if fullscreen else 0, backend_name)
+    layout = Layout(display.REFERENCE_SIZE, backend.size)
+    since = timer.mark("window", since)
+
+    show_splash(backend, layout)
+    since = timer.mark("first frame", since)
+
+    recorder = None
+    record_path = os.environ.get(flightrec.RECORDER_ENV_VAR)
+    if record_path:
+        recorder = sensors.recorder = flightrec.FlightRecorder(record_path)
+
+    source = None
+    if replay and replay.endswith(".ring"):
+        # Raw ANT+ pages from a flight recorder, decoded by openant as if they had just arrived
+        source = flightrec.ReplaySource(flightrec.read_records(replay), speed)
+        source.start()
+    elif replay:
+        import sessions
+        session = sessions.load_session(replay)
+        since = timer.mark(f"load {os.path.basename(replay)}", since)
+        source = sessions.ReplaySource(session, speed)
+        source.start()
+    elif bus:
+        # Samples from the acquisition process that owns the ANT+ node
+        source = samplebus.BusSource(bus)
+        source.start()
+    elif simulate_trainer:
+        from trainersim import TrainerSimulator
+        source = TrainerSimulator()
+        source.start()
+    elif start_sensors:
+        # The node thread imports openant itself, so it overlaps with asset loading
+        sensors.start_ant_node(timer)
+
+    session = None
+    if workout_file:
+        import workout
+        session = workout.active = workout.WorkoutSession(workout.load_workout(workout_file), ftp)
+        since = timer.mark(f"load {os.path.basename(workout_file)}", since)
+
+    race = None
+    if ghost_file:
+        import ghost
+        race = ghost.active = ghost.GhostRace(ghost.load_ghost(ghost_file))
+        sensors.subscribers.append(race.add)
+        since = timer.mark(f"load {os.path.basename(ghost_file)}", since)
+
+    balance = None
+    if cp:
+        import wbal
+        balance = wbal.active = wbal.WPrimeBalance(cp, w_prime)
+        sensors.subscribers.append(balance.add)
+
+    controller = None
+    if erg is not None or (session and workout_erg):
+        from erg import ErgController
+        controller = ErgController(source if simulate_trainer else None, erg_mode, target=erg or 0.0,
+                                   target_source=session.target_power if session and workout_erg else None)
+        controller.start()
+
+    images = load_assets(backend, layout, display.ASSETS, timer)
+    timer.report()
+
+    server = None
+    port = os.environ.get(metrics.PORT_ENV_VAR)
+    if port:
+        server = metrics.serve(int(port))
+
+    if session:
+        session.start()
+    if race:
+        race.start()
+    try:
+        display.display_loop(backend, layout, images)
+    finally:
+        if server:
+            server.shutdown()
+        if race:
+            sensors.subscribers.remove(race.add)
+        if balance:
+            sensors.subscribers.remove(balance.add)
+        if controller:
+            controller.stop()
+        if source:
+            source.stop()
+        sensors.stop_ant_node()
+        if recorder:
+            sensors.recorder = None
+            recorder.close()
+        pygame.quit()
+        latency.frames.report()
+        sensors.dispatcher.report()
+        if controller:
+            controller.report()
+        if balance:
+            print(f"Lowest W' balance {balance.minimum / 1000:.1f} kJ ({balance.minimum / balance.w_prime:.0%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start one of the workout displays")
+    parser.add_argument("display", choices=DISPLAYS)
+    parser.add_argument("--backend", help="render backend, surface or texture")
+    parser.add_argument("--size", help="screen size as WIDTHxHEIGHT")
+    parser.add_argument("--memory-budget", action="store_true",
+                        help="store assets cropped or RLE-accelerated where they allow it (surface backend)")
+    parser.add_argument("--no-ant", action="store_true", help="do not start the ANT+ node")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="play a recorded FIT or CSV session, or a flight recorder .ring file, instead of ANT+")
+    parser.add_argument("--bus", nargs="?", const=samplebus.DEFAULT_PATH, metavar="FILE",
+                        help="show the samples samplebus.py publishes from another process instead of ANT+")
+    parser.add_argument("--record", metavar="FILE", help="keep the raw ANT+ pages in this flight recorder ring file")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--erg", type=float, metavar="WATTS", help="hold the FE-C trainer at this power")
+    parser.add_argument("--erg-mode", choices=("erg", "resistance"), default="erg",
+                        help="use the trainer's ERG mode or control its resistance from here")
+    parser.add_argument("--simulate-trainer", action="store_true",
+                        help="simulated trainer and rider instead of ANT+")
+    parser.add_argument("--workout", metavar="FILE", help="JSON or .zwo workout whose targets to show")
+    parser.add_argument("--ftp", type=float, default=250, help="rider FTP in watts, scales the workout")
+    parser.add_argument("--workout-erg", action="store_true", help="let the workout set the trainer's target power")
+    parser.add_argument("--ghost", metavar="FILE", help="race a recorded FIT or CSV session from the start")
+    parser.add_argument("--cp", type=float, metavar="WATTS", help="rider critical power, shows the W' balance")
+    parser.add_argument("--w-prime", type=float, default=20000, metavar="JOULES", help="rider W', for --cp")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--power-mode", choices=("instantaneous", "accumulated"), default="instantaneous",
+                        help="show each page's instantaneous power or exact averages from the power counters")
+    args = parser.parse_args()
+
+    if args.backend:
+        os.environ[BACKEND_ENV_VAR] = args.backend
+    if args.size:
+        os.environ[SIZE_ENV_VAR] = args.size
+    if args.record:
+        os.environ[flightrec.RECORDER_ENV_VAR] = args.record
+    if args.bus:
+        os.environ[samplebus.BUS_ENV_VAR] = args.bus
+    if args.memory_budget:
+        os.environ[assetbudget.BUDGET_ENV_VAR] = "1"
+    if args.metrics_port is not None:
+        os.environ[metrics.PORT_ENV_VAR] = str(args.metrics_port)
+
+    launch(importlib.import_module(args.display), start_sensors=not args.no_ant, replay=args.replay, speed=args.speed,
+           erg=args.erg, erg_mode=args.erg_mode, simulate_trainer=args.simulate_trainer,
+           workout_file=args.workout, ftp=args.ftp, workout_erg=args.workout_erg, power_mode=args.power_mode,
+           ghost_file=args.ghost, cp=args.cp, w_prime=args.w_prime)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+import struct
+import pygame
+
+import cachefile
+
+# Scaled copies of the PNG assets are cached here, one file per target size
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".asset_cache")
+
+# Set this to e.g. "1920x1080" to override the screen size picked at startup
+SIZE_ENV_VAR = "WORKOUT_DISPLAY_SIZE"
+
+
+def parse_size(text):
+    """Parse a "WIDTHxHEIGHT" string into a (width, height) tuple."""
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def screen_size(reference_size, fullscreen=False):
+    """Pick the target resolution: the env override, the desktop size when fullscreen, else the reference size."""
+    override = os.environ.get(SIZE_ENV_VAR)
+    if override:
+        return parse_size(override)
+    if fullscreen:
+        desktops = pygame.display.get_desktop_sizes()
+        if desktops:
+            return desktops[0]
+    return tuple(reference_size)
+
+
+class Layout:
+    """Maps geometry from one reference layout onto the actual screen size."""
+
+    def __init__(self, reference_size, size):
+        self.reference_size = tuple(reference_size)
+        self.size = tuple(size)
+
+        # One uniform scale so the dials stay round, letterboxed into the screen
+        self.scale = min(size[0] / reference_size[0], size[1] / reference_size[1])
+        self.offset_x = (size[0] - reference_size[0] * self.scale) / 2
+        self.offset_y = (size[1] - reference_size[1] * self.scale) / 2
+
+    def length(self, value):
+        """Scale a reference length (arc width, font size, ...)."""
+        return max(1, round(value * self.scale))
+
+    def point(self, x, y):
+        """Map a point given in reference pixels onto the screen."""
+        return (round(self.offset_x + x * self.scale), round(self.offset_y + y * self.scale))
+
+    def rel(self, fx, fy):
+        """Map a point given in normalized (0-1) reference coordinates onto the screen."""
+        return self.point(fx * self.reference_size[0], fy * self.reference_size[1])
+
+    def rect(self, x, y, width, height):
+        """Map a rect given in reference pixels onto the screen."""
+        return pygame.Rect(self.point(x, y), (self.length(width), self.length(height)))
+
+    def image_size(self, size):
+        return (self.length(size[0]), self.length(size[1]))
+
+
+# Outcomes of load_scaled, for the metrics endpoint
+cache_stats = {"hit": 0, "miss": 0, "unscaled": 0, "written_bytes": 0}
+
+
+def png_size(path):
+    """Read the pixel size from a PNG header without decoding the image."""
+    with open(path, "rb") as f:
+        header = f.read(24)
+    if header[:8] != b"\x89PNG\r\n\x1a\n" or header[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", header[16:24])
+
+
+def cache_path(path, size, cache_dir=CACHE_DIR):
+    name, _ = os.path.splitext(os.path.basename(path))
+    return os.path.join(cache_dir, f"{name}-{size[0]}x{size[1]}-{cachefile.source_key(path)}.png")
+
+
+def load_scaled(path, layout, cache_dir=CACHE_DIR):
+    """Load an asset pre-scaled to the layout, smoothscaling and caching it on disk on first use."""
+    source_size = png_size(path)
+    image = None
+    if source_size is None:
+        image = pygame.image.load(path)
+        source_size = image.get_size()
+
+    size = layout.image_size(source_size)
+    if size == tuple(source_size):
+        if image is None:
+            image = pygame.image.load(path)
+        cache_stats["unscaled"] += 1
+        return image
+
+    cached = cache_path(path, size, cache_dir)
+    if os.path.exists(cached):
+        cache_stats["hit"] += 1
+        return pygame.image.load(cached)
+    cache_stats["miss"] += 1
+
+    if image is None:
+        image = pygame.image.load(path)
+    if image.get_bitsize() < 24:
+        # smoothscale only handles 24 and 32 bit surfaces
+        converted = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+        converted.blit(image, (0, 0))
+        image = converted
+    scaled = pygame.transform.smoothscale(image, size)
+
+    cachefile.write_atomic(cached, lambda temp: pygame.image.save(scaled, temp))
+    cache_stats["written_bytes"] += os.path.getsize(cached)
+    return scaled
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import assetbudget
+import latency
+import layout
+import sensors
+
+# Set this to a port number to serve /metrics from every display started by the launcher
+PORT_ENV_VAR = "WORKOUT_DISPLAY_METRICS_PORT"
+
+PREFIX = "workoutdisplay"
+
+# Upper bounds of the frame time histogram buckets, in seconds
+FRAME_BUCKETS = (0.002, 0.004, 0.008, 0.012, 0.016, 0.025, 0.033, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Bucket bounds the display latency histograms are merged into for export, in seconds;
+# latency.LatencyHistogram keeps far finer buckets than a scrape needs
+LATENCY_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 1.0, 2.0)
+
+
+class FrameMetrics:
+    """Frame time histogram and dropped frame count, written by the display loop.
+
+    Everything lives in arrays allocated up front, so observing a frame only updates numbers
+    in place. The scrape thread reads them without a lock; a scrape may see one frame half
+    counted, which a monitoring system does not care about.
+    """
+
+    def __init__(self, fps=30, buckets=FRAME_BUCKETS):
+        self.period = 1.0 / fps
+        self.buckets = buckets
+        self.counts = array("q", [0] * (len(buckets) + 1))  # last slot is +Inf
+        self.totals = array("d", [0.0, 0.0])  # sum of frame times, time of the last frame
+        self.dropped = array("q", [0])
+
+    def observe(self, cost, now=None):
+        """Record one frame that took `cost` seconds of work; call once per frame."""
+        if now is None:
+            now = time.monotonic()
+        index = 0
+        for bound in self.buckets:
+            if cost <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.totals[0] += cost
+        # A gap of more than one and a half periods since the last frame means frames were missed
+        last = self.totals[1]
+        if last and now - last > 1.5 * self.period:
+            self.dropped[0] += int((now - last) / self.period + 0.5) - 1
+        self.totals[1] = now
+
+
+# Frames of the display loop running in this process
+frames = FrameMetrics()
+
+
+def _memory_bytes():
+    """Resident set size now, from /proc where there is one, else the peak from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        import resource
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def render(now=None):
+    """All metrics in the Prometheus text exposition format."""
+    if now is None:
+        now = time.monotonic()
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for suffix, labels, value in samples:
+            label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+            lines.append(f"{PREFIX}_{name}{suffix}{label_text} {value}")
+
+    def histogram(bounds, counts, total, labels=()):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(bounds, counts):
+            cumulative += count
+            samples.append(("_bucket", labels + (("le", bound),), cumulative))
+        cumulative += counts[-1]  # one more count than bounds: the overflow bucket
+        samples.append(("_bucket", labels + (("le", "+Inf"),), cumulative))
+        samples.append(("_sum", labels, total))
+        samples.append(("_count", labels, cumulative))
+        return samples
+
+    counts = list(frames.counts)
+    metric("frame_seconds", "histogram", "Work per frame, from snapshot to present.",
+           histogram(frames.buckets, counts, frames.totals[0]))
+    metric("dropped_frames_total", "counter", "Frames missed because the loop ran late.",
+           [("", (), frames.dropped[0])])
+
+    page_counts = sorted(sensors.dispatcher.pages.items(), key=lambda item: str(item[0]))
+    metric("ant_pages_total", "counter", "ANT+ data pages received, by device type and page.",
+           [("", (("device_type", device_type), ("page", page)), count)
+            for (device_type, page), count in page_counts])
+    metric("ant_unhandled_pages_total", "counter", "ANT+ data pages no handler was registered for.",
+           [("", (), sum(sensors.dispatcher.unhandled.values()))])
+
+    ages = []
+    for channel, sample in list(sensors.samples.items()):
+        if sample.time is not None:
+            ages.append(("", (("channel", channel),), round(now - sample.time, 3)))
+    metric("sample_age_seconds", "gauge", "Time since the latest sample of each channel was received.", ages)
+
+    latencies = []
+    for channel, shown in list(latency.frames.histograms.items()):
+        # Fine bucket i holds ages below (i + 1) * bucket_ms, so sum the fine buckets up to each bound
+        fine = list(shown.counts)
+        counts = []
+        used = 0
+        for bound in LATENCY_BUCKETS:
+            upto = min(int(round(bound * 1000 / shown.bucket_ms)), len(fine) - 1)
+            counts.append(sum(fine[used:upto]))
+            used = max(used, upto)
+        counts.append(sum(fine[used:]))
+        latencies += histogram(LATENCY_BUCKETS, counts, shown.total / 1000, (("channel", channel),))
+    metric("display_latency_seconds", "histogram",
+           "Age of each channel's value on screen when the frame was presented.", latencies)
+
+    metric("memory_resident_bytes", "gauge", "Resident memory of the display process.",
+           [("", (), _memory_bytes())])
+
+    stats = layout.cache_stats
+    metric("asset_cache_lookups_total", "counter", "Scaled asset loads, by outcome.",
+           [("", (("result", result),), stats[result]) for result in ("hit", "miss", "unscaled")])
+    metric("asset_cache_written_bytes_total", "counter", "Bytes written to the scaled asset cache.",
+           [("", (), stats["written_bytes"])])
+    if assetbudget.reports:
+        metric("asset_stored_bytes", "gauge", "Pixel memory of each asset as stored in the memory budget mode.",
+               [("", (("asset", report.name),), report.stored_bytes) for report in assetbudget.reports])
+    return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the kiosk's console
+        pass
+
+
+def serve(port, host=""):
+    """Serve /metrics on a daemon thread; returns the server, shut it down with server.shutdown()."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host or '0.0.0.0'}:{server.server_address[1]}/metrics")
+    return server
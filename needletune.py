@@ -0,0 +1,251 @@
+import argparse
+import csv
+import time
+
+import numpy as np
+
+FPS = 30
+
+# Needle scales of steamdisplay8, in degrees per unit and the unit value at the start angle
+CHANNELS = {
+    "power": (300 / 1000, 0),
+    "heart_rate": (3, 110),
+}
+
+# Parameter grid swept by default: update_rotation's acceleration gain, its damping (a base
+# factor plus one that grows as the needle nears its target) and a velocity limit
+GRID = {
+    "max_acceleration": np.geomspace(0.005, 0.4, 20),
+    "base_damping": np.linspace(0.0, 0.4, 12),
+    "damping_scale": np.array([0.0, 0.05, 0.1, 0.2, 0.4, 0.8]),
+    "max_velocity": np.array([np.inf, 2.0, 5.0, 10.0, 20.0]),
+}
+
+# Settings found in the display variants, marked in the table
+KNOWN = {
+    "steamdisplay8": (0.05, 0.05, 0.1, np.inf),
+    "steamdisplay7": (0.05, 0.05, 0.2, np.inf),
+}
+
+# A needle has settled once it stays within this many degrees of its target
+SETTLE_TOLERANCE = 1.0
+# A needle this far off its target has gone unstable
+UNSTABLE = 1e4
+
+# Synthetic trace: steps between held values (value, seconds), then a steady value with
+# sensor noise, sampled the way a power meter sends it
+STEPS = [(0, 3), (300, 4), (150, 4), (600, 5), (200, 4), (450, 4), (100, 4)]
+NOISE_LEVEL = 250
+NOISE_SD = 25
+NOISE_SECONDS = 15
+NOISE_RATE = 4  # samples a second
+# Frames after the noisy part starts before jitter is measured, so the step into it has settled
+NOISE_SETTLE = 2 * FPS
+
+
+def synthetic_trace(seed=0, fps=FPS):
+    """Values at every frame: the steps, then noise; with the frames each step starts and where the noise starts."""
+    values = []
+    step_starts = []
+    for value, seconds in STEPS:
+        step_starts.append(len(values))
+        values.extend([value] * int(seconds * fps))
+    noise_start = len(values)
+    rng = np.random.default_rng(seed)
+    samples = NOISE_LEVEL + NOISE_SD * rng.standard_normal(NOISE_SECONDS * NOISE_RATE)
+    values.extend(np.repeat(samples, fps // NOISE_RATE).tolist())
+    return np.array(values, dtype=np.float64), step_starts[1:], noise_start
+
+
+def session_trace(path, channel, fps=FPS, minutes=None):
+    """Values at every frame of a recorded session as the display would have shown them, 0 when stale."""
+    from export import frame_values
+    from sessions import load_session
+    _, values = frame_values(load_session(path), fps, (channel,))
+    values = np.nan_to_num(values[channel])
+    if minutes:
+        values = values[:int(minutes * 60 * fps)]
+    return values
+
+
+def grid_parameters(grid=GRID):
+    """Every combination of the grid as four flat arrays, with the KNOWN settings appended."""
+    axes = np.meshgrid(*grid.values(), indexing="ij")
+    columns = [axis.ravel() for axis in axes]
+    known = np.array(list(KNOWN.values()), dtype=np.float64)
+    return {name: np.concatenate((column, known[:, i])) for i, (name, column) in enumerate(zip(grid, columns))}
+
+
+def simulate(targets, params, step_starts=(), steps_end=None, jitter_from=0, tolerance=SETTLE_TOLERANCE):
+    """Run update_rotation for every parameter combination at once over target angles, one frame at a time.
+
+    The state of all combinations is one array per variable, so a frame is a handful of NumPy
+    operations however many combinations there are, and no per-frame history is kept: the
+    metrics are accumulated as the frames go. Angles are not wrapped at 360 degrees.
+
+    Each step runs from its frame in `step_starts` to the next one, the last up to `steps_end`.
+    Returns per combination, in degrees and seconds: the slowest settle time (inf for a needle
+    that does not settle before the next step) and the largest overshoot over the steps, the
+    RMS change of velocity from frame to frame from `jitter_from` on, and the RMS tracking error.
+    """
+    acceleration_gain = params["max_acceleration"]
+    base_damping = params["base_damping"]
+    damping_scale = params["damping_scale"]
+    max_velocity = params["max_velocity"]
+    count = len(acceleration_gain)
+
+    angle = np.full(count, targets[0])
+    velocity = np.zeros(count)
+    previous_velocity = np.zeros(count)
+    jitter = np.zeros(count)
+    tracking = np.zeros(count)
+    settle = np.zeros(count)
+    overshoot = np.zeros(count)
+    unstable = np.zeros(count, dtype=bool)
+
+    if steps_end is None:
+        steps_end = len(targets)
+    boundaries = list(step_starts) + [steps_end]
+    segment_end = boundaries[0] if step_starts else steps_end
+    segment = -1  # index into step_starts of the step being watched, -1 before the first
+    last_out = np.zeros(count)
+    peak = np.zeros(count)
+    direction = 0.0
+
+    diff = np.empty(count)
+    damping = np.empty(count)
+    with np.errstate(over="ignore", invalid="ignore"):
+        for frame, target in enumerate(targets.tolist()):
+            if frame == segment_end and segment >= 0:
+                # Close the step: frames until the needle stayed in tolerance, and its overshoot
+                settled = (last_out - step_starts[segment] + 1) / FPS
+                settled[last_out >= segment_end - 1] = np.inf
+                np.maximum(settle, settled, out=settle)
+                np.maximum(overshoot, peak, out=overshoot)
+            if segment + 1 < len(step_starts) and frame == step_starts[segment + 1]:
+                segment += 1
+                segment_end = boundaries[segment + 1]
+                direction = np.sign(target - targets[frame - 1])
+                last_out[:] = frame
+                peak[:] = 0.0
+
+            np.subtract(target, angle, out=diff)
+            # acceleration = max_acceleration * abs(diff), towards the target
+            velocity += acceleration_gain * diff
+            np.abs(diff, out=damping)
+            damping *= -1 / 360
+            damping += 1
+            damping *= damping_scale
+            damping += base_damping
+            velocity *= 1 - damping
+            np.clip(velocity, -max_velocity, max_velocity, out=velocity)
+            angle += velocity
+
+            error = angle - target
+            tracking += error * error
+            if frame > jitter_from:
+                change = velocity - previous_velocity
+                jitter += change * change
+            previous_velocity[:] = velocity
+            if segment >= 0 and frame < segment_end:
+                outside = np.abs(error) > tolerance
+                last_out[outside] = frame
+                np.maximum(peak, direction * error, out=peak)
+            unstable |= ~(np.abs(error) < UNSTABLE)
+
+    if segment >= 0 and segment_end >= len(targets):
+        settled = (last_out - step_starts[segment] + 1) / FPS
+        settled[last_out >= segment_end - 1] = np.inf
+        np.maximum(settle, settled, out=settle)
+        np.maximum(overshoot, peak, out=overshoot)
+    frames = max(len(targets) - jitter_from - 1, 1)
+    result = {
+        "settle": settle,
+        "overshoot": overshoot,
+        "jitter": np.sqrt(jitter / frames),
+        "tracking": np.sqrt(tracking / len(targets)),
+    }
+    for values in result.values():
+        values[unstable] = np.inf
+    return result
+
+
+def rank_score(metrics):
+    """Sum of each combination's rank in every metric, lower is better; scale-free, so no weights to pick."""
+    score = np.zeros(len(next(iter(metrics.values()))))
+    for values in metrics.values():
+        values = np.nan_to_num(values, nan=np.inf)
+        # Equal values share the lower rank, so a tie in one metric leaves the others to decide
+        score += np.searchsorted(np.sort(values), values, side="left")
+    return score
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the needle physics parameters of update_rotation and rank them")
+    parser.add_argument("--channel", choices=tuple(CHANNELS), default="power")
+    parser.add_argument("--session", metavar="FILE", help="also score tracking and jitter on a recorded FIT or CSV session")
+    parser.add_argument("--minutes", type=float, help="only the first MINUTES of the session")
+    parser.add_argument("--max-overshoot", type=float, help="leave out settings overshooting by more degrees")
+    parser.add_argument("--sort", choices=("score", "settle", "overshoot", "jitter", "tracking"), default="score")
+    parser.add_argument("--top", type=int, default=20, help="rows to print")
+    parser.add_argument("--csv", metavar="FILE", help="write every combination's results to FILE")
+    args = parser.parse_args()
+
+    multiplier, offset = CHANNELS[args.channel]
+    params = grid_parameters()
+    count = len(params["max_acceleration"])
+    start = time.perf_counter()
+
+    values, step_starts, noise_start = synthetic_trace()
+    if args.channel == "heart_rate":
+        # Steps and noise in the heart rate range instead of watts
+        values = 100 + values / 6
+    targets = np.maximum(values - offset, 0) * multiplier
+    metrics = simulate(targets, params, step_starts, noise_start, noise_start + NOISE_SETTLE)
+    # The synthetic trace's tracking error is mostly the steps themselves; settle time covers that
+    del metrics["tracking"]
+    frames = len(targets)
+
+    if args.session:
+        recorded = np.maximum(session_trace(args.session, args.channel, minutes=args.minutes) - offset, 0) * multiplier
+        on_session = simulate(recorded, params)
+        metrics["session_jitter"] = on_session["jitter"]
+        metrics["session_tracking"] = on_session["tracking"]
+        frames += len(recorded)
+    elapsed = time.perf_counter() - start
+    print(f"Simulated {count} settings over {frames} frames in {elapsed:.2f} s")
+
+    score = rank_score(metrics)
+    keep = np.isfinite(metrics["settle"])
+    if args.max_overshoot is not None:
+        keep &= metrics["overshoot"] <= args.max_overshoot
+    key = score if args.sort == "score" else metrics.get(args.sort, metrics.get(f"session_{args.sort}"))
+    if key is None:
+        parser.error(f"--sort {args.sort} needs --session")
+    order = [i for i in np.argsort(key, kind="stable") if keep[i]]
+    position = {int(i): n for n, i in enumerate(order)}
+
+    names = ["max_acceleration", "base_damping", "damping_scale", "max_velocity"]
+    header = ["accel", "damping", "scale", "max vel", "settle s", "overshoot", "jitter"]
+    if args.session:
+        header += ["rec jitter", "rec track"]
+    print(f"{'rank':>5} " + " ".join(f"{name:>10}" for name in header))
+    known_rows = {count - len(KNOWN) + n: name for n, name in enumerate(KNOWN)}
+    shown = list(order[:args.top]) + [i for i in known_rows if position.get(i, args.top) >= args.top]
+    for i in shown:
+        row = [params[name][i] for name in names] + [metrics[name][i] for name in metrics]
+        rank = position.get(int(i))
+        label = f"  {known_rows[i]}" if i in known_rows else ""
+        print(f"{'-' if rank is None else rank + 1:>5} " + " ".join(f"{value:10.3g}" for value in row) + label)
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(names + list(metrics) + ["score"])
+            for i in range(count):
+                writer.writerow([params[name][i] for name in names] + [metrics[name][i] for name in metrics]
+                                + [score[i]])
+
+
+if __name__ == "__main__":
+    main()
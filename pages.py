@@ -0,0 +1,108 @@
+import time
+from collections import Counter
+
+# ANT+ device profile numbers (openant.devices.common.DeviceType), kept here so handlers can be
+# registered without importing openant
+POWER_METER = 11
+FITNESS_EQUIPMENT = 17
+HEART_RATE = 120
+BIKE_SPEED_CADENCE = 121
+BIKE_CADENCE = 122
+BIKE_SPEED = 123
+
+# Bits of the first payload byte that hold the page number; the heart rate and the separate
+# speed and cadence sensors use the top bit as a page change toggle
+PAGE_MASKS = {
+    HEART_RATE: 0x7F,
+    BIKE_CADENCE: 0x7F,
+    BIKE_SPEED: 0x7F,
+}
+
+# Profiles without data pages: every message carries the same fields, and openant reports
+# them as several named updates. These are keyed by openant's page name instead.
+PAGELESS = {BIKE_SPEED_CADENCE}
+
+
+class PageDispatcher:
+    """Routes ANT+ data pages to handlers registered by (device type, page number).
+
+    Typed handlers are called as handler(data, received) with openant's decoded data object,
+    raw handlers as handler(payload, received) with the 8 payload bytes; `received` is the
+    time.monotonic() the page arrived. Pages nobody handles are counted in `unhandled`.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+        self.raw_handlers = {}
+        self.pages = Counter()  # every page seen
+        self.unhandled = Counter()
+
+    def register(self, device_type, pages, handler, raw=False):
+        """Call `handler` for each of `pages` (a page number, page name or iterable of them)."""
+        table = self.raw_handlers if raw else self.handlers
+        if isinstance(pages, (int, str)):
+            pages = (pages,)
+        for page in pages:
+            table.setdefault((device_type, page), []).append(handler)
+
+    def unregister(self, device_type, pages, handler, raw=False):
+        table = self.raw_handlers if raw else self.handlers
+        if isinstance(pages, (int, str)):
+            pages = (pages,)
+        for page in pages:
+            handlers = table.get((device_type, page))
+            if handlers and handler in handlers:
+                handlers.remove(handler)
+                if not handlers:
+                    del table[(device_type, page)]
+
+    def dispatch(self, device_type, page, page_name, data, received):
+        """Route one decoded page, from the device's on_device_data."""
+        if device_type in PAGELESS:
+            key = (device_type, page_name)
+            self.pages[key] += 1
+            handlers = self.handlers.get(key)
+            if handlers is None:
+                self.unhandled[key] += 1
+                return
+        else:
+            handlers = self.handlers.get((device_type, page & PAGE_MASKS.get(device_type, 0xFF)))
+            if handlers is None:
+                return  # counted by dispatch_raw, which sees every page
+        for handler in handlers:
+            handler(data, received)
+
+    def dispatch_raw(self, device_type, payload, received):
+        """Route one raw page, from the device's on_update; runs after openant decoded it."""
+        if device_type in PAGELESS:
+            return
+        key = (device_type, payload[0] & PAGE_MASKS.get(device_type, 0xFF))
+        self.pages[key] += 1
+        handlers = self.raw_handlers.get(key)
+        if handlers is None:
+            if key not in self.handlers:
+                self.unhandled[key] += 1
+            return
+        for handler in handlers:
+            handler(payload, received)
+
+    def device_callbacks(self, device_type, clock=time.monotonic):
+        """The (on_device_data, on_update) pair to assign to an openant device of this type.
+
+        `clock` gives the received time of each page; a replay passes the recorded one.
+        """
+        def on_device_data(page, page_name, data):
+            self.dispatch(device_type, page, page_name, data, clock())
+
+        def on_update(payload):
+            self.dispatch_raw(device_type, payload, clock())
+
+        return on_device_data, on_update
+
+    def report(self):
+        if not self.unhandled:
+            return
+        print("Unhandled ANT+ pages:")
+        for (device_type, page), count in self.unhandled.most_common():
+            page_text = page if isinstance(page, str) else f"0x{page:02X}"
+            print(f"  device type {device_type:3d} page {page_text}: {count}")
@@ -0,0 +1,81 @@
+import bisect
+import threading
+
+
+class AccumulatedPower:
+    """Exact average power from an ANT+ power page's event count and accumulated power.
+
+    Every power-only page (and FE-C trainer data page) carries an 8-bit event count and a
+    16-bit running sum of the power of every event, both rolling over. Unwrapped into totals,
+    the average over any span is the difference of the sums divided by the difference of the
+    counts: exact however many pages were missed, and a window average is two lookups instead
+    of a buffer of per-frame values.
+
+    `update` runs on the sensor thread while `average` runs on the display thread; the three
+    lists change together under a lock.
+    """
+
+    def __init__(self, history=600.0, max_gap=30.0):
+        self.history = history  # seconds of totals kept for average()
+        # Longer without any page and the event count may have rolled over unseen, so start over.
+        # 256 events take about a minute at the usual 4 Hz.
+        self.max_gap = max_gap
+        self.times = []
+        self.events = []  # unwrapped event count at each time
+        self.energy = []  # unwrapped accumulated power at each time, W per event summed
+        self.restarts = 0
+        self._last = None  # (event count, accumulated power, time) as last received
+        self._lock = threading.Lock()
+
+    def update(self, event_count, accumulated, received):
+        """Take one page's fields; returns the exact average power since the previous new event, or None.
+
+        None for the first page, for repeats of the last event and after a gap, which restart the totals.
+        """
+        with self._lock:
+            return self._update(event_count, accumulated, received)
+
+    def _update(self, event_count, accumulated, received):
+        last = self._last
+        self._last = (event_count, accumulated, received)
+        if last is None or received - last[2] > self.max_gap:
+            if last is not None:
+                self.restarts += 1
+            del self.times[:], self.events[:], self.energy[:]
+            self.times.append(received)
+            self.events.append(0)
+            self.energy.append(0)
+            return None
+        events = (event_count - last[0]) & 0xFF
+        if events == 0:
+            return None
+        energy = (accumulated - last[1]) & 0xFFFF
+        self.times.append(received)
+        self.events.append(self.events[-1] + events)
+        self.energy.append(self.energy[-1] + energy)
+        # Trim in blocks, so most pages do not shift the lists
+        if received - self.times[0] > self.history * 1.5:
+            start = bisect.bisect_left(self.times, received - self.history)
+            del self.times[:start], self.events[:start], self.energy[:start]
+        return energy / events
+
+    def average(self, seconds, now=None):
+        """Exact average power over the events of the last `seconds` up to `now` (default the latest page).
+
+        Starts from the latest page at or before the window start, or the oldest one kept.
+        None until two events have been seen.
+        """
+        with self._lock:
+            return self._average(seconds, now)
+
+    def _average(self, seconds, now):
+        if len(self.times) < 2:
+            return None
+        end = len(self.times) - 1 if now is None else bisect.bisect_right(self.times, now) - 1
+        if end < 1:
+            return None
+        start = max(bisect.bisect_right(self.times, self.times[end] - seconds) - 1, 0)
+        events = self.events[end] - self.events[start]
+        if events == 0:
+            return None
+        return (self.energy[end] - self.energy[start]) / events
@@ -0,0 +1,158 @@
+import os
+import pygame
+
+# Set this to "texture" to draw through the SDL2 renderer instead of software surfaces
+BACKEND_ENV_VAR = "WORKOUT_DISPLAY_BACKEND"
+
+
+class BudgetImage:
+    """A loaded image stored smaller than it looks, for the memory budget mode (see assetbudget).
+
+    `surface` holds only the visible part of a `size` image, placed at `offset` within it.
+    SurfaceBackend draws it exactly where the full image would have gone. With `rle` set, the
+    first plain blit RLE-accelerates it; rotating it first rules that out, since every rotation
+    would have to decode the RLE data again.
+    """
+
+    def __init__(self, surface, offset=(0, 0), size=None, rle=False):
+        self.surface = surface
+        self.offset = offset
+        self.size = size or surface.get_size()
+        self.rle = rle
+        self.rotated = False
+
+    def accelerate(self):
+        """RLE-accelerate once, on the first plain blit, unless the image has been rotated."""
+        if self.rle and not self.rotated:
+            self.rle = False
+            if self.surface.get_flags() & pygame.SRCALPHA:
+                self.surface.set_alpha(self.surface.get_alpha(), pygame.RLEACCEL)
+            else:
+                self.surface.set_colorkey(self.surface.get_colorkey(), pygame.RLEACCEL)
+
+
+class SurfaceBackend:
+    """Software surfaces, needles rotated on the CPU every frame."""
+
+    name = "surface"
+
+    def __init__(self, size, caption, flags=0):
+        self.screen = pygame.display.set_mode(size, flags)
+        pygame.display.set_caption(caption)
+        self.size = self.screen.get_size()
+
+    def load(self, surface):
+        # Convert once to the display format so per-frame blits skip pixel conversion
+        if surface.get_flags() & pygame.SRCALPHA:
+            return surface.convert_alpha()
+        return surface.convert()
+
+    def clear(self, color):
+        self.screen.fill(color)
+
+    def blit(self, image, pos):
+        if isinstance(image, BudgetImage):
+            image.accelerate()
+            pos = (pos[0] + image.offset[0], pos[1] + image.offset[1])
+            image = image.surface
+        self.screen.blit(image, pos)
+
+    def blit_surface(self, surface, pos):
+        self.screen.blit(surface, pos)
+
+    def blit_rotate_center(self, image, pos, angle, offset=(0, 0), smooth=False):
+        center = pygame.Rect(pos, image.size if isinstance(image, BudgetImage) else image.get_size()).center
+        if isinstance(image, BudgetImage):
+            # Turn the stored part's offset from the full image's center along with it
+            image.rotated = True
+            width, height = image.surface.get_size()
+            shift = pygame.math.Vector2(image.offset[0] + width / 2 - image.size[0] / 2,
+                                        image.offset[1] + height / 2 - image.size[1] / 2).rotate(-angle)
+            center = (center[0] + shift.x, center[1] + shift.y)
+            image = image.surface
+        # rotozoom filters the edges (anti-aliased) but costs about twice as much as rotate
+        if smooth:
+            rotated_image = pygame.transform.rotozoom(image, angle, 1)
+        else:
+            rotated_image = pygame.transform.rotate(image, angle)
+        new_rect = rotated_image.get_rect(center=center)
+        self.screen.blit(rotated_image, new_rect.move(offset).topleft)
+
+    def present(self):
+        pygame.display.flip()
+
+
+class TextureBackend:
+    """SDL2 renderer, assets uploaded once as textures and rotated by the renderer."""
+
+    name = "texture"
+
+    def __init__(self, size, caption, flags=0):
+        from pygame._sdl2.video import Window, Renderer, Texture
+
+        self._texture_type = Texture
+        self.window = Window(caption, size=size, fullscreen=bool(flags & pygame.FULLSCREEN))
+        # accelerated=-1 lets SDL pick a GPU driver and fall back to its software renderer without one
+        self.renderer = Renderer(self.window, accelerated=-1)
+        self.size = self.window.size
+
+    def load(self, surface):
+        return self._texture_type.from_surface(self.renderer, surface)
+
+    def clear(self, color):
+        self.renderer.draw_color = (*color[:3], 255)
+        self.renderer.clear()
+
+    def blit(self, texture, pos):
+        texture.draw(dstrect=texture.get_rect(topleft=pos))
+
+    def blit_surface(self, surface, pos):
+        # For small per-frame surfaces such as rendered text
+        self.blit(self.load(surface), pos)
+
+    def blit_rotate_center(self, texture, pos, angle, offset=(0, 0), smooth=False):
+        # The renderer filters rotated textures itself, so smooth makes no difference here.
+        # pygame.transform.rotate turns counter-clockwise, the renderer clockwise
+        rect = texture.get_rect(topleft=pos).move(offset)
+        texture.draw(dstrect=rect, angle=-angle)
+
+    def present(self):
+        self.renderer.present()
+
+
+def set_alpha(image, alpha):
+    """Fade a loaded image, Surface, BudgetImage or Texture, to alpha (0-255) for every later blit."""
+    if isinstance(image, BudgetImage):
+        image = image.surface
+    if not isinstance(image, pygame.Surface):
+        image.alpha = alpha
+    elif image.get_flags() & pygame.SRCALPHA:
+        # Scale the per-pixel alpha itself, so rotated copies of the image stay faded
+        image.fill((255, 255, 255, alpha), special_flags=pygame.BLEND_RGBA_MULT)
+    else:
+        image.set_alpha(alpha)
+
+
+def tint(image, color):
+    """Multiply a loaded image's colors by an (r, g, b, alpha) color for every later blit."""
+    if isinstance(image, BudgetImage):
+        image = image.surface
+    if not isinstance(image, pygame.Surface):
+        image.color = color[:3]
+        image.alpha = color[3]
+    elif image.get_flags() & pygame.SRCALPHA:
+        image.fill(color, special_flags=pygame.BLEND_RGBA_MULT)
+    else:
+        image.fill(color[:3], special_flags=pygame.BLEND_RGB_MULT)
+        image.set_alpha(color[3])
+
+
+BACKENDS = {backend.name: backend for backend in (SurfaceBackend, TextureBackend)}
+
+
+def create_backend(size, caption, flags=0, name=None):
+    """Open the window with the backend named here or in WORKOUT_DISPLAY_BACKEND (default "surface")."""
+    name = name or os.environ.get(BACKEND_ENV_VAR, SurfaceBackend.name)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown render backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](size, caption, flags)
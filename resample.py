@@ -0,0 +1,201 @@
+import argparse
+import math
+import threading
+import time
+
+import numpy as np
+
+# Set this to "hold", "linear" or "mean" to pick how workoutdisplay.py resamples the sensors
+RESAMPLE_ENV_VAR = "WORKOUT_DISPLAY_RESAMPLE"
+
+METHODS = ("hold", "linear", "mean")
+
+# A sample stands for at most this many seconds; further from any sample a channel reads NaN
+MAX_GAP = 5.0
+
+# Seconds a streaming Resampler waits past a grid time before it fills that row in, so the
+# pages of every sensor around it have arrived. At least one page period (0.25 s).
+DELAY = 0.5
+
+
+def _valid(times, values):
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    return times[valid], values[valid]
+
+
+def hold(times, values, grid, max_gap=MAX_GAP):
+    """Zero-order hold: the latest sample at or before each grid time, NaN once it is older than max_gap."""
+    times, values = _valid(times, values)
+    held = np.full(len(grid), np.nan)
+    index = np.searchsorted(times, grid, side="right") - 1
+    ok = index >= 0
+    ok[ok] = grid[ok] - times[index[ok]] <= max_gap
+    held[ok] = values[index[ok]]
+    return held
+
+
+def linear(times, values, grid, max_gap=MAX_GAP):
+    """Straight line between the samples either side of each grid time.
+
+    Samples further apart than max_gap are not joined; past the last sample, and across such a
+    gap, the value is held as by `hold`.
+    """
+    times, values = _valid(times, values)
+    result = hold(times, values, grid, max_gap)
+    index = np.searchsorted(times, grid, side="right") - 1
+    ok = (index >= 0) & (index < len(times) - 1)
+    before = index[ok]
+    t0, t1 = times[before], times[before + 1]
+    joined = t1 - t0 <= max_gap
+    where = np.flatnonzero(ok)[joined]
+    t0, t1, before = t0[joined], t1[joined], before[joined]
+    fraction = (grid[where] - t0) / (t1 - t0)
+    result[where] = values[before] + fraction * (values[before + 1] - values[before])
+    return result
+
+
+def mean(times, values, grid, interval, max_gap=MAX_GAP):
+    """Time-weighted mean over the bucket (t - interval, t] before each grid time t.
+
+    The signal averaged is the zero-order hold, so samples count by how long they stood, and
+    evenly spaced samples give their plain mean. Time beyond max_gap from any sample is left
+    out; a bucket with none of its time covered is NaN.
+    """
+    times, values = _valid(times, values)
+    if not len(times):
+        return np.full(len(grid), np.nan)
+    # Each sample holds until the next one or for max_gap, whichever comes first
+    lengths = np.minimum(np.diff(times, append=math.inf), max_gap)
+    area = np.concatenate(([0.0], np.cumsum(values * lengths)))
+    covered = np.concatenate(([0.0], np.cumsum(lengths)))
+
+    def integrals(x):
+        # Integrals up to x: every sample before the one holding at x, and that one's part up to x
+        index = np.maximum(np.searchsorted(times, x, side="right") - 1, 0)
+        inside = np.clip(x - times[index], 0.0, lengths[index])
+        return area[index] + values[index] * inside, covered[index] + inside
+
+    grid = np.asarray(grid, dtype=np.float64)
+    area_end, covered_end = integrals(grid)
+    area_start, covered_start = integrals(grid - interval)
+    span = covered_end - covered_start
+    # Spans well below a microsecond are rounding left over from an uncovered bucket
+    return np.divide(area_end - area_start, span, out=np.full(len(grid), np.nan), where=span > 1e-9)
+
+
+def resample(times, values, grid, method="hold", interval=None, max_gap=MAX_GAP):
+    """One channel's samples at the grid times by `method`; NaN samples are skipped."""
+    if method == "hold":
+        return hold(times, values, grid, max_gap)
+    if method == "linear":
+        return linear(times, values, grid, max_gap)
+    if method == "mean":
+        if interval is None:
+            interval = grid[1] - grid[0] if len(grid) > 1 else 1.0
+        return mean(times, values, grid, interval, max_gap)
+    raise ValueError(f"Unknown resampling method {method!r}, expected one of {METHODS}")
+
+
+def resample_session(session, interval=1.0, method="hold", channels=None, max_gap=MAX_GAP):
+    """A sessions.Session on a grid every `interval` seconds from its start: (grid, {channel: values})."""
+    channels = channels or list(session.channels)
+    grid = np.arange(int(session.duration // interval) + 1) * interval if len(session) else np.empty(0)
+    return grid, {channel: resample(session.times, session.channels[channel], grid, method, interval, max_gap)
+                  for channel in channels if channel in session.channels}
+
+
+class Resampler:
+    """Live sensor channels on one uniform timeline, using the same code as the batch functions.
+
+    Register `add` with sensors.subscribers. Grid times are multiples of `interval` on the
+    time.monotonic() clock, so every Resampler with the same interval agrees on them. `rows`
+    returns the rows whose time is at least `delay` seconds past; a sample arriving later than
+    that is not used for a row already returned, which is the one way a live row can differ
+    from resampling the recording afterwards. Only the samples the next rows still need are
+    kept.
+    """
+
+    def __init__(self, interval=1.0, method="hold", channels=("heart_rate", "power"), delay=DELAY,
+                 max_gap=MAX_GAP, now=None):
+        if method not in METHODS:
+            raise ValueError(f"Unknown resampling method {method!r}, expected one of {METHODS}")
+        self.interval = interval
+        self.method = method
+        self.channels = tuple(channels)
+        self.delay = delay
+        self.max_gap = max_gap
+        # Index of the next grid time to fill in
+        self._next = math.ceil((time.monotonic() if now is None else now) / interval)
+        self._buffers = {channel: ([], []) for channel in self.channels}
+        self._lock = threading.Lock()
+
+    def add(self, channel, sample):
+        buffer = self._buffers.get(channel)
+        if buffer is None:
+            return
+        with self._lock:
+            buffer[0].append(sample.time)
+            buffer[1].append(sample.value)
+
+    def rows(self, now=None):
+        """The rows due since the last call: (grid times, {channel: values}), empty arrays when none are."""
+        if now is None:
+            now = time.monotonic()
+        last = math.floor((now - self.delay) / self.interval)
+        grid = np.arange(self._next, last + 1) * self.interval
+        with self._lock:
+            buffers = {channel: (np.array(times), np.array(values)) for channel, (times, values) in
+                       self._buffers.items()}
+        values = {channel: resample(times, samples, grid, self.method, self.interval, self.max_gap)
+                  for channel, (times, samples) in buffers.items()}
+        if len(grid):
+            self._next = last + 1
+            self._prune(self._next * self.interval)
+        return grid, values
+
+    def _prune(self, start):
+        # The rows from `start` on read nothing older than a bucket and a gap before it
+        oldest = start - self.interval - self.max_gap
+        with self._lock:
+            for times, values in self._buffers.values():
+                drop = 0
+                while drop < len(times) and times[drop] < oldest:
+                    drop += 1
+                del times[:drop], values[:drop]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resample a recorded session's channels onto one uniform timeline")
+    parser.add_argument("session", help="FIT or CSV session file")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between rows")
+    parser.add_argument("--method", choices=METHODS, default="hold")
+    parser.add_argument("--max-gap", type=float, default=MAX_GAP, help="seconds a sample is used for at most")
+    parser.add_argument("--channels", help="comma separated channels, default every channel of the session")
+    parser.add_argument("--csv", metavar="FILE", help="write the rows to FILE instead of a summary")
+    args = parser.parse_args()
+
+    from sessions import load_session
+    session = load_session(args.session)
+    channels = args.channels.split(",") if args.channels else None
+    start = time.perf_counter()
+    grid, values = resample_session(session, args.interval, args.method, channels, args.max_gap)
+    elapsed = time.perf_counter() - start
+
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write(",".join(["time"] + list(values)) + "\n")
+            columns = [column.tolist() for column in values.values()]
+            for i, t in enumerate(grid.tolist()):
+                f.write(",".join([f"{t:g}"] + ["" if column[i] != column[i] else f"{column[i]:g}"
+                                               for column in columns]) + "\n")
+    print(f"{len(session)} samples to {len(grid)} rows every {args.interval:g} s in {elapsed * 1000:.1f} ms")
+    for channel, column in values.items():
+        valid = ~np.isnan(column)
+        average = f"{np.mean(column[valid]):.1f}" if valid.any() else "-"
+        print(f"  {channel:<12} {valid.sum():8d} rows with a value, average {average}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import argparse
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import sensors
+
+# Set this to a sample bus path to feed displays started by the launcher from an acquisition
+# process (python samplebus.py) instead of opening their own ANT+ node
+BUS_ENV_VAR = "WORKOUT_DISPLAY_SAMPLE_BUS"
+
+# In RAM where there is a /dev/shm, so publishing never waits on a disk
+DEFAULT_PATH = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "workoutdisplay.bus")
+
+MAGIC = b"WDSB"
+VERSION = 1
+# Magic, version, record size, capacity in records, next sequence number, file creation time
+HEADER = struct.Struct("<4sHHQQd")
+HEADER_SIZE = 64
+NEXT = struct.Struct("<Q")
+NEXT_OFFSET = 16
+# Sequence number (from 1; 0 is an empty slot), value, monotonic sample time, whether the
+# value is an int, channel name
+RECORD = struct.Struct("<Qdd?15s")
+
+# Several minutes of every channel, and the history a chart starting late catches up on
+DEFAULT_CAPACITY = 4096
+
+# How often BusSource looks for new samples, in seconds
+POLL_INTERVAL = 0.02
+
+
+class BusWriter:
+    """Publishes every sample of this process to a ring of records in a memory-mapped file.
+
+    Append it to sensors.subscribers in the process that owns the ANT+ node. It never waits
+    for a reader: each reader keeps its own position and one that falls a whole ring behind
+    loses the oldest samples, so any number of displays can read at their own rate. A
+    restarted writer continues the sequence of a compatible file, so readers carry on.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        size = HEADER_SIZE + capacity * RECORD.size
+        sequence = None
+        try:
+            with open(path, "rb") as f:
+                magic, version, record_size, old_capacity, sequence, created = HEADER.unpack(f.read(HEADER.size))
+            if (magic, version, record_size, old_capacity) != (MAGIC, VERSION, RECORD.size, capacity):
+                sequence = None
+        except (OSError, struct.error):
+            pass
+        if sequence is None:
+            # A new file under the name, never one resized in place: a reader with the old file
+            # mapped would fault on the missing pages. Readers notice the new file and switch.
+            sequence, created = 1, time.time()
+            with open(path + ".new", "wb") as f:
+                f.truncate(size)
+                f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, capacity, sequence, created))
+            os.replace(path + ".new", path)
+        with open(path, "r+b") as f:
+            self.map = mmap.mmap(f.fileno(), size)
+        self.capacity = capacity
+        self.sequence = sequence
+        self._lock = threading.Lock()
+
+    def publish(self, channel, sample):
+        """A sensors subscriber: append one published sample."""
+        value = sample.value
+        with self._lock:
+            sequence = self.sequence
+            RECORD.pack_into(self.map, HEADER_SIZE + (sequence % self.capacity) * RECORD.size,
+                             sequence, value, sample.time, isinstance(value, int), channel.encode())
+            # The next sequence number last, so readers never see a record before it is written
+            self.sequence = sequence + 1
+            NEXT.pack_into(self.map, NEXT_OFFSET, self.sequence)
+
+    def close(self):
+        self.map.close()
+
+
+class BusReader:
+    """One reader's position in a sample bus; read() returns what was published since the last call.
+
+    Reading takes no lock and writes nothing to the file. Records the writer may have started
+    to overwrite while they were copied are dropped and counted in `lost`, like the ones that
+    were overwritten before this reader got to them.
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.map = None
+        self.capacity = 0
+        self.cursor = 0
+        self.lost = 0
+        self._inode = None
+        self._checked = 0.0
+        self._channels = {}
+
+    def _open(self):
+        try:
+            with open(self.path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                magic, version, record_size, capacity, sequence, _ = HEADER.unpack(f.read(HEADER.size))
+                if (magic, version, record_size) != (MAGIC, VERSION, RECORD.size):
+                    return False
+                bus = mmap.mmap(f.fileno(), HEADER_SIZE + capacity * RECORD.size, access=mmap.ACCESS_READ)
+        except (OSError, ValueError, struct.error):
+            return False
+        if self.map is not None:
+            self.map.close()
+        self.map, self.capacity, self._inode = bus, capacity, inode
+        # Everything still in the ring, so a display starting late shows the recent history
+        self.cursor = max(sequence - capacity + 1, 1)
+        return True
+
+    def _replaced(self):
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except OSError:
+            return False
+
+    def read(self):
+        """New (channel, sensors.Sample) pairs in publishing order; empty until the bus exists."""
+        if self.map is None and not self._open():
+            return []
+        head = NEXT.unpack_from(self.map, NEXT_OFFSET)[0]
+        if head <= self.cursor:
+            # Nothing new: look for a writer that started over with a new file, once a second
+            now = time.monotonic()
+            if now - self._checked > 1.0:
+                self._checked = now
+                if self._replaced():
+                    self._open()
+            return []
+        oldest = head - self.capacity + 1
+        if self.cursor < oldest:
+            self.lost += oldest - self.cursor
+            self.cursor = oldest
+        records = []
+        for sequence in range(self.cursor, head):
+            records.append(RECORD.unpack_from(self.map, HEADER_SIZE + (sequence % self.capacity) * RECORD.size))
+        self.cursor = head
+        # A slot is only rewritten once the sequence has gone a whole ring past it
+        oldest = NEXT.unpack_from(self.map, NEXT_OFFSET)[0] - self.capacity + 1
+        out = []
+        expected = head - len(records)
+        for sequence, value, t, is_int, channel in records:
+            if sequence != expected or sequence < oldest:
+                self.lost += 1
+            else:
+                name = self._channels.get(channel)
+                if name is None:
+                    name = self._channels[channel] = channel.rstrip(b"\0").decode()
+                out.append((name, sensors.Sample(int(value) if is_int else value, t)))
+            expected += 1
+        return out
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+
+class BusSource:
+    """Feeds the samples of an acquisition process into this process's sensors, like sessions.ReplaySource.
+
+    The samples were filtered by the writer, so they are published as they are. Sample times
+    are on the writer's time.monotonic(), which every process of the machine shares, so
+    freshness and latency work as with a local ANT+ node.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, interval=POLL_INTERVAL):
+        self.reader = BusReader(path)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        waiting = False
+        while True:
+            for channel, sample in self.reader.read():
+                sensors.publish(channel, sample)
+            if self.reader.map is None and not waiting:
+                print(f"Waiting for the sample bus {self.reader.path}, start python samplebus.py")
+                waiting = True
+            if self._stop.wait(self.interval):
+                break
+        if self.reader.lost:
+            print(f"Sample bus: {self.reader.lost} samples lost reading behind the writer")
+        self.reader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Own the ANT+ node and publish its samples to displays in other "
+                                                 "processes through a shared-memory sample bus")
+    parser.add_argument("--bus", default=DEFAULT_PATH, help="sample bus file")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="samples kept in the ring")
+    parser.add_argument("--replay", metavar="FILE", help="publish a recorded FIT or CSV session, or a flight "
+                                                         "recorder .ring file, instead of ANT+")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+    parser.add_argument("--simulate-trainer", action="store_true", help="simulated trainer and rider instead of ANT+")
+    parser.add_argument("--erg", type=float, metavar="WATTS", help="hold the FE-C trainer at this power")
+    parser.add_argument("--record", metavar="FILE", help="keep the raw ANT+ pages in this flight recorder ring file")
+    parser.add_argument("--power-mode", choices=("instantaneous", "accumulated"), default="instantaneous",
+                        help="publish each page's instantaneous power or exact averages from the power counters")
+    args = parser.parse_args()
+
+    sensors.power_mode = args.power_mode
+    writer = BusWriter(args.bus, args.capacity)
+    first = writer.sequence
+    sensors.subscribers.append(writer.publish)
+    print(f"Publishing samples on {args.bus}, start displays with --bus {args.bus}")
+
+    recorder = None
+    if args.record:
+        import flightrec
+        recorder = sensors.recorder = flightrec.FlightRecorder(args.record)
+
+    source = None
+    if args.replay and args.replay.endswith(".ring"):
+        import flightrec
+        source = flightrec.ReplaySource(flightrec.read_records(args.replay), args.speed)
+    elif args.replay:
+        import sessions
+        source = sessions.ReplaySource(sessions.load_session(args.replay), args.speed)
+    elif args.simulate_trainer:
+        from trainersim import TrainerSimulator
+        source = TrainerSimulator()
+    if source:
+        source.start()
+    else:
+        sensors.start_ant_node()
+
+    controller = None
+    if args.erg is not None:
+        from erg import ErgController
+        controller = ErgController(source if args.simulate_trainer else None, target=args.erg)
+        controller.start()
+
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if controller:
+            controller.stop()
+        if source:
+            source.stop()
+        sensors.stop_ant_node()
+        if recorder:
+            sensors.recorder = None
+            recorder.close()
+        sensors.subscribers.remove(writer.publish)
+        writer.close()
+        sensors.dispatcher.report()
+        print(f"Published {writer.sequence - first} samples")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import threading
+import time
+from collections import namedtuple
+import pages
+from filters import make_filters
+from freshness import FreshnessTracker
+from hrv import HeartRateVariability
+from powercounters import AccumulatedPower
+
+# One sensor reading and the time.monotonic() at which its page was received
+Sample = namedtuple("Sample", ["value", "time"])
+
+# Latest sample per channel, written by the ANT+ thread and read by the display loops.
+# Each entry is replaced whole, so readers always see a matching value and time.
+samples = {
+    "heart_rate": Sample(0, None),
+    "power": Sample(0, None),
+    "cadence": Sample(0, None),  # rpm
+    "speed": Sample(0, None),  # m/s
+    "trainer_power": Sample(0, None),
+    # Heart rate variability over the last two minutes of beats, once there are enough of them
+    "rmssd": Sample(0, None),  # ms
+    "sdnn": Sample(0, None),  # ms
+    "dfa_alpha1": Sample(0, None),
+}
+
+# Spike rejection applied to every sample before it reaches the displays, one filter per
+# channel; replace or remove entries to reconfigure a channel
+filters = make_filters()
+
+# Tracks which channels have gone quiet; the display loops advance it once per frame
+freshness = FreshnessTracker()
+
+# Callables taking (channel, sample), called for every published sample in time order,
+# including the interpolated samples that bridge a short gap
+subscribers = []
+
+# Routes each ANT+ page to the handlers registered for its (device type, page number)
+dispatcher = pages.PageDispatcher()
+
+# Event count and accumulated power totals of the power meter and the trainer, kept from
+# every page whatever power_mode is
+power_counters = {"power": AccumulatedPower(), "trainer_power": AccumulatedPower()}
+
+# R-R intervals rebuilt from the heart rate pages' beat timing, and the statistics over them
+heart_rate_variability = HeartRateVariability()
+
+# What the power channels carry: "instantaneous" is each page's instantaneous power,
+# "accumulated" the exact average power over the events since the previous page, from the
+# counters, so no event between two pages is lost
+power_mode = "instantaneous"
+
+# Wheel circumference for speed sensors, in meters (700x25c)
+WHEEL_CIRCUMFERENCE = 2.105
+
+# openant device classes start_ant_node opens a channel for, by name, with their arguments
+DEVICES = {
+    "PowerMeter": {},
+    "HeartRate": {},
+    "BikeSpeedCadence": {"wheel_circumference_m": WHEEL_CIRCUMFERENCE},
+    "FitnessEquipment": {},
+}
+
+# flightrec.FlightRecorder every ANT+ page is written to before it is decoded, if set
+recorder = None
+
+# The running openant node and its devices by DEVICES name, set once start_ant_node has
+# finished its setup
+node = None
+devices = {}
+
+
+def on_found(device):
+    print(f"Device {device} found and receiving")
+
+
+def update(channel, value, t=None):
+    """Pass a raw sample received at monotonic time t through the channel's filter and publish it."""
+    if t is None:
+        t = time.monotonic()
+    channel_filter = filters.get(channel)
+    if channel_filter is not None:
+        value = channel_filter.update(value, t)
+        if value is None:
+            return
+    publish(channel, Sample(value, t))
+
+
+def publish(channel, sample):
+    """Make an already filtered sample the channel's latest and pass it to the subscribers."""
+    fills = freshness.seen(channel, sample)
+    samples[channel] = sample
+    for subscriber in subscribers:
+        for fill in fills:
+            subscriber(channel, fill)
+        subscriber(channel, sample)
+
+
+def snapshot(channels=("heart_rate", "power")):
+    """Latest sample per channel for one frame, None for channels that have gone stale."""
+    freshness.advance()
+    return {channel: None if freshness.is_stale(channel) else samples[channel] for channel in channels}
+
+
+def power_average(seconds, channel="power", now=None):
+    """Exact average power over the last `seconds` from the counters, None before two events."""
+    return power_counters[channel].average(seconds, now)
+
+
+def on_heart_rate(data, received):
+    update("heart_rate", data.heart_rate, received)
+
+def on_power(data, received):
+    if power_mode == "instantaneous":
+        update("power", data.instantaneous_power, received)
+    if data.cadence != 0xFF:  # 255 means the power meter does not measure cadence
+        update("cadence", data.cadence, received)
+
+def on_trainer_power(data, received):
+    if power_mode == "instantaneous" and data.instantaneous_power != 0xFFF:  # all bits set means invalid
+        update("trainer_power", data.instantaneous_power, received)
+
+def count_power(channel, event_count, accumulated, received):
+    average = power_counters[channel].update(event_count, accumulated, received)
+    if average is not None and power_mode == "accumulated":
+        update(channel, average, received)
+
+def on_power_counters(payload, received):
+    # Power-only page: event count in byte 1, accumulated power in bytes 4-5
+    count_power("power", payload[1], payload[4] | payload[5] << 8, received)
+
+def on_trainer_power_counters(payload, received):
+    # Specific trainer data page: event count in byte 1, accumulated power in bytes 3-4
+    count_power("trainer_power", payload[1], payload[3] | payload[4] << 8, received)
+
+def on_heart_rate_beats(payload, received):
+    # Beat event time in bytes 4-5, beat count in byte 6; page 4 adds the previous beat's time in bytes 2-3
+    previous = payload[2] | payload[3] << 8 if payload[0] & 0x7F == 4 else None
+    if not heart_rate_variability.update(payload[6], payload[4] | payload[5] << 8, received, previous):
+        return
+    for channel, value in (("rmssd", heart_rate_variability.rmssd()), ("sdnn", heart_rate_variability.sdnn()),
+                           ("dfa_alpha1", heart_rate_variability.dfa_alpha1())):
+        if value is not None:
+            update(channel, value, received)
+
+def on_trainer_speed(data, received):
+    if data.speed < 0xFFFF / 1000:
+        update("speed", data.speed, received)
+
+def on_cadence(data, received):
+    # The combined sensor reports the last calculated value again while no crank event arrives
+    if data.calculated_cadence is not None:
+        update("cadence", data.calculated_cadence, received)
+
+def on_speed(data, received):
+    if data.calculated_speed is not None:
+        update("speed", data.calculated_speed / 3.6, received)
+
+# Heart rate data pages 0-7 all carry the current heart rate
+dispatcher.register(pages.HEART_RATE, range(8), on_heart_rate)
+# Standard power-only page
+dispatcher.register(pages.POWER_METER, 0x10, on_power)
+# Fitness equipment: specific trainer data and general FE data pages
+dispatcher.register(pages.FITNESS_EQUIPMENT, 0x19, on_trainer_power)
+dispatcher.register(pages.FITNESS_EQUIPMENT, 0x10, on_trainer_speed)
+# The counter fields of the same power pages, which openant does not decode
+dispatcher.register(pages.POWER_METER, 0x10, on_power_counters, raw=True)
+dispatcher.register(pages.FITNESS_EQUIPMENT, 0x19, on_trainer_power_counters, raw=True)
+# Beat timing of the same heart rate pages, for heart rate variability
+dispatcher.register(pages.HEART_RATE, range(8), on_heart_rate_beats, raw=True)
+dispatcher.register(pages.BIKE_SPEED_CADENCE, "bike_cadence", on_cadence)
+dispatcher.register(pages.BIKE_SPEED_CADENCE, "bike_speed", on_speed)
+
+
+def start_ant_node(timer=None):
+    """Import openant, set up the node and devices and run it, all on a background thread.
+
+    openant and the USB stick setup are slow, so the displays call this only after their first frame.
+    """
+    def run():
+        global node
+        start = time.perf_counter()
+        from openant.easy.node import Node
+        from openant.devices import ANTPLUS_NETWORK_KEY
+        from openant.devices.bike_speed_cadence import BikeSpeedCadence
+        from openant.devices.fitness_equipment import FitnessEquipment
+        from openant.devices.heart_rate import HeartRate
+        from openant.devices.power_meter import PowerMeter
+        classes = {cls.__name__: cls for cls in (PowerMeter, HeartRate, BikeSpeedCadence, FitnessEquipment)}
+        if timer:
+            timer.record("import openant", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            node = Node()
+            node.set_network_key(0x00, ANTPLUS_NETWORK_KEY)
+            opened = {name: classes[name](node, **kwargs) for name, kwargs in DEVICES.items()}
+        except Exception as e:
+            print(f"Could not start ANT+ node: {e}")
+            return
+
+        # Assign callbacks to devices; every page goes through the dispatcher
+        for d in opened.values():
+            d.on_found = lambda d=d: on_found(d)
+            d.on_device_data, d.on_update = dispatcher.device_callbacks(d.device_type)
+            if recorder is not None:
+                recorder.tap(d)
+        devices.update(opened)
+        if timer:
+            timer.record("ant+ node setup", time.perf_counter() - start)
+
+        try:
+            print(f"Starting {list(opened.values())}, press Ctrl-C to finish")
+            node.start()
+        except KeyboardInterrupt:
+            print("Closing ANT+ device...")
+        finally:
+            devices.clear()
+            for d in opened.values():
+                d.close_channel()
+            node.stop()
+
+    ant_thread = threading.Thread(target=run, daemon=True)
+    ant_thread.start()
+    return ant_thread
+
+
+def stop_ant_node():
+    if node is not None:
+        node.stop()
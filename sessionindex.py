@@ -0,0 +1,319 @@
+import argparse
+import datetime as dt
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import cachefile
+import ghost
+
+# The index lives next to the rides it summarises, under this name
+INDEX_NAME = ".session_index.npz"
+SESSION_EXTENSIONS = (".fit", ".csv")
+
+# Time in zone is kept as histograms of seconds, so zones and FTP can change after the fact:
+# power in POWER_BIN watt bins, heart rate in 1 bpm bins; the last bin takes everything above
+POWER_BIN = 5
+POWER_BINS = 400
+HEART_RATE_BINS = 250
+
+# Seconds of the rolling average inside normalized power
+NP_WINDOW = 30
+
+# Default zone boundaries: power as fractions of FTP (Coggan's seven zones), heart rate in bpm
+POWER_ZONES = (0.55, 0.75, 0.90, 1.05, 1.20, 1.50)
+HEART_RATE_ZONES = (120, 140, 155, 170)
+
+# One value per session; the histograms are kept as 2-D arrays beside them
+COLUMNS = ("start", "duration", "work", "normalized_power", "max_power", "power_seconds",
+           "heart_rate_sum", "heart_rate_seconds", "max_heart_rate")
+
+
+def summarize(session, start=None):
+    """The index row of one sessions.Session: a dict of the COLUMNS plus both histograms.
+
+    Power and heart rate are taken from ghost.build_index, one row a second with every sample
+    held up to ghost.MAX_GAP, so work and time in zone here agree with the ghost race. `start`
+    (seconds since the epoch) replaces the session's own start, for files without one.
+    """
+    if session.start is not None:
+        start = session.start.timestamp()
+    # The last row is the ride's end; every row before it stands for one second
+    table = ghost.build_index(session)[:-1]
+    power = table[:, ghost.POWER]
+    heart_rate = table[:, ghost.HEART_RATE]
+    ridden = np.nan_to_num(power)
+
+    if len(ridden) >= NP_WINDOW:
+        rolling = np.convolve(ridden, np.ones(NP_WINDOW) / NP_WINDOW, mode="valid")
+        normalized = float(np.mean(rolling ** 4) ** 0.25)
+    else:
+        normalized = float(ridden.mean()) if len(ridden) else 0.0
+
+    power = power[~np.isnan(power)]
+    heart_rate = heart_rate[~np.isnan(heart_rate)]
+    power_bins = np.minimum((power // POWER_BIN).astype(np.int64), POWER_BINS - 1)
+    heart_rate_bins = np.clip(heart_rate.astype(np.int64), 0, HEART_RATE_BINS - 1)
+    return {
+        "start": np.nan if start is None else start,
+        "duration": session.duration,
+        "work": float(ridden.sum()),
+        "normalized_power": normalized,
+        "max_power": float(power.max()) if len(power) else 0.0,
+        "power_seconds": float(len(power)),
+        "heart_rate_sum": float(heart_rate.sum()),
+        "heart_rate_seconds": float(len(heart_rate)),
+        "max_heart_rate": float(heart_rate.max()) if len(heart_rate) else 0.0,
+        "power_histogram": np.bincount(power_bins, minlength=POWER_BINS).astype(np.float32),
+        "heart_rate_histogram": np.bincount(heart_rate_bins, minlength=HEART_RATE_BINS).astype(np.float32),
+    }
+
+
+def summarize_file(path):
+    """The index row of a FIT or CSV file, None when it cannot be read."""
+    import sessions
+    try:
+        session = sessions.load_session(path)
+    except (OSError, ValueError) as e:
+        print(f"Skipping {path}: {e}")
+        return None
+    # Without a start time in the file, take the ride as having ended when it was last written
+    return summarize(session, os.stat(path).st_mtime - session.duration)
+
+
+def _file_key(stat):
+    return stat.st_mtime_ns, stat.st_size
+
+
+class SessionIndex:
+    """Per-session summaries of an archive of rides, for totals over any range of dates.
+
+    Each ride is read once, when it is added; every query after that is NumPy arithmetic over
+    one row per ride, so totals over years of rides never touch the ride files. Rows are kept
+    sorted by start time. `update` brings the index in line with the archive directory,
+    reading only rides that are new or changed since the last update.
+    """
+
+    def __init__(self, directory, path=None):
+        self.directory = directory
+        self.path = path or os.path.join(directory, INDEX_NAME)
+        self.files = np.array([], dtype=str)  # paths relative to the directory
+        self.keys = np.empty((0, 2), dtype=np.int64)  # (mtime in ns, size) when summarised
+        self.columns = {name: np.empty(0) for name in COLUMNS}
+        self.power_histogram = np.empty((0, POWER_BINS), dtype=np.float32)
+        self.heart_rate_histogram = np.empty((0, HEART_RATE_BINS), dtype=np.float32)
+        if os.path.exists(self.path):
+            with np.load(self.path) as data:
+                self.files = data["files"]
+                self.keys = data["keys"]
+                self.columns = {name: data[name] for name in COLUMNS}
+                self.power_histogram = data["power_histogram"]
+                self.heart_rate_histogram = data["heart_rate_histogram"]
+
+    def __len__(self):
+        return len(self.files)
+
+    def save(self):
+        # np.savez appends ".npz" to any other name, so the temp name always ends in it
+        cachefile.write_atomic(self.path, lambda temp: np.savez(
+            temp, files=self.files, keys=self.keys, power_histogram=self.power_histogram,
+            heart_rate_histogram=self.heart_rate_histogram, **self.columns), suffix=".npz")
+
+    def _replace(self, keep, files, keys, rows):
+        """Keep the rows where `keep` is set, add `rows` for `files`, and sort by start time again."""
+        rows = [row for row in rows if row is not None]
+        self.files = np.concatenate((self.files[keep], np.array(files, dtype=str)))
+        self.keys = np.concatenate((self.keys[keep], np.array(keys, dtype=np.int64).reshape(-1, 2)))
+        for name in COLUMNS:
+            self.columns[name] = np.concatenate((self.columns[name][keep], [row[name] for row in rows]))
+        for name in ("power_histogram", "heart_rate_histogram"):
+            old = getattr(self, name)
+            setattr(self, name, np.concatenate((old[keep], np.array([row[name] for row in rows]).reshape(-1, old.shape[1]))))
+        order = np.argsort(self.columns["start"], kind="stable")
+        self.files, self.keys = self.files[order], self.keys[order]
+        self.columns = {name: values[order] for name, values in self.columns.items()}
+        self.power_histogram = self.power_histogram[order]
+        self.heart_rate_histogram = self.heart_rate_histogram[order]
+
+    def add(self, path):
+        """Summarise one ride file into the index and save it, for whatever just finished writing a ride."""
+        relative = os.path.relpath(path, self.directory)
+        row = summarize_file(path)
+        if row is None:
+            return False
+        self._replace(self.files != relative, [relative], [_file_key(os.stat(path))], [row])
+        self.save()
+        return True
+
+    def update(self, workers=None):
+        """Add new and changed rides in the directory and drop deleted ones; returns (rides read, rides removed).
+
+        Unchanged rides cost one stat each. New rides are read on a process pool, so a first
+        build over hundreds of files uses every core.
+        """
+        found = {}
+        for root, dirs, names in os.walk(self.directory):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for name in names:
+                if name.lower().endswith(SESSION_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    found[os.path.relpath(path, self.directory)] = _file_key(os.stat(path))
+
+        keep = np.array([found.get(name) == tuple(key) for name, key in zip(self.files.tolist(), self.keys.tolist())],
+                        dtype=bool)
+        known = set(self.files[keep].tolist())
+        new = sorted(name for name in found if name not in known)
+        paths = [os.path.join(self.directory, name) for name in new]
+        if len(paths) > 1 and workers != 1:
+            with ProcessPoolExecutor(workers) as pool:
+                rows = list(pool.map(summarize_file, paths, chunksize=4))
+        else:
+            rows = [summarize_file(path) for path in paths]
+
+        read = [row is not None for row in rows]
+        removed = sum(name not in found for name in self.files.tolist())
+        self._replace(keep, [name for name, ok in zip(new, read) if ok],
+                      [found[name] for name, ok in zip(new, read) if ok], rows)
+        if new or removed:
+            self.save()
+        return sum(read), removed
+
+    def select(self, start=None, end=None):
+        """Slice of the rows starting within [start, end), datetimes or seconds since the epoch."""
+        starts = self.columns["start"]
+        low = 0 if start is None else np.searchsorted(starts, _seconds(start), side="left")
+        high = len(starts) if end is None else np.searchsorted(starts, _seconds(end), side="left")
+        return slice(int(low), int(high))
+
+    def totals(self, rows=slice(None), ftp=None, power_zones=None, heart_rate_zones=None, group=None):
+        """Totals over `rows` (a slice or index array), per group when `group` labels each row.
+
+        Returns a dict of arrays, one value per group (one value without `group`): rides, time
+        in s, work in kJ, average and maximum heart rate, time in each zone in s, and TSS with
+        `ftp`. `power_zones` are boundaries in W, by default POWER_ZONES of `ftp`;
+        `heart_rate_zones` boundaries in bpm. Power zone edges are rounded to POWER_BIN watts.
+        """
+        columns = {name: values[rows] for name, values in self.columns.items()}
+        count = len(columns["start"])
+        if group is None:
+            labels, groups = np.zeros(count, dtype=np.int64), 1
+        else:
+            labels, groups = group, int(group.max()) + 1 if count else 0
+
+        def total(values):
+            return np.bincount(labels, weights=values, minlength=groups)
+
+        def maximum(values):
+            result = np.zeros(groups)
+            np.maximum.at(result, labels, values)
+            return result
+
+        heart_rate_seconds = total(columns["heart_rate_seconds"])
+        result = {
+            "rides": np.bincount(labels, minlength=groups),
+            "time": total(columns["duration"]),
+            "work": total(columns["work"]) / 1000,
+            "max_power": maximum(columns["max_power"]),
+            "average_heart_rate": np.divide(total(columns["heart_rate_sum"]), heart_rate_seconds,
+                                            out=np.full(groups, np.nan), where=heart_rate_seconds > 0),
+            "max_heart_rate": maximum(columns["max_heart_rate"]),
+        }
+        if ftp:
+            # TSS = 100 * hours * IF^2, IF = NP / FTP
+            result["tss"] = total(100 * columns["duration"] / 3600 * (columns["normalized_power"] / ftp) ** 2)
+            if power_zones is None:
+                power_zones = [fraction * ftp for fraction in POWER_ZONES]
+        if power_zones is not None:
+            edges = [round(boundary / POWER_BIN) for boundary in power_zones]
+            result["power_zones"] = _zone_times(self.power_histogram[rows], labels, groups, edges)
+        if heart_rate_zones is not None:
+            edges = [int(round(boundary)) for boundary in heart_rate_zones]
+            result["heart_rate_zones"] = _zone_times(self.heart_rate_histogram[rows], labels, groups, edges)
+        return result
+
+    def periods(self, period="week", start=None, end=None, **zones):
+        """Totals per calendar week (from Monday) or month in local time; returns (period starts, totals)."""
+        rows = self.select(start, end)
+        starts = self.columns["start"][rows]
+        firsts = [_period_start(dt.datetime.fromtimestamp(t), period) for t in starts.tolist()]
+        unique = sorted(set(firsts))
+        position = {first: i for i, first in enumerate(unique)}
+        group = np.array([position[first] for first in firsts], dtype=np.int64)
+        return unique, self.totals(rows, group=group, **zones)
+
+
+def _zone_times(histograms, labels, groups, edges):
+    """Seconds per zone for each group, zones split at histogram bin indices `edges`."""
+    # One matrix product with the rows' one-hot group membership, far quicker than np.add.at
+    per_group = (labels == np.arange(groups)[:, None]).astype(np.float64) @ histograms
+    bins = histograms.shape[1]
+    edges = np.clip([0] + list(edges) + [bins], 0, bins)
+    cumulative = np.concatenate((np.zeros((groups, 1)), np.cumsum(per_group, axis=1)), axis=1)
+    return cumulative[:, edges[1:]] - cumulative[:, edges[:-1]]
+
+
+def _seconds(when):
+    return when.timestamp() if isinstance(when, dt.datetime) else float(when)
+
+
+def _period_start(when, period):
+    if period == "month":
+        return when.date().replace(day=1)
+    if period == "week":
+        return when.date() - dt.timedelta(days=when.weekday())
+    raise ValueError(f"Unknown period {period!r}, expected week or month")
+
+
+def _duration(seconds):
+    minutes = int(round(seconds / 60))
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weekly and monthly totals over an archive of recorded rides")
+    parser.add_argument("directory", help="folder of FIT and CSV rides, searched recursively")
+    parser.add_argument("--index", metavar="FILE", help=f"index file, default {INDEX_NAME} in the folder")
+    parser.add_argument("--by", choices=("week", "month", "all"), default="week")
+    parser.add_argument("--from", dest="start", type=dt.datetime.fromisoformat, help="first date, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", type=dt.datetime.fromisoformat, help="date after the last one")
+    parser.add_argument("--ftp", type=float, help="functional threshold power in W, for TSS and power zones")
+    parser.add_argument("--hr-zones", help="heart rate zone boundaries in bpm, e.g. 120,140,155,170")
+    parser.add_argument("--workers", type=int, help="processes reading new rides, default one per core")
+    parser.add_argument("--no-update", action="store_true", help="query the index as it is, without rescanning")
+    args = parser.parse_args()
+
+    index = SessionIndex(args.directory, args.index)
+    if not args.no_update:
+        started = time.perf_counter()
+        added, removed = index.update(args.workers)
+        print(f"Index of {len(index)} rides: {added} added, {removed} removed in {time.perf_counter() - started:.2f} s")
+
+    heart_rate_zones = HEART_RATE_ZONES
+    if args.hr_zones:
+        heart_rate_zones = [float(value) for value in args.hr_zones.split(",")]
+    zones = {"ftp": args.ftp, "heart_rate_zones": heart_rate_zones}
+    started = time.perf_counter()
+    if args.by == "all":
+        rows = index.select(args.start, args.end)
+        labels = ["all"]
+        totals = index.totals(rows, **zones)
+    else:
+        labels, totals = index.periods(args.by, args.start, args.end, **zones)
+    elapsed = time.perf_counter() - started
+
+    header = f"{args.by:<10} {'rides':>5} {'time':>7} {'kJ':>7}"
+    if args.ftp:
+        header += f" {'TSS':>6}  power zones (h:mm)"
+    print(header + "  heart rate zones (h:mm)")
+    for i, label in enumerate(labels):
+        line = f"{str(label):<10} {totals['rides'][i]:5d} {_duration(totals['time'][i]):>7} {totals['work'][i]:7.0f}"
+        if args.ftp:
+            line += f" {totals['tss'][i]:6.0f}  " + " ".join(f"{_duration(s):>5}" for s in totals["power_zones"][i])
+        print(line + "  " + " ".join(f"{_duration(s):>5}" for s in totals["heart_rate_zones"][i]))
+    print(f"Queried in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
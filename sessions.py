@@ -0,0 +1,298 @@
+import csv
+import datetime as dt
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import sensors
+
+# FIT timestamps count seconds from 1989-12-31 00:00 UTC
+FIT_EPOCH = dt.datetime(1989, 12, 31, tzinfo=dt.timezone.utc)
+
+# FIT "record" message (global number 20) fields we import: channel -> (field number, scale)
+FIT_RECORD_MESSAGE = 20
+FIT_TIMESTAMP_FIELD = 253
+FIT_RECORD_FIELDS = {
+    "heart_rate": (3, 1),
+    "power": (7, 1),
+    "cadence": (4, 1),
+    "speed": (6, 1000),  # m/s
+}
+# Fields read where the one above is missing or invalid: newer head units write only
+# enhanced_speed, a 32 bit field with the same scale
+FIT_FALLBACK_FIELDS = {
+    "speed": (73, 1000),
+}
+
+# CSV header names accepted for each column, compared lower-cased
+CSV_COLUMNS = {
+    "time": ("time", "timestamp", "elapsed", "seconds", "secs"),
+    "heart_rate": ("heart_rate", "heartrate", "hr", "bpm"),
+    "power": ("power", "watts", "pwr"),
+    "cadence": ("cadence", "rpm"),
+    "speed": ("speed",),
+}
+
+
+class FitError(ValueError):
+    pass
+
+
+class Session:
+    """A recorded ride: one time axis in seconds from the start and one value array per channel.
+
+    Missing values are NaN, so all channels share the time axis.
+    """
+
+    def __init__(self, times, channels, start=None):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.channels = {name: np.asarray(values, dtype=np.float64) for name, values in channels.items()}
+        self.start = start
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return float(self.times[-1] - self.times[0]) if len(self.times) else 0.0
+
+    def samples(self, channel, offset=0.0):
+        """Yield the channel as sensors.Sample tuples, with times shifted by offset."""
+        values = self.channels[channel]
+        valid = ~np.isnan(values)
+        for value, t in zip(values[valid].tolist(), (self.times[valid] + offset).tolist()):
+            yield sensors.Sample(value, t)
+
+
+class _FitDefinition:
+    __slots__ = ("global_number", "little_endian", "size", "fields")
+
+    def __init__(self, global_number, little_endian, size, fields):
+        self.global_number = global_number
+        self.little_endian = little_endian
+        self.size = size
+        # field number -> (byte offset within the message, size)
+        self.fields = fields
+
+
+def _gather_uint(buffer, offsets, size, little_endian):
+    """Read one unsigned integer of `size` bytes at every offset, vectorized."""
+    value = np.zeros(len(offsets), dtype=np.int64)
+    for i in range(size):
+        shift = 8 * i if little_endian else 8 * (size - 1 - i)
+        value |= buffer[offsets + i].astype(np.int64) << shift
+    return value
+
+
+def load_fit(path):
+    """Decode the record messages of a FIT file into a Session.
+
+    The message headers are walked once in Python to find where each record lives; the
+    field values are then pulled out for all records at once with NumPy.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < 12 or data[8:12] != b".FIT":
+        raise FitError(f"{path} is not a FIT file")
+    header_size = data[0]
+    end = header_size + int.from_bytes(data[4:8], "little")
+
+    definitions = {}
+    records = {}  # definition -> (record offsets, timestamps)
+    last_timestamp = 0
+    pos = header_size
+    while pos < end:
+        header = data[pos]
+        pos += 1
+
+        if header & 0x80:
+            # Compressed timestamp header: 5 bit offset on the last full timestamp
+            definition = definitions[(header >> 5) & 0x03]
+            offset = header & 0x1F
+            timestamp = (last_timestamp & ~0x1F) + offset
+            if offset < (last_timestamp & 0x1F):
+                timestamp += 0x20
+            last_timestamp = timestamp
+        elif header & 0x40:
+            # Definition message
+            little_endian = data[pos + 1] == 0
+            global_number = int.from_bytes(data[pos + 2:pos + 4], "little" if little_endian else "big")
+            field_count = data[pos + 4]
+            pos += 5
+            fields = {}
+            size = 0
+            for _ in range(field_count):
+                number, field_size = data[pos], data[pos + 1]
+                fields[number] = (size, field_size)
+                size += field_size
+                pos += 3
+            if header & 0x20:
+                developer_count = data[pos]
+                pos += 1
+                for _ in range(developer_count):
+                    size += data[pos + 1]
+                    pos += 3
+            definitions[header & 0x0F] = _FitDefinition(global_number, little_endian, size, fields)
+            continue
+        else:
+            definition = definitions[header & 0x0F]
+            timestamp_field = definition.fields.get(FIT_TIMESTAMP_FIELD)
+            if timestamp_field is not None:
+                start = pos + timestamp_field[0]
+                last_timestamp = int.from_bytes(data[start:start + 4],
+                                                "little" if definition.little_endian else "big")
+            timestamp = last_timestamp
+
+        if definition.global_number == FIT_RECORD_MESSAGE:
+            offsets, timestamps = records.setdefault(definition, ([], []))
+            offsets.append(pos)
+            timestamps.append(timestamp)
+        pos += definition.size
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    all_times = []
+    all_channels = {name: [] for name in FIT_RECORD_FIELDS}
+    for definition, (offsets, timestamps) in records.items():
+        offsets = np.asarray(offsets, dtype=np.int64)
+        all_times.append(np.asarray(timestamps, dtype=np.float64))
+        for name, primary in FIT_RECORD_FIELDS.items():
+            values = np.full(len(offsets), np.nan)
+            fallback = FIT_FALLBACK_FIELDS.get(name)
+            for number, scale in (primary, fallback) if fallback else (primary,):
+                field = definition.fields.get(number)
+                if field is None:
+                    continue
+                raw = _gather_uint(buffer, offsets + field[0], field[1], definition.little_endian)
+                # All bits set marks an invalid value; keep what an earlier field already gave
+                valid = (raw != (1 << (8 * field[1])) - 1) & np.isnan(values)
+                values[valid] = raw[valid] / scale
+            all_channels[name].append(values)
+
+    if not all_times:
+        return Session([], {name: [] for name in FIT_RECORD_FIELDS})
+    times = np.concatenate(all_times)
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    start = FIT_EPOCH + dt.timedelta(seconds=float(times[0])) if len(times) else None
+    channels = {name: np.concatenate(parts)[order] for name, parts in all_channels.items()}
+    return Session(times - times[0], channels, start)
+
+
+def _parse_times(column):
+    """Elapsed seconds from a column of either numbers or ISO 8601 timestamps."""
+    if not column:
+        return np.empty(0), None
+    try:
+        times = np.array(column, dtype=np.float64)
+        start = None
+    except ValueError:
+        stamps = [dt.datetime.fromisoformat(value) for value in column]
+        start = stamps[0]
+        times = np.array([(stamp - start).total_seconds() for stamp in stamps])
+    return times - times[0], start
+
+
+def _float_or_nan(cell):
+    try:
+        return float(cell)
+    except ValueError:
+        return math.nan
+
+
+def _parse_values(cells):
+    """Floats from a column of CSV cells; blank and non-numeric cells become NaN."""
+    cells = [cell.strip() or "nan" for cell in cells]
+    try:
+        return np.array(cells, dtype=np.float64)
+    except ValueError:
+        # Rare: a stray "--" or unit in the column costs one slower pass over this chunk only
+        return np.array([_float_or_nan(cell) for cell in cells], dtype=np.float64)
+
+
+def load_csv(path, chunk_size=65536):
+    """Read a CSV export with a header row into a Session.
+
+    Blank and non-numeric value cells become NaN; rows without a time are skipped.
+    """
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = [name.strip().lower() for name in next(reader)]
+        columns = {}
+        for channel, aliases in CSV_COLUMNS.items():
+            for alias in aliases:
+                if alias in header:
+                    columns[channel] = header.index(alias)
+                    break
+        if "time" not in columns:
+            raise ValueError(f"{path} has no time column, expected one of {CSV_COLUMNS['time']}")
+
+        # Convert in chunks so a long file never holds more than one chunk of Python strings
+        parts = {channel: [] for channel in columns}
+        time_index = columns["time"]
+        while True:
+            chunk = [row for _, row in zip(range(chunk_size), reader)]
+            if not chunk:
+                break
+            # A row without a time cannot be placed on the time axis, so it is skipped
+            rows = [row for row in chunk if time_index < len(row) and row[time_index].strip()]
+            for channel, index in columns.items():
+                cells = [row[index] if index < len(row) else "" for row in rows]
+                if channel == "time":
+                    parts[channel].append([cell.strip() for cell in cells])
+                else:
+                    parts[channel].append(_parse_values(cells))
+
+    times, start = _parse_times([cell for chunk in parts.pop("time") for cell in chunk])
+    channels = {channel: np.concatenate(chunks) if chunks else np.array([]) for channel, chunks in parts.items()}
+    return Session(times, channels, start)
+
+
+def load_session(path):
+    """Load a FIT or CSV session, picked by file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".fit":
+        return load_fit(path)
+    if extension == ".csv":
+        return load_csv(path)
+    raise ValueError(f"Unsupported session file {path}, expected .fit or .csv")
+
+
+class ReplaySource:
+    """Plays a recorded session into sensors.update, standing in for the openant Node."""
+
+    def __init__(self, session, speed=1.0, channels=("heart_rate", "power"), loop=False):
+        self.session = session
+        self.speed = speed
+        self.channels = [channel for channel in channels if channel in session.channels]
+        self.loop = loop
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        times = self.session.times.tolist()
+        columns = [(channel, self.session.channels[channel].tolist()) for channel in self.channels]
+        while True:
+            started = time.monotonic()
+            for i, t in enumerate(times):
+                delay = started + t / self.speed - time.monotonic()
+                if delay > 0 and self._stop.wait(delay):
+                    return
+                if self._stop.is_set():
+                    return
+                for channel, values in columns:
+                    value = values[i]
+                    if value == value:  # skip NaN
+                        sensors.update(channel, value)
+            if not self.loop:
+                return
@@ -1,28 +1,34 @@
+import sys
 import pygame
 import math
-import threading
-from openant.easy.node import Node
-from openant.devices import ANTPLUS_NETWORK_KEY
-from openant.devices.heart_rate import HeartRate, HeartRateData
-from openant.devices.power_meter import PowerMeter, PowerData
-
-# Initialize global variables to hold the latest power and heart rate values
-power = 0
-heart_rate = 0
-
-# Set up Pygame display
-pygame.init()
-screen_width, screen_height = 1317, 737
-screen = pygame.display.set_mode((screen_width, screen_height))
-pygame.display.set_caption("Heart Rate and Power Indicator")
-
-# Load images
-background_image = pygame.image.load("background.png")
-hr_indicator_image = pygame.image.load("bigarrow.png")
-power_indicator_image = pygame.image.load("smallarrow.png")
-
-# Set up rotation center points
-center_x, center_y = 658, 368	
+from collections import namedtuple
+import launcher
+import latency
+import metrics
+import ghost
+import sensors
+import wbal
+import workout
+from governor import FrameGovernor
+from renderer import set_alpha, tint
+from stripchart import StripChart
+
+# Reference layout all pixel coordinates below were tuned on
+REFERENCE_SIZE = (1317, 737)
+CAPTION = "Heart Rate and Power Indicator"
+FPS = 30
+
+# Images, loaded on the launcher's thread pool and pre-scaled to the screen size
+ASSETS = {
+    "background": "background.png",
+    "hr_indicator": "bigarrow.png",
+    "power_indicator": "smallarrow.png",
+    "target_indicator": "smallarrow.png",  # faded copy showing the workout's target power
+    "ghost_indicator": "smallarrow.png",  # tinted copy showing the ghost rider's power
+}
+
+# Set up rotation center points, in reference pixels
+center_x, center_y = 658, 368
 
 # Variables to set the initial rotation angles for heart rate and power indicators
 hr_start_angle = -140  # Adjust this for the heart rate indicator starting angle
@@ -33,21 +39,48 @@ power_multiplier = 300 / 1000  # 1000W equals 300 degrees rotation
 hr_multiplier = 3  # 1 BPM equals 3 degrees of rotation
 hr_offset = 110  # Ignore heart rate values below 110 BPM
 
-# Font setup for number display
-font = pygame.font.Font(None, 36)  # Use default font, size 36
-
-# Function to rotate and draw an image around a center
-def blit_rotate_center(surf, image, pos, angle):
-    rotated_image = pygame.transform.rotate(image, angle)
-    new_rect = rotated_image.get_rect(center=image.get_rect(topleft=pos).center)
-    surf.blit(rotated_image, new_rect.topleft)
-
 # Variables for smooth animation
 prev_hr_value, prev_power_value = 0, 0
 hr_angle, power_angle = hr_start_angle, power_start_angle  # Initialize angles with start angles
 hr_velocity, power_velocity = 0, 0
+ghost_angle, ghost_velocity = power_start_angle, 0
 max_acceleration = 0.05  # Adjust for desired smoothness
 
+# Text colors for live and stale (no recent sample) values
+TEXT_COLOR = (255, 255, 255)
+STALE_TEXT_COLOR = (110, 110, 110)
+
+# Workout target: target needle opacity, and the power text color below, in and above the band
+TARGET_ALPHA = 110
+BELOW_TARGET_COLOR = (120, 170, 255)
+IN_TARGET_COLOR = (120, 230, 120)
+ABOVE_TARGET_COLOR = (255, 120, 100)
+
+# Ghost rider: needle tint and opacity, and the delta text color when ahead and behind
+GHOST_TINT = (150, 255, 190, 170)
+AHEAD_COLOR = (120, 230, 120)
+BEHIND_COLOR = (255, 120, 100)
+
+# W' balance text turns this color below this fraction of W'
+LOW_BALANCE = 0.25
+LOW_BALANCE_COLOR = (255, 120, 100)
+
+# Trend chart of the last few minutes in the bottom left corner, in reference pixels
+CHART_RECT = (30, 560, 360, 150)
+CHART_SECONDS = 180
+CHART_TRACES = {
+    "heart_rate": ((220, 40, 40), 60, 200),  # color, bottom and top of the scale
+    "power": ((40, 120, 230), 0, 600),
+}
+
+# Render quality tiers, best first; the frame governor steps down when frames run over budget
+QUALITY_TIERS = [
+    {"smooth_needles": True, "text_every": 1},  # anti-aliased needles via rotozoom
+    {"smooth_needles": False, "text_every": 1},
+    {"smooth_needles": False, "text_every": 5},  # re-render the numbers 6 times a second
+    {"smooth_needles": False, "text_every": 15},
+]
+
 # Update function for smooth rotation based on data
 def update_rotation(target_value, current_angle, velocity, multiplier, start_angle, offset=0, max_power_threshold=None):
     # Calculate adjusted target angle
@@ -83,73 +116,171 @@ def update_rotation(target_value, current_angle, velocity, multiplier, start_ang
 
     return current_angle, velocity
 
-# Pygame loop for displaying the indicators
-def display_loop():
-    global prev_hr_value, prev_power_value, hr_angle, power_angle, hr_velocity, power_velocity
-    clock = pygame.time.Clock()
-    running = True
+# What one frame shows: needle angles and the values for the text, None when stale
+DialState = namedtuple("DialState", ["hr_angle", "power_angle", "heart_rate", "power", "target", "target_angle",
+                                     "ghost", "ghost_angle", "w_balance"])
 
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
+def make_view(layout, images):
+    """Scale fonts and geometry once from the reference layout."""
+    set_alpha(images["target_indicator"], TARGET_ALPHA)
+    tint(images["ghost_indicator"], GHOST_TINT)
+    return {
+        "images": images,
+        "font": pygame.font.Font(None, layout.length(36)),  # Use default font, size 36 at reference size
+        "background_pos": layout.point(0, 0),
+        "center": layout.point(center_x, center_y),
+        "hr_text_pos": layout.point(REFERENCE_SIZE[0] - 300, REFERENCE_SIZE[1] // 2 - 50),
+        "power_text_pos": layout.point(REFERENCE_SIZE[0] - 300, REFERENCE_SIZE[1] // 2 + 10),
+        "target_text_pos": layout.point(REFERENCE_SIZE[0] - 300, REFERENCE_SIZE[1] // 2 + 70),
+        "line_height": layout.length(60),
+        # Rendered text kept between frames when the quality tier updates it less often
+        "text": None,
+        "text_frames": 0,
+        # Trend chart, fed from the sensors by display_loop; None draws no chart
+        "chart": None,
+        "chart_pos": layout.point(*CHART_RECT[:2]),
+    }
 
-        # Update indicator angles with respective multipliers and offsets
-        hr_angle, hr_velocity = update_rotation(heart_rate, hr_angle, hr_velocity, hr_multiplier, hr_start_angle, hr_offset)
-        power_angle, power_velocity = update_rotation(power, power_angle, power_velocity, power_multiplier, power_start_angle)
+def make_chart(layout):
+    return StripChart(layout.image_size(CHART_RECT[2:]), CHART_TRACES, CHART_SECONDS)
 
-        # Draw everything
-        screen.fill((0, 0, 0))  # Clear screen
-        screen.blit(background_image, (0, 0))  # Draw dial background
+def frame_state(heart_rate, power, target=None, ghost_state=None, w_balance=None):
+    """Advance the needles by one frame towards the given values; None means the channel is stale.
 
-        # Rotate and draw indicators with the starting offset
-        blit_rotate_center(screen, hr_indicator_image, (center_x, center_y), hr_angle)
-        blit_rotate_center(screen, power_indicator_image, (center_x, center_y), power_angle)
+    `target` is the workout.Target to show, if any, `ghost_state` the ghost.GhostState and
+    `w_balance` the W' balance as a fraction of W'.
+    """
+    global hr_angle, power_angle, hr_velocity, power_velocity, ghost_angle, ghost_velocity
+
+    # Channels that stopped sending are parked at their start angle instead of frozen
+    hr_angle, hr_velocity = update_rotation(hr_offset if heart_rate is None else heart_rate, hr_angle, hr_velocity,
+                                            hr_multiplier, hr_start_angle, hr_offset)
+    power_angle, power_velocity = update_rotation(0 if power is None else power, power_angle, power_velocity,
+                                                  power_multiplier, power_start_angle)
+    # The target needle points straight at the target power, on the power needle's scale
+    target_angle = None if target is None else power_start_angle + target.power * power_multiplier
+    # The ghost's needle moves like the rider's, so the two can be compared at a glance
+    shown_ghost_angle = None
+    if ghost_state is not None:
+        ghost_angle, ghost_velocity = update_rotation(ghost_state.power or 0, ghost_angle, ghost_velocity,
+                                                      power_multiplier, power_start_angle)
+        shown_ghost_angle = ghost_angle
+    return DialState(hr_angle, power_angle, heart_rate, power, target, target_angle, ghost_state, shown_ghost_angle,
+                     w_balance)
+
+def render_text(font, state):
+    # Display the current heart rate and power values, dimmed when stale
+    if state.heart_rate is None:
+        hr_text = font.render("Heart Rate: -- BPM", True, STALE_TEXT_COLOR)
+    else:
+        hr_text = font.render(f"Heart Rate: {state.heart_rate:.0f} BPM", True, TEXT_COLOR)
+    target = state.target
+    if state.power is None:
+        power_text = font.render("Power: -- W", True, STALE_TEXT_COLOR)
+    else:
+        if target is None:
+            color = TEXT_COLOR
+        elif state.power < target.low:
+            color = BELOW_TARGET_COLOR
+        elif state.power > target.high:
+            color = ABOVE_TARGET_COLOR
+        else:
+            color = IN_TARGET_COLOR
+        power_text = font.render(f"Power: {state.power:.0f} W", True, color)
+
+    # Workout lines below them
+    target_lines = []
+    if target is not None:
+        target_lines.append(font.render(f"Target: {target.power:.0f} W", True, TEXT_COLOR))
+        if target.next_power is not None:
+            minutes, seconds = divmod(int(target.remaining), 60)
+            target_lines.append(font.render(f"Next: {target.next_power:.0f} W in {minutes}:{seconds:02d}",
+                                            True, TEXT_COLOR))
+    ghost_state = state.ghost
+    if ghost_state is not None:
+        power = "--" if ghost_state.power is None else f"{ghost_state.power:.0f}"
+        target_lines.append(font.render(f"Ghost: {power} W  {ghost_state.delta:+.1f} kJ", True,
+                                        AHEAD_COLOR if ghost_state.delta >= 0 else BEHIND_COLOR))
+    if state.w_balance is not None:
+        target_lines.append(font.render(f"W' balance: {state.w_balance:.0%}", True,
+                                        LOW_BALANCE_COLOR if state.w_balance < LOW_BALANCE else TEXT_COLOR))
+    return hr_text, power_text, target_lines
+
+def draw_frame(backend, view, state, quality=QUALITY_TIERS[0]):
+    images = view["images"]
+    smooth = quality["smooth_needles"]
+
+    # Draw everything
+    backend.clear((0, 0, 0))  # Clear screen
+    backend.blit(images["background"], view["background_pos"])  # Draw dial background
+
+    # Rotate and draw indicators around their centers, the faded target needle underneath
+    if state.target_angle is not None:
+        backend.blit_rotate_center(images["target_indicator"], view["center"], state.target_angle, smooth=smooth)
+    if state.ghost_angle is not None:
+        backend.blit_rotate_center(images["ghost_indicator"], view["center"], state.ghost_angle, smooth=smooth)
+    backend.blit_rotate_center(images["hr_indicator"], view["center"], state.hr_angle, smooth=smooth)
+    backend.blit_rotate_center(images["power_indicator"], view["center"], state.power_angle, smooth=smooth)
+
+    # Lower tiers re-render the text only every few frames
+    if view["text"] is None or view["text_frames"] >= quality["text_every"] - 1:
+        view["text"] = render_text(view["font"], state)
+        view["text_frames"] = 0
+    else:
+        view["text_frames"] += 1
+    hr_text, power_text, target_lines = view["text"]
+
+    # Position text in the right half of the window
+    backend.blit_surface(hr_text, view["hr_text_pos"])
+    backend.blit_surface(power_text, view["power_text_pos"])
+    x, y = view["target_text_pos"]
+    for line in target_lines:
+        backend.blit_surface(line, (x, y))
+        y += view["line_height"]
+
+    chart = view["chart"]
+    if chart is not None:
+        chart.tick()
+        backend.blit_surface(chart.surface, view["chart_pos"])
+
+# Pygame loop for displaying the indicators
+def display_loop(backend, layout, images):
+    clock = pygame.time.Clock()
+    running = True
+    view = make_view(layout, images)
+    governor = FrameGovernor(QUALITY_TIERS, FPS)
+    chart = view["chart"] = make_chart(layout)
+    sensors.subscribers.append(chart.add)
 
-        # Display the current heart rate and power values
-        hr_text = font.render(f"Heart Rate: {heart_rate} BPM", True, (255, 255, 255))
-        power_text = font.render(f"Power: {power} W", True, (255, 255, 255))
+    try:
+        while running:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
 
-        # Position text in the right half of the window
-        screen.blit(hr_text, (screen_width - 300, screen_height // 2 - 50))
-        screen.blit(power_text, (screen_width - 300, screen_height // 2 + 10))
+            governor.begin()
 
-        # Update display and tick clock
-        pygame.display.flip()
-        clock.tick(30)  # 30 FPS for smooth animation
+            # Latest fresh samples, None for channels that have gone quiet
+            shown = sensors.snapshot()
+            hr_sample, power_sample = shown["heart_rate"], shown["power"]
+            target = workout.active.current() if workout.active else None
+            ghost_state = ghost.active.current() if ghost.active else None
+            w_balance = wbal.active.fraction() if wbal.active else None
+            state = frame_state(hr_sample and hr_sample.value, power_sample and power_sample.value, target,
+                                ghost_state, w_balance)
+            draw_frame(backend, view, state, governor.quality)
 
-    pygame.quit()
+            # Update display and tick clock
+            backend.present()
+            latency.frames.record(shown)
+            metrics.frames.observe(governor.end())
+            clock.tick(FPS)  # 30 FPS for smooth animation
+    finally:
+        sensors.subscribers.remove(chart.add)
 
-# Main ANT+ data acquisition function
 def main():
-    node = Node()
-    node.set_network_key(0x00, ANTPLUS_NETWORK_KEY)
-    
-    # Define devices
-    devices = [PowerMeter(node), HeartRate(node)]
-    
-    # Define device callbacks
-    def on_found(device):
-        print(f"Device {device} found and receiving")
-        
-    def on_device_data(page: int, page_name: str, data):
-        global power, heart_rate
-        if isinstance(data, HeartRateData):
-            heart_rate = data.heart_rate  # Update global heart_rate variable
-        elif isinstance(data, PowerData):
-            power = data.instantaneous_power  # Update global power variable
-    
-    # Assign callbacks to devices
-    for d in devices:
-        d.on_found = lambda d=d: on_found(d)
-        d.on_device_data = on_device_data
-
-    # Start the ANT+ node in a separate thread
-    ant_thread = threading.Thread(target=node.start)
-    ant_thread.start()
-
-    # Start the Pygame display loop
-    display_loop()
+    # The launcher shows a first frame, then loads assets and starts ANT+ in the background
+    launcher.launch(sys.modules[__name__])
 
 if __name__ == "__main__":
     main()
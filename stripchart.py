@@ -0,0 +1,95 @@
+import time
+from collections import deque
+
+import pygame
+
+
+class StripChart:
+    """Trend of the last few minutes of samples, one pixel column per time step.
+
+    Each tick scrolls the chart surface left in place and draws only the columns that
+    have come due since the last tick, so the cost of an update follows the number of new
+    columns and samples, not the length of the window.
+
+    `traces` maps a channel to (color, low, high): the line color and the values drawn at
+    the bottom and top edge. Register `add` with sensors.subscribers; it may be called from
+    the sensor thread, while `tick` and the drawing stay on the display thread.
+    """
+
+    def __init__(self, size, traces, seconds=180, background=(0, 0, 0, 140), hold=3.0, line_width=2):
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.width, self.height = size
+        self.traces = traces
+        self.period = seconds / self.width
+        self.background = background
+        self.hold = hold  # repeat the last value this long without samples, then leave a gap
+        self.line_width = line_width
+        self.surface.fill(background)
+
+        self._pending = deque()  # (channel, sample), appended by the sensor thread
+        self._column_start = None
+        self._sums = {channel: [0.0, 0] for channel in traces}
+        self._last = {channel: None for channel in traces}  # last sample seen
+        self._y = {channel: None for channel in traces}  # y of the newest drawn column
+
+    def add(self, channel, sample):
+        if channel in self.traces:
+            self._pending.append((channel, sample))
+
+    def clear(self):
+        self.surface.fill(self.background)
+        self._y = {channel: None for channel in self.traces}
+
+    def _value_y(self, channel, value):
+        _, low, high = self.traces[channel]
+        fraction = min(max((value - low) / (high - low), 0.0), 1.0)
+        return round((self.height - 1) * (1.0 - fraction))
+
+    def tick(self, now=None):
+        """Take in the new samples and draw the columns that came due; returns True if the surface changed."""
+        if now is None:
+            now = time.monotonic()
+        while self._pending:
+            channel, sample = self._pending.popleft()
+            total = self._sums[channel]
+            total[0] += sample.value
+            total[1] += 1
+            self._last[channel] = sample
+
+        if self._column_start is None:
+            self._column_start = now
+            return False
+        columns = int((now - self._column_start) / self.period)
+        if columns <= 0:
+            return False
+        self._column_start += columns * self.period
+
+        if columns >= self.width:
+            self.clear()
+            columns = 1
+        else:
+            self.surface.scroll(-columns, 0)
+            self.surface.fill(self.background, (self.width - columns, 0, columns, self.height))
+
+        # Everything that arrived since the last tick lands in the newest column; a tick that
+        # covers several columns (a slow frame) bridges them with one line segment
+        x = self.width - 1
+        for channel, (color, _, _) in self.traces.items():
+            total = self._sums[channel]
+            last = self._last[channel]
+            if total[1]:
+                value = total[0] / total[1]
+                total[0], total[1] = 0.0, 0
+            elif last is not None and now - last.time <= self.hold:
+                value = last.value
+            else:
+                self._y[channel] = None
+                continue
+            y = self._value_y(channel, value)
+            previous = self._y[channel]
+            if previous is None:
+                pygame.draw.line(self.surface, color, (x, y), (x, y), self.line_width)
+            else:
+                pygame.draw.line(self.surface, color, (x - columns, previous), (x, y), self.line_width)
+            self._y[channel] = y
+        return True
@@ -0,0 +1,189 @@
+import math
+import random
+import threading
+import time
+from collections import namedtuple
+
+import pages
+import sensors
+
+# Decoded page handed to the dispatcher, with the fields the sensors handlers read from
+# openant's FE data objects
+SimulatedPage = namedtuple("SimulatedPage", ["instantaneous_power", "cadence", "speed"])
+
+# FE-C command page numbers
+TARGET_POWER_PAGE = 0x31
+BASIC_RESISTANCE_PAGE = 0x30
+COMMAND_STATUS_PAGE = 0x47
+
+
+class TrainerSimulator:
+    """Smart trainer and rider model standing in for an FE-C trainer, for tuning without hardware.
+
+    The rider pushes on a flywheel (its inertia lumped into an equivalent mass) trying to hold
+    a preferred speed: a quick push back when the speed drops, on top of an effort that follows
+    the load only slowly, so a jump in brake force first costs cadence as on a real bike. The
+    trainer's brake either tracks a target power (ERG mode, through its own lagging
+    controller) or applies an eddy-current force proportional to resistance and speed.
+    Commands arrive after a radio delay and are confirmed with a command status page, and the
+    measured brake power is sent as FE-C pages 4 times a second through sensors.dispatcher,
+    the same way a real trainer's pages arrive.
+
+    It has the set_target_power and set_basic_resistance methods of openant's FitnessEquipment,
+    so an ErgController can drive either.
+    """
+
+    def __init__(self, mass=20.0, preferred_speed=9.0, rider_gain=40.0, rider_tau=1.5, max_force=600.0, loss_force=3.0,
+                 brake_tau=0.6, eddy_gain=12.3, radio_delay=0.12, page_period=0.25, noise=3.0,
+                 gear_ratio=50 / 17, wheel_circumference=sensors.WHEEL_CIRCUMFERENCE, rider_channels=True):
+        self.mass = mass  # equivalent flywheel mass, kg
+        self.preferred_speed = preferred_speed  # m/s the rider settles at without load
+        self.rider_gain = rider_gain  # N of extra pedal force per m/s below the preferred speed
+        self.rider_tau = rider_tau  # how quickly the rider's effort adapts to the load, s
+        self.max_force = max_force
+        self.loss_force = loss_force  # bearings and belt, N
+        self.brake_tau = brake_tau  # response time of the trainer's own ERG controller, s
+        self.eddy_gain = eddy_gain  # brake N per (m/s) at 100 % resistance
+        self.radio_delay = radio_delay
+        self.page_period = page_period
+        self.noise = noise  # W of measurement noise on the reported power
+        self.gear_ratio = gear_ratio
+        self.wheel_circumference = wheel_circumference
+        self.rider_channels = rider_channels  # also publish what a power meter and HR strap would see
+
+        self.speed = preferred_speed
+        self.brake_force = 0.0
+        self.rider_force = 0.0
+        self.effort = loss_force
+        self.rider_power = 0.0  # average over the last page period
+        self.measured_power = 0  # last reported brake power
+        self.heart_rate = 70.0
+        self.mode = "resistance"
+        self.target_power = 0.0
+        self.resistance = 0.0
+        self.commands = []  # (apply time, page, value), waiting out the radio delay
+        self.sequence = 0
+
+        self._time = 0.0
+        self._brake_energy = 0.0
+        self._rider_energy = 0.0
+        self._page_time = 0.0
+        self._event_count = 0
+        self._accumulated_power = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # Commands, as on openant's FitnessEquipment
+
+    def set_target_power(self, power):
+        with self._lock:
+            self.commands.append((self._time + self.radio_delay, TARGET_POWER_PAGE, float(power)))
+
+    def set_basic_resistance(self, resistance):
+        with self._lock:
+            self.commands.append((self._time + self.radio_delay, BASIC_RESISTANCE_PAGE, float(resistance)))
+
+    @property
+    def cadence(self):
+        return self.speed / self.wheel_circumference * 60 / self.gear_ratio
+
+    def step(self, dt):
+        """Advance the model by dt seconds; returns the FE-C pages due in that time as (page, payload)."""
+        with self._lock:
+            self._time += dt
+            due = [command for command in self.commands if command[0] <= self._time]
+            if due:
+                self.commands = [command for command in self.commands if command[0] > self._time]
+        out = []
+        for _, page, value in due:
+            if page == TARGET_POWER_PAGE:
+                self.mode, self.target_power = "erg", value
+            else:
+                self.mode, self.resistance = "resistance", value
+            self.sequence = (self.sequence + 1) & 0xFF
+            out.append((COMMAND_STATUS_PAGE, self._status_page(page, value)))
+
+        speed = max(self.speed, 0.1)
+        if self.mode == "erg":
+            goal = self.target_power / speed
+        else:
+            goal = self.eddy_gain * self.resistance / 100 * speed
+        self.brake_force += (goal - self.brake_force) * min(dt / self.brake_tau, 1.0)
+        self.effort += (self.brake_force + self.loss_force - self.effort) * min(dt / self.rider_tau, 1.0)
+        self.rider_force = min(max(self.effort + self.rider_gain * (self.preferred_speed - self.speed), 0.0),
+                               self.max_force)
+
+        # Flywheel: pedal force against brake and losses
+        self.speed += (self.rider_force - self.brake_force - self.loss_force) / self.mass * dt
+        self.speed = max(self.speed, 0.0)
+        self._brake_energy += self.brake_force * self.speed * dt
+        self._rider_energy += self.rider_force * self.speed * dt
+
+        # Heart rate drifts towards a level set by the rider's power
+        self.heart_rate += (60 + 0.35 * self.rider_force * self.speed - self.heart_rate) * min(dt / 30.0, 1.0)
+
+        if self._time - self._page_time >= self.page_period:
+            elapsed = self._time - self._page_time
+            self._page_time = self._time
+            power = self._brake_energy / elapsed
+            self._brake_energy = 0.0
+            self.rider_power = self._rider_energy / elapsed
+            self._rider_energy = 0.0
+            out.append((0x19, self._trainer_page(power)))
+            out.append((0x10, self._general_page()))
+        return out
+
+    def _status_page(self, page, value):
+        # Bytes 4-7 echo the command's data: target power as 0.25 W in bytes 6-7, basic
+        # resistance as 0.5 % in byte 7 after reserved bytes
+        if page == TARGET_POWER_PAGE:
+            raw = int(value * 4)
+            return [COMMAND_STATUS_PAGE, page, self.sequence, 0, 0xFF, 0xFF, raw & 0xFF, (raw >> 8) & 0xFF]
+        return [COMMAND_STATUS_PAGE, page, self.sequence, 0, 0xFF, 0xFF, 0xFF, int(value * 2) & 0xFF]
+
+    def _trainer_page(self, power):
+        measured = self.measured_power = max(0, min(int(round(power + random.gauss(0, self.noise))), 0xFFE))
+        self._event_count = (self._event_count + 1) & 0xFF
+        self._accumulated_power = (self._accumulated_power + measured) & 0xFFFF
+        return [0x19, self._event_count, int(self.cadence) & 0xFF, self._accumulated_power & 0xFF,
+                self._accumulated_power >> 8, measured & 0xFF, measured >> 8, 0]
+
+    def _general_page(self):
+        speed = min(int(self.speed * 1000), 0xFFFE)
+        return [0x10, 25, int(self._time * 4) & 0xFF, 0, speed & 0xFF, speed >> 8, 0xFF, 0x30]
+
+    def publish(self, out, received):
+        """Feed pages from step() into the sensors, as the ANT+ node would."""
+        for page, payload in out:
+            if sensors.recorder is not None:
+                sensors.recorder.record(pages.FITNESS_EQUIPMENT, payload, received)
+            if page != COMMAND_STATUS_PAGE:
+                data = SimulatedPage(self.measured_power, self.cadence, self.speed)
+                sensors.dispatcher.dispatch(pages.FITNESS_EQUIPMENT, page, "", data, received)
+            sensors.dispatcher.dispatch_raw(pages.FITNESS_EQUIPMENT, payload, received)
+            if page == 0x19 and self.rider_channels:
+                sensors.update("power", self.rider_power, received)
+                sensors.update("cadence", self.cadence, received)
+                sensors.update("heart_rate", self.heart_rate, received)
+
+    # Real-time thread
+
+    def start(self, step=0.01):
+        self._thread = threading.Thread(target=self._run, args=(step,), daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, step):
+        last = time.monotonic()
+        while not self._stop.wait(step):
+            now = time.monotonic()
+            # Sub-step long waits so a stalled thread does not destabilize the integration
+            elapsed = now - last
+            last = now
+            steps = max(1, math.ceil(elapsed / step))
+            for _ in range(steps):
+                self.publish(self.step(elapsed / steps), now)
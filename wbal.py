@@ -0,0 +1,163 @@
+import argparse
+import math
+import threading
+import time
+
+import numpy as np
+
+# A power sample is held this many seconds at most; a longer gap counts as 0 W, like coasting
+MAX_GAP = 5.0
+
+# The exponent range each vectorized block of balance_series may span, well inside float64
+_BLOCK_DECAY = 600.0
+
+# The W' balance the displays show, set by the launcher
+active = None
+
+
+class WPrimeBalance:
+    """W' balance of one rider from the live power samples, Skiba's differential model.
+
+    Above critical power `cp` (W) the rider spends W' (J) at P - CP; at or below it the deficit
+    recovers at a rate of (CP - P) / W' of itself. Each sample's power is held until the
+    next one and the model solved exactly over that step, so the result does not depend on
+    the sample rate, and an update is a few float operations.
+
+    Register `add` with sensors.subscribers. It may be called from the sensor thread while
+    `current` runs on the display thread.
+    """
+
+    def __init__(self, cp, w_prime, max_gap=MAX_GAP):
+        if cp <= 0 or w_prime <= 0:
+            raise ValueError("CP and W' must be positive")
+        self.cp = cp
+        self.w_prime = w_prime
+        self.max_gap = max_gap
+        self.minimum = w_prime
+        # Balance at the last sample and that sample's (power, time), replaced whole
+        self._state = (w_prime, None)
+        self._lock = threading.Lock()
+
+    def _advance(self, balance, power, held, coasted):
+        """Balance after `held` seconds at `power` and `coasted` more at 0 W."""
+        cp, w_prime = self.cp, self.w_prime
+        if power > cp:
+            balance -= (power - cp) * held
+            decay = cp * coasted
+        else:
+            decay = (cp - power) * held + cp * coasted
+        if decay:
+            balance = w_prime - (w_prime - balance) * math.exp(-decay / w_prime)
+        return balance
+
+    def _step_to(self, state, t):
+        balance, last = state
+        if last is None or t <= last[1]:
+            return balance
+        elapsed = t - last[1]
+        held = min(elapsed, self.max_gap)
+        return self._advance(balance, last[0], held, elapsed - held)
+
+    def update(self, power, t):
+        """Take one power sample in W at monotonic time t; returns the balance in J at t."""
+        with self._lock:
+            balance = self._step_to(self._state, t)
+            self._state = (balance, (power, t))
+            if balance < self.minimum:
+                self.minimum = balance
+        return balance
+
+    def add(self, channel, sample):
+        if channel == "power":
+            self.update(sample.value, sample.time)
+
+    def current(self, now=None):
+        """Balance in J now, the last sample's power held up to now."""
+        return self._step_to(self._state, time.monotonic() if now is None else now)
+
+    def fraction(self, now=None):
+        return self.current(now) / self.w_prime
+
+
+def balance_series(times, power, cp, w_prime, max_gap=MAX_GAP):
+    """W' balance in J at every sample of a recorded session, in one vectorized pass.
+
+    The same model and holding rule as WPrimeBalance, whose live updates it matches. Written
+    as the deficit D = W' - balance, every step is D <- e (D + c): c the work above CP, e the
+    recovery factor. Unrolled, D at sample k is exp(-L_k) times a cumulative sum of c_j exp(L_j),
+    L_j the sum of the recovery exponents of the steps before sample j. exp(L) would overflow
+    on a long ride, so the sums restart in blocks over which L grows by at most _BLOCK_DECAY.
+    NaN samples are skipped, as a replay skips them; they come out NaN.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    power = np.asarray(power, dtype=np.float64)
+    result = np.full(len(power), np.nan)
+    valid = ~np.isnan(power)
+    t, p = times[valid], power[valid]
+    if not len(p):
+        return result
+
+    elapsed = np.diff(t)
+    held = np.minimum(elapsed, max_gap)
+    coasted = elapsed - held
+    above = p[:-1] - cp
+    spent = np.maximum(above, 0.0) * held
+    decay = (np.maximum(-above, 0.0) * held + cp * coasted) / w_prime
+    # Recovery exponent summed before each sample, L[0] = 0
+    total = np.concatenate(([0.0], np.cumsum(decay)))
+
+    deficit = np.empty(len(p))
+    deficit[0] = 0.0
+    start = 0
+    while start < len(p) - 1:
+        # Samples start..end share one block; its steps are start..end-1
+        end = int(np.searchsorted(total, total[start] + _BLOCK_DECAY, side="right")) - 1
+        end = min(max(end, start + 1), len(p) - 1)
+        base = total[start]
+        # D_k = exp(-(L_k - L_s)) * (D_s + sum over s <= j < k of c_j exp(L_j - L_s))
+        weights = spent[start:end] * np.exp(total[start:end] - base)
+        deficit[start + 1:end + 1] = np.exp(base - total[start + 1:end + 1]) * (deficit[start] + np.cumsum(weights))
+        start = end
+    result[valid] = w_prime - deficit
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="W' balance over a recorded session")
+    parser.add_argument("session", help="FIT or CSV session file")
+    parser.add_argument("--cp", type=float, required=True, help="critical power in watts")
+    parser.add_argument("--w-prime", type=float, default=20000, help="W' in joules")
+    parser.add_argument("--csv", metavar="FILE", help="write time, power and W' balance to FILE")
+    args = parser.parse_args()
+
+    from sessions import load_session
+    session = load_session(args.session)
+    if "power" not in session.channels:
+        parser.error(f"{args.session} has no power")
+    start = time.perf_counter()
+    balance = balance_series(session.times, session.channels["power"], args.cp, args.w_prime)
+    elapsed = time.perf_counter() - start
+
+    valid = ~np.isnan(balance)
+    if not valid.any():
+        print("No power samples")
+        return
+    lowest = int(np.nanargmin(balance))
+    minutes, seconds = divmod(int(session.times[lowest]), 60)
+    print(f"{valid.sum()} power samples in {elapsed * 1000:.1f} ms")
+    print(f"Lowest W' balance {balance[lowest] / 1000:.1f} kJ ({balance[lowest] / args.w_prime:.0%}) "
+          f"at {minutes}:{seconds:02d}")
+    # Samples are not evenly spaced, so weigh each by the time until the next one
+    spans = np.diff(session.times[valid], append=session.times[valid][-1])
+    for level in (0.5, 0.25):
+        below = spans[balance[valid] < level * args.w_prime].sum()
+        print(f"  {below / 60:6.1f} min below {level:.0%}")
+    if args.csv:
+        with open(args.csv, "w") as f:
+            f.write("time,power,w_prime_balance\n")
+            for t, p, b in zip(session.times.tolist(), session.channels["power"].tolist(), balance.tolist()):
+                f.write(f"{t:g},{'' if p != p else f'{p:g}'},{'' if b != b else f'{b:.1f}'}\n")
+
+
+if __name__ == "__main__":
+    main()
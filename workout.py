@@ -0,0 +1,206 @@
+import bisect
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+# Half width of the target band as a fraction of the target, unless an interval sets its own
+DEFAULT_BAND = 0.05
+
+# Where a rider should be at one moment: target watts and the band around it, the interval it
+# comes from, seconds left in it and the next interval's starting target (None after the last)
+Target = namedtuple("Target", ["power", "low", "high", "index", "label", "remaining", "next_power"])
+
+# The workout the displays show, set by the launcher
+active = None
+
+
+class WorkoutError(ValueError):
+    pass
+
+
+class Timeline:
+    """A workout compiled to flat per-segment arrays, targets as fractions of FTP.
+
+    Repeats are unrolled once at compile time, so finding the segment for an elapsed time is
+    one bisect over the start times, and a ramp is one interpolation. The fractions are shared:
+    any number of riders follow the same timeline, each scaled by their own FTP.
+    """
+
+    def __init__(self, segments, name=""):
+        # segments: (duration, start fraction, end fraction, band, label); fraction None is free riding
+        self.name = name
+        self.starts = []
+        self.ends = []
+        self.start_power = []
+        self.end_power = []
+        self.bands = []
+        self.labels = []
+        t = 0.0
+        for duration, start_power, end_power, band, label in segments:
+            if duration <= 0:
+                raise WorkoutError(f"Interval {label or len(self.starts) + 1} has no duration")
+            self.starts.append(t)
+            t += duration
+            self.ends.append(t)
+            self.start_power.append(start_power)
+            self.end_power.append(end_power)
+            self.bands.append(band)
+            self.labels.append(label)
+        self.duration = t
+
+    def __len__(self):
+        return len(self.starts)
+
+    def index(self, elapsed):
+        """Segment at elapsed seconds, or None before the start and after the end."""
+        if elapsed < 0 or elapsed >= self.duration:
+            return None
+        return bisect.bisect_right(self.starts, elapsed) - 1
+
+    def fraction(self, index, elapsed):
+        start_power, end_power = self.start_power[index], self.end_power[index]
+        if start_power is None or start_power == end_power:
+            return start_power
+        start, end = self.starts[index], self.ends[index]
+        return start_power + (end_power - start_power) * (elapsed - start) / (end - start)
+
+    def at(self, elapsed, ftp=1.0):
+        """Target at elapsed seconds for a rider with this FTP; None outside the workout or free riding."""
+        return self.for_riders(elapsed, (ftp,))[0]
+
+    def for_riders(self, elapsed, ftps):
+        """Targets for several riders at once: one lookup, then one multiply per rider."""
+        index = self.index(elapsed)
+        if index is None:
+            return [None] * len(ftps)
+        fraction = self.fraction(index, elapsed)
+        if fraction is None:
+            return [None] * len(ftps)
+        band = self.bands[index]
+        next_fraction = self.start_power[index + 1] if index + 1 < len(self.starts) else None
+        remaining = self.ends[index] - elapsed
+        label = self.labels[index]
+        targets = []
+        for ftp in ftps:
+            power = fraction * ftp
+            targets.append(Target(power, power * (1 - band), power * (1 + band), index, label, remaining,
+                                  None if next_fraction is None else next_fraction * ftp))
+        return targets
+
+
+def _power(value, where):
+    if isinstance(value, (int, float)):
+        return float(value), float(value)
+    if isinstance(value, list) and len(value) == 2:
+        return float(value[0]), float(value[1])
+    raise WorkoutError(f"{where}: power must be a fraction of FTP or a [from, to] ramp, not {value!r}")
+
+
+def _unroll(intervals, band, segments, where="workout"):
+    for number, interval in enumerate(intervals, 1):
+        here = f"{where} interval {number}"
+        if "repeat" in interval:
+            for _ in range(int(interval["repeat"])):
+                _unroll(interval["intervals"], interval.get("band", band), segments, here)
+            continue
+        if "duration" not in interval:
+            raise WorkoutError(f"{here} has no duration")
+        if interval.get("power") is None:
+            start_power = end_power = None
+        else:
+            start_power, end_power = _power(interval["power"], here)
+        segments.append((float(interval["duration"]), start_power, end_power, interval.get("band", band),
+                         interval.get("label", "")))
+
+
+def compile_workout(definition):
+    """Compile a workout definition into a Timeline.
+
+    A definition is a dict with an "intervals" list. Each interval has a "duration" in seconds
+    and a "power" as a fraction of FTP: a number for a steady block, [from, to] for a ramp, or
+    null for free riding. {"repeat": n, "intervals": [...]} repeats a block. "band" (fraction
+    of the target) and "label" are optional on any interval.
+    """
+    segments = []
+    _unroll(definition.get("intervals", []), definition.get("band", DEFAULT_BAND), segments)
+    if not segments:
+        raise WorkoutError("Workout has no intervals")
+    return Timeline(segments, definition.get("name", ""))
+
+
+def _zwo_float(element, name):
+    try:
+        return float(element.attrib[name])
+    except (KeyError, ValueError):
+        raise WorkoutError(f"{element.tag} needs a numeric {name}")
+
+
+def parse_zwo(path):
+    """Read a Zwift .zwo workout into the definition format of compile_workout."""
+    root = ET.parse(path).getroot()
+    workout = root.find("workout")
+    if workout is None:
+        raise WorkoutError(f"{path} has no <workout> element")
+    intervals = []
+    for element in workout:
+        tag = element.tag
+        duration = _zwo_float(element, "Duration") if tag != "IntervalsT" else None
+        if tag == "SteadyState":
+            intervals.append({"duration": duration, "power": _zwo_float(element, "Power"), "label": tag})
+        elif tag in ("Warmup", "Cooldown", "Ramp"):
+            intervals.append({"duration": duration, "label": tag,
+                              "power": [_zwo_float(element, "PowerLow"), _zwo_float(element, "PowerHigh")]})
+        elif tag == "IntervalsT":
+            intervals.append({"repeat": int(_zwo_float(element, "Repeat")), "intervals": [
+                {"duration": _zwo_float(element, "OnDuration"), "power": _zwo_float(element, "OnPower"), "label": "On"},
+                {"duration": _zwo_float(element, "OffDuration"), "power": _zwo_float(element, "OffPower"),
+                 "label": "Off"},
+            ]})
+        elif tag in ("FreeRide", "Freeride"):
+            intervals.append({"duration": duration, "power": None, "label": "Free ride"})
+        else:
+            raise WorkoutError(f"Unsupported .zwo element {tag}")
+    name = root.findtext("name", default="")
+    return {"name": name, "intervals": intervals}
+
+
+def load_workout(path):
+    """Load and compile a JSON or Zwift .zwo workout, picked by file extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".json":
+        with open(path) as f:
+            return compile_workout(json.load(f))
+    if extension == ".zwo":
+        return compile_workout(parse_zwo(path))
+    raise ValueError(f"Unsupported workout file {path}, expected .json or .zwo")
+
+
+class WorkoutSession:
+    """One rider following a timeline, on the time.monotonic() clock."""
+
+    def __init__(self, timeline, ftp, start=None):
+        self.timeline = timeline
+        self.ftp = ftp
+        self.start_time = start
+
+    def start(self, now=None):
+        self.start_time = time.monotonic() if now is None else now
+
+    def elapsed(self, now=None):
+        if self.start_time is None:
+            return None
+        return (time.monotonic() if now is None else now) - self.start_time
+
+    def current(self, now=None):
+        """This rider's Target now, None before the start, after the end or while free riding."""
+        elapsed = self.elapsed(now)
+        if elapsed is None:
+            return None
+        return self.timeline.at(elapsed, self.ftp)
+
+    def target_power(self, now=None):
+        """Watts to hold now, 0 when there is no target; an ErgController target source."""
+        target = self.current(now)
+        return 0.0 if target is None else target.power
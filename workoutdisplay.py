@@ -4,9 +4,14 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from matplotlib.figure import Figure
 import datetime as dt
+import os
 import random
 import time
 
+import resample
+import samplebus
+import sensors
+
 class RealTimePlotApp:
     def __init__(self, root):
         self.root = root
@@ -43,14 +48,18 @@ class RealTimePlotApp:
     def update_plot(self):
         current_time = dt.datetime.now()
         
-        # Generate random data for simulation
-        power = random.randint(100, 300)  # Replace with actual power data
-        heart_rate = random.randint(60, 180)  # Replace with actual heart rate data
-        
-        # Update data lists
-        self.times.append(current_time)
-        self.power_data.append(power)
-        self.hr_data.append(heart_rate)
+        if resampler:
+            # Rows due since the last update, both channels on the same grid times, NaN in gaps
+            grid, values = resampler.rows()
+            now = time.monotonic()
+            self.times.extend(current_time - dt.timedelta(seconds=now - t) for t in grid.tolist())
+            self.power_data.extend(values["power"].tolist())
+            self.hr_data.extend(values["heart_rate"].tolist())
+        else:
+            # Generate random data for simulation
+            self.times.append(current_time)
+            self.power_data.append(random.randint(100, 300))
+            self.hr_data.append(random.randint(60, 180))
         
         # Keep data for the last 5 minutes (300 seconds)
         while self.times and (current_time - self.times[0]).total_seconds() > 300:
@@ -79,6 +88,16 @@ class RealTimePlotApp:
         self.root.after(1000, self.update_plot)  # Update every second
 
 # Main
+# With WORKOUT_DISPLAY_SAMPLE_BUS set, plot the sensors samplebus.py publishes, resampled to one
+# row a second by WORKOUT_DISPLAY_RESAMPLE (hold, linear or mean, default mean); otherwise random data
+source = resampler = None
+bus = os.environ.get(samplebus.BUS_ENV_VAR)
+if bus:
+    resampler = resample.Resampler(1.0, os.environ.get(resample.RESAMPLE_ENV_VAR, "mean"))
+    sensors.subscribers.append(resampler.add)
+    source = samplebus.BusSource(bus)
+    source.start()
+
 root = tk.Tk()
 app = RealTimePlotApp(root)
 root.mainloop()